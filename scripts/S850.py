@@ -6,27 +6,27 @@ Number counts
 """
 
 
-import caesar
 import sys
 import os
 import matplotlib.pyplot as plt
 import numpy as np
+from catalogs import catalog_table
 
 # define input file
 infile = '/mnt/ceph/users/daisyleung/simba/sim/m50n1024/s50/Groups/m50n1024_036.hdf5'
 
-# load in input file
-sim = caesar.load(infile,LoadHalo=False)
-mlim = 64*sim.simulation.critical_density.value*sim.simulation.boxsize.value**3*sim.simulation.omega_matter/sim.simulation.effective_resolution**3 # galaxy mass resolution limit in DM particle mass
+# load in input file, as flat columns (see catalogtable.py)
+sim = catalog_table(infile)
+mlim = 64*sim.simulation.critical_density*sim.simulation.boxsize**3*sim.simulation.omega_matter/sim.simulation.effective_resolution**3 # galaxy mass resolution limit in DM particle mass
 redshift = sim.simulation.redshift
 
-ids = np.asarray([i.GroupID for i in sim.galaxies])
-ms = np.asarray([i.masses['stellar'] for i in sim.galaxies])
-mHI = np.asarray([i.masses['HI'] for i in sim.galaxies])
-mdust = np.asarray([i.masses['dust'] for i in sim.galaxies])
-mbh = np.asarray([i.masses['bh'] for i in sim.galaxies])
-sfr = np.asarray([i.sfr for i in sim.galaxies])
-met = np.asarray([i.metallicities['sfr_weighted'] for i in sim.galaxies])
+ids = sim.galaxies['GroupID']
+ms = sim.galaxies['masses.stellar']
+mHI = sim.galaxies['masses.HI']
+mdust = sim.galaxies['masses.dust']
+mbh = sim.galaxies['masses.bh']
+sfr = sim.galaxies['sfr']
+met = sim.galaxies['metallicities.sfr_weighted']
 
 S850 = 0.81 * ((sfr+1.e-6)/100)**0.43 * (mdust/1.e8)**0.54  # Hayward+11 fit to iso sims+Sunrise
 
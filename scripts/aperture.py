@@ -0,0 +1,123 @@
+"""
+
+Sums of particle properties inside apertures around many galaxies at once.
+
+The particles of all galaxies are concatenated (see galindex.MemberIndex), their distances to the galaxy centre are computed once and every aperture and weight is summed with one segmented reduction, instead of computing the distances again for each galaxy and quantity as calc_SFRSD_inside_half_mass() and calc_gasSD_inside_half_mass() in yt2caesar.py did.
+
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+
+def galaxy_radii(galaxies, names=('gas', 'gas_half_mass', 'stellar_half_mass')):
+    """
+
+    Parameters
+    ----------
+    galaxies: list
+        caesar galaxy objects
+
+    names: sequence of str
+        keys of gal.radii
+
+    Returns
+    -------
+    radii: array
+        (ngalaxies, len(names)) in kpc
+
+    """
+
+    from galcatalog import strip_units
+
+    radii = np.empty((len(galaxies), len(names)))
+    for j, name in enumerate(names):
+        radii[:, j] = strip_units([gal.radii[name] for gal in galaxies], 'kpc')
+    return radii
+
+
+def aperture_sums(pos, offsets, radii, weights, projection=None):
+    """
+
+    Sum weights over the particles inside each aperture of each galaxy.
+
+    Parameters
+    ----------
+    pos: array
+        (N, 3) positions relative to the galaxy centre, galaxy i owning rows offsets[i]:offsets[i+1]
+
+    offsets: array of int
+
+    radii: array
+        (ngalaxies,) or (ngalaxies, napertures), in the units of pos; a particle is inside if its distance is <= the radius
+
+    weights: dict
+        name --> (N,) array, e.g. {'SFR': gas_SFR, 'm': gas_m}
+
+    projection: int or None
+        None for spheres, otherwise the line-of-sight axis (e.g. 2 for face-on after the caesar rotation) and apertures are circles in the other two axes
+
+    Returns
+    -------
+    sums: dict
+        name --> array of the shape of radii
+
+    """
+
+    from galindex import segment_reduce
+
+    pos = np.asarray(pos)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    radii = np.asarray(radii, dtype=np.float64)
+    shape = radii.shape
+    radii = radii[:, None] if radii.ndim == 1 else radii
+
+    axes = [k for k in range(3) if k != projection]
+    extent = np.sqrt(np.sum(pos[:, axes]**2, axis=1))
+
+    names = list(weights)
+    W = np.column_stack([np.asarray(weights[k], dtype=np.float64) for k in names]) if names else np.empty((len(pos), 0))
+    counts = np.diff(offsets)
+
+    sums = np.empty((len(names),) + radii.shape)
+    for j in range(radii.shape[1]):
+        inside = extent <= np.repeat(radii[:, j], counts)
+        sums[:, :, j] = segment_reduce(np.add, W * inside[:, None], offsets).T
+    return {k: sums[i].reshape(shape) for i, k in enumerate(names)}
+
+
+def surface_densities(galaxies, pos, offsets, gas_SFR, gas_m, projection=None):
+    """
+
+    Catalog SFR and gas mass surface densities: SFR inside gal.radii['gas'] and gas mass inside gal.radii['gas_half_mass'], divided by the area of the aperture.
+
+    Parameters
+    ----------
+    galaxies: list
+        caesar galaxy objects, galaxy i owning the gas particles offsets[i]:offsets[i+1]
+
+    pos: array
+        (N, 3) gas positions relative to the galaxy centre in physical kpc
+
+    gas_SFR, gas_m: array
+        Msun/yr and Msun
+
+    projection: int or None
+        see aperture_sums()
+
+    Returns
+    -------
+    SFRSD: array
+        Msun/yr/kpc^2
+
+    gasSD: array
+        Msun/pc^2
+
+    """
+
+    radii = galaxy_radii(galaxies, names=('gas', 'gas_half_mass'))
+    sums = aperture_sums(pos, offsets, radii, {'SFR': gas_SFR, 'm': gas_m}, projection=projection)
+
+    SFRSD = sums['SFR'][:, 0] / np.pi/radii[:, 0]**2
+    gasSD = sums['m'][:, 1] / np.pi/(radii[:, 1]*1.e3)**2
+    return SFRSD, gasSD
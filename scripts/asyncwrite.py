@@ -0,0 +1,97 @@
+"""
+
+Write finished galaxies in background threads while the next galaxy is being extracted.
+
+Writing DataFrames is mostly waiting on the filesystem (pickle.dump and write() release the GIL), so a few threads are enough to hide it behind the extraction. Jobs wait in a bounded queue; submit() blocks while the DataFrames waiting to be written exceed a memory budget, so a slow filesystem slows the extraction down instead of filling up memory.
+
+"""
+
+from __future__ import print_function, division
+import threading
+import traceback
+import queue
+
+
+class AsyncWriter(object):
+
+    def __init__(self, nthreads=1, maxbytes=1.e9):
+        """
+
+        Parameters
+        ----------
+        nthreads: int
+            number of writer threads
+
+        maxbytes: float
+            memory budget of the jobs submitted but not yet written. A single job larger than that is still accepted once the queue is empty.
+
+        """
+        self.maxbytes = maxbytes
+        self.pending = 0
+        self.errors = []
+        self._cond = threading.Condition()
+        self._queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(nthreads)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn, *args, nbytes=0, name=None):
+        """
+
+        Queue fn(*args) for a writer thread.
+
+        Parameters
+        ----------
+        nbytes: int
+            memory held by args until the job is done, see frames_nbytes()
+
+        name: str
+            to identify the job in errors, e.g. galname
+
+        """
+
+        with self._cond:
+            while self.pending > 0 and self.pending + nbytes > self.maxbytes:
+                self._cond.wait()
+            self.pending += nbytes
+        self._queue.put((fn, args, nbytes, name))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            fn, args, nbytes, name = job
+            try:
+                fn(*args)
+            except Exception as e:
+                # keep writing the other galaxies, report at the end
+                self.errors.append((name, e, traceback.format_exc()))
+            finally:
+                # drop the DataFrames before waiting for the next job
+                job = fn = args = None
+                with self._cond:
+                    self.pending -= nbytes
+                    self._cond.notify_all()
+
+    def close(self):
+        """
+
+        Wait until every submitted job is written.
+
+        Returns
+        -------
+        errors: list of tuple
+            (name, exception, traceback) of each failed job
+
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        return self.errors
+
+
+def frames_nbytes(frames):
+    """ memory of a dict of DataFrames, e.g. {'gas': simgas, 'star': simstar, 'dm': simdm} """
+    return int(sum(df.memory_usage(index=True).sum() for df in frames.values()))
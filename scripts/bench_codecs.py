@@ -0,0 +1,122 @@
+"""
+
+Compression ratio and write/read throughput of the GalaxyStore codecs (see galstore.CODECS) on extracted galaxies.
+
+Usage
+-----
+python bench_codecs.py <store.hdf5 or directory of .gas/.star/.dm pickles> [ngal] [codec ...]
+
+Every codec writes the same galaxies to a temporary store, which is then read back galaxy by galaxy as SIGAME would. Codecs that need hdf5plugin are skipped if it is not installed.
+
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import time
+import tempfile
+
+
+def load_galaxies(source, ngal=None):
+    """
+
+    Parameters
+    ----------
+    source: str
+        a GalaxyStore file or a directory of .gas, .star, .dm pickles (particles2pd.main_proc() output)
+
+    ngal: int or None
+        only the first ngal galaxies
+
+    Returns
+    -------
+    galaxies: list of tuple
+        (galname, {'gas': df, 'star': df, 'dm': df})
+
+    schema: str
+        of the store, 'full' for pickles
+
+    """
+
+    import pandas as pd
+    from galstore import GalaxyStore, PTYPES
+
+    if os.path.isdir(source):
+        names = sorted(f[:-4] for f in os.listdir(source) if f.endswith('.gas'))[:ngal]
+        return [(name, {ptype: pd.read_pickle(os.path.join(source, name + '.' + ptype)) for ptype in PTYPES}) for name in names], 'full'
+
+    with GalaxyStore(source) as store:
+        return [(name, {ptype: store.galaxy(name, ptype) for ptype in PTYPES}) for name in store.galnames[:ngal]], store.schema
+
+
+def benchmark(galaxies, codecs, schema='full', tmpdir=None):
+    """
+
+    Parameters
+    ----------
+    galaxies: list of tuple
+        see load_galaxies()
+
+    codecs: list
+        keys of galstore.CODECS, None for no compression
+
+    schema: str
+        of the stores written, see schema.py
+
+    tmpdir: str or None
+        where to write the stores, e.g. on the shared filesystem to include its speed
+
+    Returns
+    -------
+    results: list of dict
+        codec, ratio (uncompressed / compressed size), write_MBs, read_MBs (of uncompressed data) and size_MB
+
+    """
+
+    from galstore import GalaxyStore, PTYPES
+
+    nbytes = sum(df.memory_usage(index=False).sum() for _, frames in galaxies for df in frames.values())
+    results = []
+    for codec in codecs:
+        fd, path = tempfile.mkstemp(suffix='.hdf5', dir=tmpdir)
+        os.close(fd)
+        try:
+            t0 = time.time()
+            with GalaxyStore(path, mode='w', schema=schema, compression=codec) as store:
+                for name, frames in galaxies:
+                    store.append(name, frames)
+            t1 = time.time()
+            with GalaxyStore(path) as store:
+                for name, _ in galaxies:
+                    for ptype in PTYPES:
+                        store.galaxy(name, ptype)
+            t2 = time.time()
+            size = os.path.getsize(path)
+        except ValueError as e:
+            print("Skipping {:}: {:}".format(codec, e))
+            continue
+        finally:
+            os.remove(path)
+        results.append({'codec': codec or 'none', 'ratio': nbytes / size,
+                        'write_MBs': nbytes / 1e6 / (t1 - t0), 'read_MBs': nbytes / 1e6 / (t2 - t1),
+                        'size_MB': size / 1e6})
+    return results
+
+
+if __name__ == '__main__':
+
+    from galstore import CODECS
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    source = sys.argv[1]
+    ngal = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    codecs = sys.argv[3:] or [None] + sorted(CODECS)
+
+    galaxies, schema = load_galaxies(source, ngal)
+    nbytes = sum(df.memory_usage(index=False).sum() for _, frames in galaxies for df in frames.values())
+    print("{:} galaxies, {:.1f} MB of particle columns, schema {:}".format(len(galaxies), nbytes / 1e6, schema))
+    print("{:12s} {:>8s} {:>10s} {:>12s} {:>12s}".format('codec', 'ratio', 'size [MB]', 'write [MB/s]', 'read [MB/s]'))
+    for r in benchmark(galaxies, [None if c == 'none' else c for c in codecs], schema=schema):
+        print("{:12s} {:8.2f} {:10.2f} {:12.1f} {:12.1f}".format(r['codec'], r['ratio'], r['size_MB'], r['write_MBs'], r['read_MBs']))
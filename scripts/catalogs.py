@@ -0,0 +1,142 @@
+"""
+
+Process-wide registry of loaded caesar catalogs, so that scripts run in one interpreter load each catalog once.
+
+caesar_catalog() and catalog_table() return the same object for the same file every time it is asked for, until it is evicted. The least recently used catalogs are dropped once the catalogs held take more than the memory limit (set_memory_limit()). The size of a caesar obj is estimated from its file size, see CAESAR_MEMORY_FACTOR.
+
+A catalog loaded with LoadHalo=True also serves requests with LoadHalo=False.
+
+"""
+
+from __future__ import print_function, division
+import os
+import threading
+from collections import OrderedDict
+
+
+# memory of a loaded caesar obj per byte of its hdf5 file, roughly
+CAESAR_MEMORY_FACTOR = 3.
+
+
+class CatalogRegistry(object):
+
+    def __init__(self, maxGB=16.):
+        """
+
+        Parameters
+        ----------
+        maxGB: float
+            catalogs are evicted, least recently used first, while the catalogs held take more than this; the catalog just loaded is always kept
+
+        """
+        self.maxGB = maxGB
+        self._entries = OrderedDict()      # key --> (obj, nbytes), least recently used first
+        # callers may share the registry between threads
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        return sum(nb for obj, nb in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, load, nbytes):
+        """
+
+        Parameters
+        ----------
+        key: tuple
+            identifies the catalog, e.g. ('caesar', path, LoadHalo)
+
+        load: callable
+            load() returns the catalog if it is not held yet
+
+        nbytes: callable
+            nbytes(obj) estimates the memory of the catalog
+
+        Returns
+        -------
+        obj: the shared catalog
+
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            obj = load()
+            self._entries[key] = (obj, nbytes(obj))
+            self._evict(keep=key)
+            return obj
+
+    def _evict(self, keep):
+        while len(self._entries) > 1 and self.nbytes > self.maxGB * 1e9:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            print("Dropping catalog {:} from memory".format(key[1]))
+            del self._entries[key]
+
+    def drop(self, path=None):
+        """ forget the catalogs of path, or all catalogs if None """
+        with self._lock:
+            for key in list(self._entries):
+                if path is None or key[1] == os.path.abspath(path):
+                    del self._entries[key]
+
+
+REGISTRY = CatalogRegistry()
+
+
+def set_memory_limit(GB):
+    """ memory limit of the process-wide registry """
+    REGISTRY.maxGB = GB
+    with REGISTRY._lock:
+        REGISTRY._evict(keep=None)
+
+
+def caesar_catalog(path, LoadHalo=True, keep=True):
+    """
+
+    caesar.load(path, LoadHalo=LoadHalo), loaded once per process.
+
+    Parameters
+    ----------
+    keep: bool
+        False to load the catalog without adding it to the registry, if it isn't held already, e.g. to build its catalog table once (see catalogtable.py)
+
+    Returns
+    -------
+    obj: caesar obj
+        shared with every other caller; don't modify it (e.g. sort its galaxies) without copying
+
+    """
+
+    path = os.path.abspath(path)
+
+    def load():
+        import caesar
+        print("Loading Ceasar file: {:}".format(path))
+        return caesar.load(path, LoadHalo=LoadHalo)
+
+    with REGISTRY._lock:
+        if not LoadHalo and ('caesar', path, True) in REGISTRY:
+            return REGISTRY.get(('caesar', path, True), load, None)
+        if not keep and ('caesar', path, LoadHalo) not in REGISTRY:
+            return load()
+        return REGISTRY.get(('caesar', path, LoadHalo), load, lambda obj: os.path.getsize(path) * CAESAR_MEMORY_FACTOR)
+
+
+def catalog_table(path):
+    """ catalogtable.load_catalog_table(path), loaded once per process """
+    from catalogtable import load_catalog_table
+
+    def nbytes(table):
+        return sum(a.nbytes for cols in (table.galaxies, table.halos) for a in cols.values())
+
+    path = os.path.abspath(path)
+    return REGISTRY.get(('table', path), lambda: load_catalog_table(path), nbytes)
@@ -0,0 +1,207 @@
+"""
+
+Flat, memory-mapped copy of a caesar catalog, for analysis scripts that only need galaxy and halo properties.
+
+caesar.load() builds a Python object per galaxy and halo, and scripts then loop over them again to make arrays. Here every property is flattened once into one .npy file per column, units stripped, next to the caesar file:
+
+    <caesar file without .hdf5>_table/galaxies.<column>.npy
+    <caesar file without .hdf5>_table/halos.<column>.npy
+    <caesar file without .hdf5>_table/meta.json     units of the columns and the simulation attributes
+
+Column names follow caesar, e.g. 'masses.stellar' for gal.masses['stellar'], 'pos' for gal.pos; halos also have 'ngalaxies', the length of their galaxy_index_list. load_catalog_table() memory-maps the columns, so loading takes milliseconds. The table is rebuilt (from catalogs.caesar_catalog(keep=False)) when the caesar file is newer, as for the membership index (galindex.py).
+
+"""
+
+from __future__ import print_function, division
+import os
+import json
+import shutil
+import numpy as np
+
+
+GALAXY_COLUMNS = ['GroupID', 'masses.stellar', 'masses.gas', 'masses.HI', 'masses.H2', 'masses.dust', 'masses.bh', 'masses.total',
+                  'radii.gas', 'radii.stellar', 'radii.gas_half_mass', 'radii.stellar_half_mass', 'radii.total',
+                  'metallicities.sfr_weighted', 'metallicities.mass_weighted', 'metallicities.stellar',
+                  'sfr', 'gas_fraction', 'pos', 'vel', 'central', 'parent_halo_index']
+
+HALO_COLUMNS = ['GroupID', 'masses.total', 'masses.virial', 'masses.stellar', 'masses.gas', 'masses.dm',
+                'radii.virial', 'radii.total', 'pos', 'vel', 'central_galaxy_index']
+
+SIMULATION_ATTRS = ['redshift', 'scale_factor', 'time', 'hubble_constant', 'omega_matter', 'omega_baryon', 'omega_lambda',
+                    'boxsize', 'critical_density', 'effective_resolution']
+
+
+class CatalogTable(object):
+
+    def __init__(self, galaxies, halos, simulation, units):
+        """
+
+        Parameters
+        ----------
+        galaxies, halos: dict
+            column --> array, one row per galaxy or halo in the order of obj.galaxies and obj.halos
+
+        simulation: dict
+            obj.simulation attributes as plain numbers, plus 'boxsize_Mpccm'
+
+        units: dict
+            'galaxies', 'halos', 'simulation' --> column --> unit string ('' for plain numbers)
+
+        """
+        self.galaxies = galaxies
+        self.halos = halos
+        self.units = units
+        self.simulation = _Attributes(simulation)
+
+    @property
+    def ngalaxies(self):
+        return len(self.galaxies['GroupID'])
+
+    @property
+    def nhalos(self):
+        return len(self.halos['GroupID']) if 'GroupID' in self.halos else 0
+
+
+class _Attributes(dict):
+    """ dict whose keys are also attributes, e.g. table.simulation.redshift """
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def table_dir(caesarFile):
+    """ directory of the table of caesarFile """
+    return os.path.splitext(caesarFile)[0] + '_table'
+
+
+def _property(obj, column):
+    # 'masses.stellar' --> obj.masses['stellar']
+    name, _, key = column.partition('.')
+    value = getattr(obj, name)
+    return value[key] if key else value
+
+
+def _flatten(objs, columns):
+    """ column --> (array, unit) for the columns every object has """
+    from galcatalog import strip_units
+
+    out = {}
+    for column in columns:
+        try:
+            values = [_property(o, column) for o in objs]
+        except (AttributeError, KeyError, TypeError):
+            print("Catalog has no {:}, skipping column".format(column))
+            continue
+        units = getattr(values[0], 'units', None) if len(values) else None
+        unit = '' if units is None else str(units)
+        if len(values) and np.ndim(values[0]) > 0:
+            # vectors, e.g. pos; strip_units() is for scalars
+            arr = np.array([np.asarray(getattr(v, 'd', v), dtype=np.float64) for v in values]).reshape(len(values), -1)
+        elif unit:
+            arr = strip_units(values, unit)
+        else:
+            arr = np.array([-1 if v is None else v for v in values])
+        out[column] = (arr, unit)
+    return out
+
+
+def flatten_catalog(obj):
+    """
+
+    Parameters
+    ----------
+    obj: caesar obj
+
+    Returns
+    -------
+    table: CatalogTable
+        in memory
+
+    """
+
+    galaxies = _flatten(obj.galaxies, GALAXY_COLUMNS)
+    halolist = getattr(obj, 'halos', None) or []
+    halos = _flatten(halolist, HALO_COLUMNS)
+    if len(halolist) and hasattr(halolist[0], 'galaxy_index_list'):
+        halos['ngalaxies'] = (np.array([len(h.galaxy_index_list) for h in halolist], dtype=np.int64), '')
+
+    simulation, simunits = {}, {}
+    for name in SIMULATION_ATTRS:
+        value = getattr(obj.simulation, name, None)
+        if value is None:
+            continue
+        simulation[name] = float(getattr(value, 'd', value))
+        simunits[name] = str(getattr(value, 'units', ''))
+    simulation['boxsize_Mpccm'] = float(obj.simulation.boxsize.to('Mpccm').d)
+    simunits['boxsize_Mpccm'] = 'Mpccm'
+
+    units = {'galaxies': {k: u for k, (a, u) in galaxies.items()},
+             'halos': {k: u for k, (a, u) in halos.items()},
+             'simulation': simunits}
+    return CatalogTable({k: a for k, (a, u) in galaxies.items()}, {k: a for k, (a, u) in halos.items()}, simulation, units)
+
+
+def save_catalog_table(table, caesarFile):
+    """ write table next to caesarFile, replacing an older one; written to a temp directory first, so a half-written table is never picked up """
+    path = table_dir(caesarFile)
+    tmp = '{:}.{:}.tmp'.format(path, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for kind in ('galaxies', 'halos'):
+        for column, arr in getattr(table, kind).items():
+            np.save(os.path.join(tmp, '{:}.{:}.npy'.format(kind, column)), arr)
+    meta = {'galaxies': list(table.galaxies), 'halos': list(table.halos),
+            'simulation': dict(table.simulation), 'units': table.units}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def load_catalog_table(caesarFile, obj=None, mmap=True):
+    """
+
+    Load the flat table of a caesar catalog, building and saving it on first use.
+
+    Parameters
+    ----------
+    caesarFile: str
+        path to caesar .hdf5
+
+    obj: caesar obj or None
+        used to build the table if it doesn't exist yet; loaded with catalogs.caesar_catalog(keep=False) if None, so building the table doesn't keep the caesar obj in memory
+
+    mmap: bool
+        memory-map the columns instead of reading them into memory
+
+    Returns
+    -------
+    table: CatalogTable
+
+    """
+
+    path = table_dir(caesarFile)
+    fmeta = os.path.join(path, 'meta.json')
+    if os.path.exists(fmeta) and os.path.getmtime(fmeta) >= os.path.getmtime(caesarFile):
+        with open(fmeta) as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        cols = {kind: {column: np.load(os.path.join(path, '{:}.{:}.npy'.format(kind, column)), mmap_mode=mode) for column in meta[kind]}
+                for kind in ('galaxies', 'halos')}
+        return CatalogTable(cols['galaxies'], cols['halos'], meta['simulation'], meta['units'])
+
+    if obj is None:
+        from catalogs import caesar_catalog
+        # not kept in the registry, the table replaces it
+        obj = caesar_catalog(caesarFile, keep=False)
+
+    print("Building catalog table of {:}".format(caesarFile))
+    table = flatten_catalog(obj)
+    try:
+        save_catalog_table(table, caesarFile)
+    except (IOError, OSError) as e:
+        # e.g. no write permission in the simulation directory; keep the table in memory
+        print("Could not save catalog table: {:}".format(e))
+    return table
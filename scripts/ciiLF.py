@@ -58,8 +58,8 @@ def get_vol(caesarfile = '/mnt/ceph/users/daisyleung/simba/sim/m50n1024/s50/Grou
     """
     Ran on Rusty, where the caesar file is, and caesar is installed
     """
-    import caesar      # module purge; module load gcc python3
-    bubu = caesar.load(caesarfile, LoadHalo=False)
+    from catalogs import caesar_catalog      # module purge; module load gcc python3
+    bubu = caesar_catalog(caesarfile, LoadHalo=False)
     volume = bubu.simulation.boxsize.to('Mpccm').d**3
     print(volume)
     return volume
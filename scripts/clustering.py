@@ -52,18 +52,18 @@ import matplotlib.pyplot as plt
 from astropy.cosmology import FlatLambdaCDM
 
 # read in data
-import caesar
+from catalogs import catalog_table
 nn = 'm50n1024'
 # nn = 'm100n1024'
 # nn = 'm25n1024'
 
 infile = '/mnt/ceph/users/daisyleung/simba/sim/' + nn + '/s50/Groups/' + nn + '_036.hdf5'
-sim = caesar.load(infile)  # load caesar file
-mlim = 64 * sim.simulation.critical_density.value * sim.simulation.boxsize.value**3 * \
+sim = catalog_table(infile)  # caesar file as flat columns, see catalogtable.py
+mlim = 64 * sim.simulation.critical_density * sim.simulation.boxsize**3 * \
     sim.simulation.omega_matter / \
     sim.simulation.effective_resolution**3  # galaxy mass resolution limit in DM particle
 
-boxsize = sim.simulation.boxsize.to('Mpccm').d
+boxsize = sim.simulation.boxsize_Mpccm
 vol_mpc = boxsize**3
 cosmo = FlatLambdaCDM(H0=100 * sim.simulation.hubble_constant,
                       Om0=sim.simulation.omega_matter, Ob0=sim.simulation.omega_baryon, Tcmb0=2.73)
@@ -124,7 +124,7 @@ from halotools.mock_observables import tpcf_one_two_halo_decomp
 # TPCF (r, m, z), where z fixed at z=6, we take m as the median of all gal
 # sample centered on what stellar mass range
 plt.figure()
-mstar = np.array([g.masses['stellar'] for g in sim.galaxies])
+mstar = np.array(sim.galaxies['masses.stellar'])
 plt.hist(mstar, bins=100)
 plt.title('median: {:.1f}E8 Msun; delta: {:.1f}E10 Msun'.format(np.median(mstar)/1.e8, (mstar.max() - mstar.min())/1.e10))
 plt.xscale('log')
@@ -133,7 +133,7 @@ plt.savefig('mstar_dist' + nn + '.pdf', bbox_inches='tight')
 # import sys; sys.exit()
 
 # ACF
-galpos = np.array([g.pos.d for g in sim.galaxies])/1.e3      # cMpc/h
+galpos = np.array(sim.galaxies['pos'])/1.e3      # cMpc/h
 #  the real space radial bins in which pairs are counted
 rsize = 15
 rbins = np.logspace(-1, 1.25, rsize)                      # cMpc/h
@@ -231,13 +231,10 @@ plt.savefig('halo_jackknife_' + nn + '.pdf', bbox_inches='tight')
 
 # input array of host halo IDs that are equal for galaxies occupying the
 # same halo
-group_list = sim.galaxies
-phid = []
-for ii, o in enumerate(group_list):
-    if o.halo is not None:
-        phid.append(o.halo.GroupID)
-    else:
-        import pdb; pdb.set_trace()
+parent = sim.galaxies['parent_halo_index']
+if (parent < 0).any():
+    import pdb; pdb.set_trace()
+phid = sim.halos['GroupID'][parent]
 
 print(len(galpos), len(phid))
 xi_1h, xi_2h = tpcf_one_two_halo_decomp(galpos,
@@ -0,0 +1,77 @@
+"""
+
+Cosmic time and stellar ages in the flat LCDM cosmology of a simulation.
+
+Stellar ages are converted for the star particles of a whole snapshot in one vectorized call (see particles2pd.load_snap_fields()), and each galaxy then takes its slice, instead of evaluating the formula again for every galaxy.
+
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+
+# 1 / (100 km/s/Mpc) in Myr
+HUBBLE_TIME_MYR = 3.085677580666e19 / 100. / (1e6 * 365.25 * 86400)
+
+
+def cosmic_time(a, omega_matter, hubble_constant, dtype=None):
+    """
+
+    Age of the universe at scale factor a, for a flat universe with matter and a cosmological constant. Code from yt project (yt.utilities.cosmology).
+
+    Parameters
+    ----------
+    a: float or array
+        scale factor, e.g. StellarFormationTime of the star particles
+
+    omega_matter: float
+
+    hubble_constant: float
+        h, i.e. H0 / (100 km/s/Mpc)
+
+    dtype: numpy dtype or None
+        e.g. np.float32 to halve the memory of the result
+
+    Returns
+    -------
+    t: float or array
+        Myr
+
+    """
+
+    z = 1. / np.asarray(a) - 1
+    t = 2.0 / 3.0 / np.sqrt(1 - omega_matter) * np.arcsinh(np.sqrt(
+        (1 - omega_matter) / omega_matter) / np.power(1 + z, 1.5)) / (hubble_constant)  # Mpc*s/(100*km)
+    t *= HUBBLE_TIME_MYR
+    if dtype is not None:
+        t = np.asarray(t).astype(dtype, copy=False)
+    return t
+
+
+def stellar_ages(a, current_time, omega_matter, hubble_constant, dtype=None):
+    """
+
+    Ages of star particles from their formation scale factor.
+
+    Parameters
+    ----------
+    a: array
+        formation scale factor of each star particle
+
+    current_time: float
+        age of the universe at the snapshot in Myr, e.g. obj.simulation.time.in_units('Myr').d
+
+    omega_matter, hubble_constant, dtype:
+        see cosmic_time()
+
+    Returns
+    -------
+    age: array
+        Myr
+
+    """
+
+    age = current_time - cosmic_time(a, omega_matter, hubble_constant)
+    if dtype is not None:
+        age = np.asarray(age).astype(dtype, copy=False)
+    return age
@@ -0,0 +1,205 @@
+"""
+
+Build gal_catalog for many galaxies at once, as numpy columns.
+
+Every caesar property is collected for all galaxies in one pass and its units are stripped with one conversion factor per column, instead of one unit conversion per galaxy and property (see link_caesarGalProp_galname() in yt2caesar.py). Columns are plain floats in the units of CATALOG_UNITS.
+
+"""
+
+from __future__ import print_function, division
+import os
+import threading
+import numpy as np
+
+
+CATALOG_COLUMNS = ['GroupID', 'galnames', 'Mstar', 'Mgas', 'MBH', 'fedd', 'SFR', 'SFRSD_gasR_caesar', 'SFRSD_gasR_manual', 'gasSD_caesar', 'gasSD_manual', 'r_gas', 'r_gas_half_mass', 'r_stellar_half_mass', 'Zsfr', 'Zstellar', 'fgas', 'f_H2_fromSnap', 'DGR', 'Central', 'Mhalo_parent', 'HID']
+
+CATALOG_UNITS = {'Mstar': 'Msun', 'Mgas': 'Msun', 'MBH': 'Msun', 'SFR': 'Msun/yr',
+                 'SFRSD_gasR_caesar': 'Msun/yr/kpc**2', 'gasSD_caesar': 'Msun/pc**2',
+                 'r_gas': 'kpc', 'r_gas_half_mass': 'kpc', 'r_stellar_half_mass': 'kpc',
+                 'Zsfr': 'Zsun', 'Zstellar': 'Zsun', 'Mhalo_parent': 'Msun'}
+
+# catalog columns measured on the extracted particles, see particles2pd.extract_galaxy()
+EXTRACTED_COLUMNS = ['MBH', 'fedd', 'SFRSD_gasR_manual', 'gasSD_manual', 'f_H2_fromSnap']
+
+Zsun = 0.0134
+
+
+def strip_units(quantities, units=None):
+    """
+
+    Plain floats of a sequence of quantities.
+
+    Parameters
+    ----------
+    quantities: list
+        unyt/yt quantities or plain numbers
+
+    units: str or None
+        convert to these units first; the conversion factor is computed once per distinct unit, not per value
+
+    Returns
+    -------
+    values: array of float
+
+    """
+
+    out = np.empty(len(quantities))
+    factors = {}
+    for i, q in enumerate(quantities):
+        u = getattr(q, 'units', None)
+        if u is None or units is None:
+            out[i] = getattr(q, 'd', q)
+            continue
+        key = str(u)
+        if key not in factors:
+            factors[key] = float((1. * u).in_units(units).d)
+        out[i] = q.d * factors[key]
+    return out
+
+
+def bh_properties(galObj, bhmdot, frad=0.1):
+    """
+
+    Mass and Eddington ratio of the most massive BH of a galaxy, as in link_caesarGalProp_galname().
+
+    Parameters
+    ----------
+    galObj: caesar galaxy object
+
+    bhmdot: array
+        BH mdot in Msun/yr of every BH particle
+
+    frad: float
+        BH radiation efficiency
+
+    Returns
+    -------
+    bm, fedd: float or quantity
+        0 if the galaxy has no BH
+
+    """
+
+    try:
+        bhmdots = [bhmdot[k] for k in galObj.bhlist]
+        bm = galObj.masses['bh']
+        imax = np.argmax(bm)
+        try:
+            bm = bm[imax]
+            bmdot = bhmdots[imax]        # only the massive BH particle matters.
+        except:
+            bm = bm
+            bmdot = bhmdots
+
+        mdot_edd = 4*np.pi*6.67e-8*1.673e-24/(frad*3.e10*6.65245e-25) * bm * 3.155e7 # in Mo/yr
+        fedd = bmdot / mdot_edd
+        fedd = fedd[0].value
+    except:
+        bm = 0
+        fedd = 0
+    return bm, fedd
+
+
+def build_catalog(galaxies, galnames, extracted):
+    """
+
+    gal_catalog of many galaxies.
+
+    Parameters
+    ----------
+    galaxies: list
+        caesar galaxy objects
+
+    galnames: list of str
+
+    extracted: dict
+        EXTRACTED_COLUMNS --> sequence with one value per galaxy, from the extraction
+
+    Returns
+    -------
+    catalog: DataFrame
+        CATALOG_COLUMNS, one row per galaxy
+
+    """
+
+    import pandas as pd
+
+    n = len(galaxies)
+    halos = [gal.halo for gal in galaxies]
+
+    cols = {'GroupID': np.array([gal.GroupID for gal in galaxies], dtype=np.int64),
+            'galnames': np.array(galnames, dtype=object)}
+    cols['Mstar'] = strip_units([gal.masses['stellar'] for gal in galaxies], 'Msun')
+    cols['Mgas'] = strip_units([gal.masses['gas'] for gal in galaxies], 'Msun')
+    cols['MBH'] = strip_units(extracted['MBH'], 'Msun')
+    cols['fedd'] = strip_units(extracted['fedd'])
+    cols['SFR'] = strip_units([gal.sfr for gal in galaxies], 'Msun/yr')
+    cols['r_gas'] = strip_units([gal.radii['gas'] for gal in galaxies], 'kpc')
+    cols['SFRSD_gasR_caesar'] = cols['SFR']/np.pi/cols['r_gas']**2
+    cols['SFRSD_gasR_manual'] = np.asarray(extracted['SFRSD_gasR_manual'])
+    cols['gasSD_caesar'] = cols['Mgas']/np.pi/strip_units([gal.radii['gas'] for gal in galaxies], 'pc')**2
+    cols['gasSD_manual'] = np.asarray(extracted['gasSD_manual'])
+    cols['r_gas_half_mass'] = strip_units([gal.radii['gas_half_mass'] for gal in galaxies], 'kpc')
+    cols['r_stellar_half_mass'] = strip_units([gal.radii['stellar_half_mass'] for gal in galaxies], 'kpc')
+    cols['Zsfr'] = strip_units([gal.metallicities['sfr_weighted'] for gal in galaxies])/Zsun
+    cols['Zstellar'] = strip_units([gal.metallicities['stellar'] for gal in galaxies])/Zsun
+    cols['fgas'] = strip_units([gal.gas_fraction for gal in galaxies])             # = Mgas / (Mg + Ms)
+    cols['f_H2_fromSnap'] = np.asarray(extracted['f_H2_fromSnap'])
+    cols['DGR'] = cols['Mgas']/strip_units([gal.masses['dust'] for gal in galaxies], 'Msun')
+    cols['Central'] = np.array([bool(gal.central) for gal in galaxies], dtype=bool)
+    cols['Mhalo_parent'] = strip_units([-1 if h is None else h.masses['total'] for h in halos], 'Msun')
+    cols['HID'] = np.array([-1 if h is None else h.GroupID for h in halos], dtype=np.int64)
+
+    return pd.DataFrame(cols, columns=CATALOG_COLUMNS, index=np.arange(n))
+
+
+def write_catalog(catalog, path):
+    """
+
+    Write gal_catalog atomically (temp file, then rename), as a pickle or, if path ends in .parquet, as a Parquet table (needs pyarrow).
+
+    """
+
+    from manifest import atomic_to_pickle
+
+    if not path.endswith('.parquet'):
+        atomic_to_pickle(catalog, path)
+        return
+    # temp name unique per process and thread, as in atomic_to_pickle()
+    tmp = '{:}.{:}.{:}.tmp'.format(path, os.getpid(), threading.get_ident())
+    catalog.to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def read_catalog(path):
+    """ gal_catalog written by write_catalog() """
+    import pandas as pd
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def merge_catalogs(paths, path):
+    """
+
+    Concatenate the per-snapshot catalogs in paths, in the given order, and write them to path with write_catalog().
+
+    Parameters
+    ----------
+    paths: list of str
+        e.g. gal_catalog_s<snap> of every snapshot of a run; missing files are skipped
+
+    path: str
+
+    Returns
+    -------
+    catalog: DataFrame
+
+    """
+
+    import pandas as pd
+
+    catalogs = [read_catalog(p) for p in paths if os.path.exists(p)]
+    catalog = pd.concat(catalogs, ignore_index=True) if catalogs else pd.DataFrame(columns=CATALOG_COLUMNS)
+    write_catalog(catalog, path)
+    return catalog
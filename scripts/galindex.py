@@ -0,0 +1,267 @@
+"""
+
+Galaxy membership index of a caesar catalog, in compressed sparse row (CSR) form.
+
+For one particle type, members holds the glist (or slist, bhlist) of every galaxy concatenated in GroupID order, and the particles of galaxy i are members[offsets[i]:offsets[i+1]]. The index is built once from the caesar object graph, saved as .npy sidecar files next to the caesar .hdf5 and memory-mapped on later loads.
+
+Any per-galaxy field is then one slice of field[members], and per-galaxy sums are segmented numpy reductions instead of a python loop over galaxies.
+
+"""
+
+from __future__ import print_function, division
+import os
+import numpy as np
+
+
+LISTS = {'gas': 'glist', 'star': 'slist', 'bh': 'bhlist'}
+
+
+class MemberIndex(object):
+
+    def __init__(self, members, offsets, ptype):
+        """
+
+        Parameters
+        ----------
+        members: array of int64
+            particle indices of all galaxies, concatenated in GroupID order
+
+        offsets: array of int64
+            len(ngalaxies + 1); galaxy i owns members[offsets[i]:offsets[i+1]]
+
+        ptype: str
+            'gas', 'star' or 'bh'
+
+        """
+        self.members = members
+        self.offsets = offsets
+        self.ptype = ptype
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def counts(self):
+        """ number of particles in each galaxy """
+        return np.diff(self.offsets)
+
+    def galaxy(self, i):
+        """ particle indices of galaxy with GroupID i """
+        return self.members[self.offsets[i]:self.offsets[i+1]]
+
+    def subset(self, rows):
+        """
+
+        Index of only some galaxies, in the given order.
+
+        Parameters
+        ----------
+        rows: array of int
+            GroupIDs, e.g. [gal.GroupID for gal in obj.galaxies] after sorting obj.galaxies by SFR
+
+        Returns
+        -------
+        idx: MemberIndex
+            galaxy i of idx is galaxy rows[i] of self
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = self.counts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # position of every member of the subset inside self.members
+        pos = np.repeat(self.offsets[rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return MemberIndex(np.asarray(self.members)[pos], offsets, self.ptype)
+
+    def gather(self, snapPart, sel=None):
+        """
+
+        Gather a snapshot field for the members of every galaxy at once.
+
+        Parameters
+        ----------
+        snapPart: array
+            field of every particle in the box (or of the particles in sel), 1-D or N-D
+
+        sel: array of int or None
+            sorted particle indices snapPart was read with, see snapio.readsnap_fields(index=...)
+
+        Returns
+        -------
+        out: array
+            out[offsets[i]:offsets[i+1]] are the particles of galaxy i
+
+        """
+        members = self.members
+        if sel is not None:
+            members = np.searchsorted(sel, members)
+        return snapPart[members]
+
+    def segment_sum(self, values):
+        """ sum of values (already gathered, see gather()) over each galaxy """
+        return segment_reduce(np.add, values, self.offsets, empty=0)
+
+    def weighted_mean(self, values, weights):
+        """ weighted mean of values over each galaxy, nan for galaxies without particles """
+        wsum = self.segment_sum(weights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.segment_sum(values * weights) / wsum
+
+
+def segment_reduce(ufunc, values, offsets, empty=0):
+    """
+
+    Reduce values over each segment offsets[i]:offsets[i+1] with a numpy ufunc, e.g. np.add or np.maximum.
+
+    Parameters
+    ----------
+    ufunc: numpy ufunc
+
+    values: array
+        len(offsets[-1]), 1-D or N-D (reduced along axis 0)
+
+    offsets: array of int
+
+    empty: float
+        result for segments without particles. np.ufunc.reduceat would return values[offsets[i]] for those.
+
+    Returns
+    -------
+    out: array
+        len(offsets) - 1
+
+    """
+
+    offsets = np.asarray(offsets)
+    values = np.asarray(values)
+    counts = np.diff(offsets)
+    out = np.full((len(counts),) + values.shape[1:], empty, dtype=np.result_type(values, empty))
+    nonzero = counts > 0
+    if nonzero.any():
+        out[nonzero] = ufunc.reduceat(values, offsets[:-1][nonzero], axis=0)
+    return out
+
+
+def batch_galaxies(nbytes, budget):
+    """
+
+    Split galaxies into consecutive batches whose fields fit in a memory budget.
+
+    Parameters
+    ----------
+    nbytes: array
+        memory of the fields of each galaxy
+
+    budget: float
+        max. memory of one batch; a galaxy larger than that is a batch by itself
+
+    Returns
+    -------
+    batches: list of array of int
+        positions into nbytes, in order
+
+    """
+
+    batches = []
+    start, total = 0, 0
+    for i, nb in enumerate(nbytes):
+        if i > start and total + nb > budget:
+            batches.append(np.arange(start, i))
+            start, total = i, 0
+        total += nb
+    if len(nbytes) > start:
+        batches.append(np.arange(start, len(nbytes)))
+    return batches
+
+
+def build_member_index(obj, ptype):
+    """
+
+    Walk the caesar galaxies once and build the CSR membership index.
+
+    Parameters
+    ----------
+    obj: caesar obj
+
+    ptype: str
+        'gas', 'star' or 'bh'
+
+    Returns
+    -------
+    idx: MemberIndex
+        galaxies in GroupID order, independent of how obj.galaxies is currently sorted
+
+    """
+
+    key = LISTS[ptype]
+    galaxies = sorted(obj.galaxies, key=lambda x: x.GroupID)
+
+    counts = np.array([len(getattr(gal, key)) for gal in galaxies], dtype=np.int64)
+    offsets = np.zeros(len(galaxies) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    members = np.empty(offsets[-1], dtype=np.int64)
+    for i, gal in enumerate(galaxies):
+        members[offsets[i]:offsets[i+1]] = getattr(gal, key)
+
+    return MemberIndex(members, offsets, ptype)
+
+
+def sidecar_names(caesarFile, ptype):
+    """ .npy files holding members and offsets next to the caesar file """
+    base = os.path.splitext(caesarFile)[0] + '_' + LISTS[ptype]
+    return base + '_members.npy', base + '_offsets.npy'
+
+
+def save_member_index(idx, caesarFile):
+    """ write idx as sidecar .npy files next to caesarFile """
+    fmembers, foffsets = sidecar_names(caesarFile, idx.ptype)
+    # write to temp file first, so a half-written sidecar is never picked up
+    for fname, arr in ((fmembers, idx.members), (foffsets, idx.offsets)):
+        with open(fname + '.tmp', 'wb') as f:
+            np.save(f, arr)
+        os.replace(fname + '.tmp', fname)
+
+
+def load_member_index(caesarFile, ptype, obj=None, mmap=True):
+    """
+
+    Load the membership index of a caesar catalog, building and saving it on first use.
+
+    Parameters
+    ----------
+    caesarFile: str
+        path to caesar .hdf5
+
+    ptype: str
+        'gas', 'star' or 'bh'
+
+    obj: caesar obj or None
+        needed only if the sidecar files don't exist yet
+
+    mmap: bool
+        memory-map the sidecar files instead of reading them into memory
+
+    Returns
+    -------
+    idx: MemberIndex
+
+    """
+
+    fmembers, foffsets = sidecar_names(caesarFile, ptype)
+    if os.path.exists(fmembers) and os.path.exists(foffsets) and \
+            os.path.getmtime(fmembers) >= os.path.getmtime(caesarFile):
+        mode = 'r' if mmap else None
+        return MemberIndex(np.load(fmembers, mmap_mode=mode), np.load(foffsets, mmap_mode=mode), ptype)
+
+    if obj is None:
+        raise ValueError("No membership index for {:} yet, pass the caesar obj to build it".format(caesarFile))
+
+    print("Building {:} membership index of {:}".format(LISTS[ptype], caesarFile))
+    idx = build_member_index(obj, ptype)
+    try:
+        save_member_index(idx, caesarFile)
+    except (IOError, OSError) as e:
+        # e.g. no write permission in the simulation directory; keep the index in memory
+        print("Could not save membership index: {:}".format(e))
+    return idx
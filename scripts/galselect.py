@@ -0,0 +1,156 @@
+"""
+
+Select the top galaxies across snapshots by SFR, stellar mass or another property, see parse_simba.select_SFgal_from_simba().
+
+Each snapshot is ranked from the columns of its catalog table (catalogtable.py), so no caesar galaxy objects are sorted. The top N of a snapshot are found with np.partition, and the snapshots are merged with a heap of at most N galaxies.
+
+"""
+
+from __future__ import print_function, division
+import heapq
+import numpy as np
+
+
+# ranking name --> function of the catalog table galaxy columns, larger is better
+RANKINGS = {'sfr': lambda gal: gal['sfr'],
+            'stellar_mass': lambda gal: gal['masses.stellar'],
+            'dense_gas_mass': lambda gal: gal['masses.H2'],
+            'ssfr': lambda gal: gal['sfr'] / gal['masses.stellar']}
+
+
+def ranking_values(galaxies, key='sfr'):
+    """
+
+    Parameters
+    ----------
+    galaxies: dict
+        column --> array, e.g. CatalogTable.galaxies
+
+    key: str or callable
+        a name in RANKINGS, a column of galaxies or key(galaxies) --> array
+
+    Returns
+    -------
+    values: array of float
+        one per galaxy; nan (e.g. the sSFR of a galaxy without stars) is ranked last
+
+    """
+
+    if callable(key):
+        func = key
+    elif key in RANKINGS:
+        func = RANKINGS[key]
+    elif key in galaxies:
+        func = lambda gal: gal[key]
+    else:
+        raise KeyError("Unknown ranking: {:}, choose from {:} or a catalog column".format(key, sorted(RANKINGS)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.array(func(galaxies), dtype=np.float64)
+    values[np.isnan(values)] = -np.inf
+    return values
+
+
+def top_k(values, k, tiebreak=None):
+    """
+
+    Indices of the k largest values, largest first. Ties are cut and ordered by tiebreak, lowest first; by default by their original order, so the result is the same as the first k of a stable sort with reverse=True, e.g. obj.galaxies.sort(key=lambda x: x.sfr, reverse=True).
+
+    Parameters
+    ----------
+    values: array
+
+    k: int
+
+    tiebreak: array or None
+        one per value, e.g. sfr_ranks(); None for the index
+
+    Returns
+    -------
+    index: array of int
+        min(k, len(values)) indices, in the order of np.lexsort((tiebreak, -values))
+
+    """
+
+    values = np.asarray(values)
+    tiebreak = np.arange(len(values)) if tiebreak is None else np.asarray(tiebreak)
+    k = min(int(k), len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(values):
+        # k-th largest value; everything above it is in, of the values equal to it those first in tiebreak are
+        kth = -np.partition(-values, k - 1)[k - 1]
+        above = np.flatnonzero(values > kth)
+        tied = np.flatnonzero(values == kth)
+        tied = tied[np.argsort(tiebreak[tied], kind='stable')][:k - len(above)]
+        index = np.concatenate([above, tied])
+    else:
+        index = np.arange(len(values))
+    return index[np.lexsort((tiebreak[index], -values[index]))]
+
+
+def sfr_ranks(sfr):
+    """ position of every galaxy in the galaxy list sorted by SFR (highest first), as in parse_simba.define_ds() """
+    order = np.argsort(-np.asarray(sfr), kind='stable')
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order))
+    return ranks
+
+
+def select_top_galaxies(tables, Ngalaxies, key='sfr'):
+    """
+
+    Parameters
+    ----------
+    tables: iterable
+        (snap, CatalogTable) pairs, read one after the other
+
+    Ngalaxies: int
+        number of galaxies to select over all snapshots
+
+    key: str or callable
+        see ranking_values()
+
+    Returns
+    -------
+    galnames: DataFrame
+        columns 'halo' (parent halo index), 'snap', 'GAL' (position in the snapshot's galaxy list sorted by SFR, highest first), 'SFR' in Msun/yr, and the ranking value under the name of key unless it is 'sfr'; sorted by the ranking value, highest first
+
+    """
+
+    import pandas as pd
+
+    name = key if isinstance(key, str) else getattr(key, '__name__', 'rank')
+
+    # min-heap of the best galaxies so far: (value, -snapshot number in order, -GAL, row); ties go to the earlier snapshot, then to the higher SFR
+    heap = []
+    for isnap, (snap, table) in enumerate(tables):
+        gal = table.galaxies
+        values = ranking_values(gal, key)
+        if key == 'sfr':
+            # ties by index, which is the order of the SFR sort of define_ds()
+            index = top_k(values, Ngalaxies)
+            ranks = np.arange(len(index))
+        else:
+            # ties by SFR rank, as in the heap
+            allranks = sfr_ranks(gal['sfr'])
+            index = top_k(values, Ngalaxies, tiebreak=allranks)
+            ranks = allranks[index]
+        # in decreasing order of the heap key within this snapshot
+        for i, rank in zip(index, ranks):
+            row = (int(gal['parent_halo_index'][i]), int(snap), int(rank), float(gal['sfr'][i]), float(values[i]))
+            item = (values[i], -isnap, -int(rank), row)
+            if len(heap) < Ngalaxies:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            else:
+                # index is sorted like the heap key, the rest of this snapshot can't get in either
+                break
+
+    rows = [item[-1] for item in sorted(heap, reverse=True)]
+    galnames = pd.DataFrame(rows, columns=['halo', 'snap', 'GAL', 'SFR', name])
+    galnames[['halo', 'snap', 'GAL']] = galnames[['halo', 'snap', 'GAL']].astype(int)
+    if name == 'sfr':
+        galnames = galnames.drop(columns=name)
+    return galnames
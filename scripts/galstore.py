@@ -0,0 +1,283 @@
+"""
+
+One HDF5 file per snapshot holding the particles of all extracted galaxies, instead of a .gas, .star and .dm pickle per galaxy.
+
+Layout
+------
+/gas/<column>, /star/<column>, /dm/<column>
+    particle tables: one chunked, resizable 1-D dataset per DataFrame column, galaxies stored back to back
+
+/galaxies/galnames, /galaxies/<ptype>_offset, /galaxies/<ptype>_count
+    galaxy index: the rows of galaxy i in the ptype tables are offset[i]:offset[i] + count[i]
+
+/galaxies/<ptype>_<column>
+    with the 'compact' schema (see schema.py), columns that are constant within a galaxy, one value per galaxy; galaxy() repeats them for every particle
+
+/catalog/<column>
+    gal_catalog table
+
+Particle tables may be compressed with an HDF5 filter (see CODECS), which readers undo transparently. gzip and lzf come with h5py; the blosc, zstd and lz4 codecs need the hdf5plugin package, also for reading.
+
+A galaxy is only added to the index after its particles are written, so particles of a galaxy that was being written when a run got killed are simply overwritten by the next append.
+
+"""
+
+from __future__ import print_function, division
+import threading
+import numpy as np
+import h5py
+
+
+PTYPES = ['gas', 'star', 'dm']
+
+# codec --> (hdf5plugin filter or None, h5py create_dataset options); floats are byte-shuffled first
+CODECS = {'gzip': (None, {'compression': 'gzip', 'compression_opts': 4}),
+          'lzf': (None, {'compression': 'lzf'}),
+          'blosc-lz4': ('Blosc', {'cname': 'lz4', 'clevel': 5}),
+          'blosc-zstd': ('Blosc', {'cname': 'zstd', 'clevel': 3}),
+          'zstd': ('Zstd', {'clevel': 3}),
+          'lz4': ('LZ4', {})}
+
+# rows per chunk of compressed particle tables; small chunks compress poorly
+CHUNK_ROWS = 1 << 14
+
+
+def compression_options(codec, dtype):
+    """
+
+    Parameters
+    ----------
+    codec: str or None
+        key of CODECS, None for no compression
+
+    dtype: numpy dtype
+        of the column
+
+    Returns
+    -------
+    options: dict
+        keyword arguments for h5py create_dataset()
+
+    """
+
+    if codec is None:
+        return {'chunks': True}
+    if codec not in CODECS:
+        raise ValueError("Unclear compression: {:}".format(codec))
+    plugin, opts = CODECS[codec]
+    shuffle = np.dtype(dtype).kind == 'f'
+    if plugin is None:
+        return dict(opts, shuffle=shuffle, chunks=(CHUNK_ROWS,))
+    hdf5plugin = _import_hdf5plugin(codec)
+    if plugin == 'Blosc':
+        opts = dict(opts, shuffle=hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE)
+    options = dict(getattr(hdf5plugin, plugin)(**opts))
+    options['chunks'] = (CHUNK_ROWS,)
+    if shuffle and plugin != 'Blosc':
+        options['shuffle'] = True
+    return options
+
+
+def _import_hdf5plugin(codec):
+    try:
+        import hdf5plugin
+    except ImportError:
+        raise ValueError("compression {:} needs the hdf5plugin package".format(codec))
+    return hdf5plugin
+
+
+class GalaxyStore(object):
+
+    def __init__(self, path, mode='r', schema='full', compression=None):
+        """
+
+        Parameters
+        ----------
+        path: str
+            e.g. savepath + 'm25n1024_036_sim.hdf5'
+
+        mode: str
+            'r' to read, 'a' to append to an existing store (e.g. resuming), 'w' to start a new one
+
+        schema: str
+            'full' or 'compact', see schema.py; only used for a new store, an existing one keeps its own
+
+        compression: str or None
+            codec of the particle tables, see CODECS; only used for a new store, like schema
+
+        """
+        self.path = path
+        # append() may be called from several writer threads, see asyncwrite.py
+        self._lock = threading.Lock()
+        self.f = h5py.File(path, mode)
+        if mode != 'r' and 'galaxies' not in self.f:
+            compression_options(compression, np.float32)     # fail before writing anything
+            self.f.attrs['schema'] = schema
+            self.f.attrs['compression'] = compression or ''
+            g = self.f.create_group('galaxies')
+            g.create_dataset('galnames', (0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=True)
+            for ptype in PTYPES:
+                g.create_dataset(ptype + '_offset', (0,), maxshape=(None,), dtype='i8', chunks=True)
+                g.create_dataset(ptype + '_count', (0,), maxshape=(None,), dtype='i8', chunks=True)
+        self.schema = self.f.attrs.get('schema', 'full')
+        self.compression = self.f.attrs.get('compression', '') or None
+        if self.compression is not None and CODECS[self.compression][0] is not None:
+            # registers the filter for reading
+            _import_hdf5plugin(self.compression)
+        self._load_index()
+
+    def _load_index(self):
+        if 'galaxies' not in self.f:
+            self.rows = {}
+            return
+        galnames = self.f['galaxies/galnames'].asstr()[...]
+        # a galaxy written twice (e.g. re-extracted on resume) is read from its last copy
+        self.rows = {name: i for i, name in enumerate(galnames)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def __contains__(self, galname):
+        return galname in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def galnames(self):
+        """ galaxies in the store, in the order they were written """
+        return sorted(self.rows, key=self.rows.get)
+
+    def append(self, galname, frames):
+        """
+
+        Write the particles of one galaxy.
+
+        Parameters
+        ----------
+        galname: str
+
+        frames: dict
+            ptype --> DataFrame, e.g. {'gas': simgas, 'star': simstar, 'dm': simdm}
+
+        """
+
+        from schema import split_galaxy_columns
+
+        with self._lock:
+            g = self.f['galaxies']
+            n = len(g['galnames'])
+            for ptype in PTYPES:
+                df = frames[ptype]
+                columns = list(df.columns)
+                if self.schema == 'compact':
+                    df, values = split_galaxy_columns(df, ptype)
+                    for col, v in values.items():
+                        name = ptype + '_' + col
+                        if name not in g:
+                            g.create_dataset(name, (0,), maxshape=(None,), dtype=np.asarray(v).dtype, chunks=True)
+                        _set(g[name], n, v)
+                # end of the last indexed galaxy, not of the datasets, see module doc
+                offset = g[ptype + '_offset'][n-1] + g[ptype + '_count'][n-1] if n > 0 else 0
+                table = self.f.require_group(ptype)
+                for col in df.columns:
+                    data = np.asarray(df[col].values)
+                    if col not in table:
+                        if n > 0:
+                            raise KeyError("{:} has no {:} column {:}".format(self.path, ptype, col))
+                        table.create_dataset(col, (0,), maxshape=(None,), dtype=data.dtype, **compression_options(self.compression, data.dtype))
+                    dset = table[col]
+                    dset.resize((offset + len(data),))
+                    dset[offset:] = data
+                if 'columns' not in table.attrs:
+                    table.attrs['columns'] = columns
+                _set(g[ptype + '_offset'], n, offset)
+                _set(g[ptype + '_count'], n, len(df))
+
+            # galaxy becomes visible only now
+            _set(g['galnames'], n, galname)
+            self.f.flush()
+            self.rows[galname] = n
+
+    def galaxy(self, galname, ptype='gas'):
+        """
+
+        Read the particles of one galaxy.
+
+        Parameters
+        ----------
+        galname: str
+
+        ptype: str
+            'gas', 'star' or 'dm'
+
+        Returns
+        -------
+        df: DataFrame
+            same columns as the .gas, .star or .dm pickle
+
+        """
+
+        from schema import join_galaxy_columns
+
+        i = self.rows[galname]
+        g = self.f['galaxies']
+        a = g[ptype + '_offset'][i]
+        b = a + g[ptype + '_count'][i]
+        table = self.f[ptype]
+        columns = list(table.attrs.get('columns', list(table.keys())))
+        particles = {col: table[col][a:b] for col in columns if col in table}
+        values = {col: g[ptype + '_' + col][i] for col in columns if col not in table}
+        return join_galaxy_columns(particles, values, columns)
+
+    def write_catalog(self, catalog):
+        """ store the gal_catalog DataFrame, replacing an earlier one """
+        if 'catalog' in self.f:
+            del self.f['catalog']
+        g = self.f.create_group('catalog')
+        for col in catalog.columns:
+            data = _catalog_column(catalog[col].values)
+            if data.dtype.kind in 'OU':
+                g.create_dataset(col, data=data.astype(object), dtype=h5py.string_dtype())
+            else:
+                g.create_dataset(col, data=data)
+        g.attrs['columns'] = list(catalog.columns)
+        self.f.flush()
+
+    def catalog(self):
+        """ gal_catalog as a DataFrame, quantities as plain numbers """
+        import pandas as pd
+
+        g = self.f['catalog']
+        cols = list(g.attrs['columns'])
+        return pd.DataFrame({col: g[col].asstr()[...] if h5py.check_string_dtype(g[col].dtype) else g[col][...] for col in cols}, columns=cols)
+
+
+def read_galaxy(path, galname, ptype='gas'):
+    """ DataFrame of one galaxy from the store at path, see GalaxyStore.galaxy() """
+    with GalaxyStore(path) as store:
+        return store.galaxy(galname, ptype=ptype)
+
+
+def _set(dset, i, value):
+    # index entry i, dropping entries left behind by an incomplete append
+    dset.resize((i + 1,))
+    dset[i] = value
+
+
+def _catalog_column(values):
+    # unyt quantities --> float
+    values = [getattr(v, 'value', v) for v in values]
+    data = np.array(values)
+    if data.dtype == object:
+        try:
+            data = data.astype(float)
+        except (TypeError, ValueError):
+            data = data.astype(str)
+    return data
@@ -31,7 +31,8 @@ def info(obj, snapFile, top=None, savetxt=False):
     """
 
     from readgadget import readsnap
-    from yt2caesar import group_part_by_galaxy, get_partmasses_from_snapshot
+    from yt2caesar import get_partmasses_from_snapshot
+    from galindex import load_member_index
 
     group_list = obj.galaxies[:]
     nobjs = len(group_list)
@@ -60,6 +61,15 @@ def info(obj, snapFile, top=None, savetxt=False):
     gfH2_p = readsnap(snapFile,'fH2','gas', units=1)
     gas_p_m = get_partmasses_from_snapshot(snapFile, obj, ptype='gas')
 
+    # mass-weighted f_h2 of every galaxy in one segmented reduction, indexed by GroupID
+    if hasattr(obj, 'data_file'):
+        gidx = load_member_index(obj.data_file, 'gas', obj=obj)
+    else:
+        from galindex import build_member_index
+        gidx = build_member_index(obj, 'gas')
+    fh2_gal = gidx.weighted_mean(gidx.gather(gfH2_p), gidx.gather(gas_p_m))
+    del gfH2_p, gas_p_m
+
 
     output += '## ID      Mstar     Mgas      MBH    fedd    SFR [Msun/yr]      SFRSD [Msun/yr/kpc^2]    SFRSD_r_stellar_half_mass [Msun/yr/kpc^2]    gasSD [Msun/pc^2]    r_baryon   r_gas      r_gas_half_mass      r_stellar    r_stellar_half_mass    Z_sfrWeighted [/Zsun]    Z_massWeighted [/Zsun]     Z_stellar [/Zsun]     T_gas_massWeighted    T_gas_SFRWeighted   fgas    f_h2_fromSnap   DGR   nrho      Central\t|  Mhalo_parent     HID\n'
     output += '## ----------------------------------------------------------------------------------------\n'
@@ -98,10 +108,6 @@ def info(obj, snapFile, top=None, savetxt=False):
         # print bm, fedd
         # import pdb; pdb.set_trace()
 
-        # Calculate mass-weighted f_h2 of each gal
-        gas_f_H2 = group_part_by_galaxy(gfH2_p, o, ptype='gas')
-        gas_m = group_part_by_galaxy(gas_p_m, o, ptype='gas')
-
         output += ' %04d  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e  %0.2e   %0.3f   %0.3f  %0.3f  %0.2e  %0.2e  %0.3f  %0.2e  %.2e  %.2e  %s\t|  %0.2e  %d \n' % \
                   (o.GroupID, o.masses['stellar'], o.masses['gas'],
                    bm,
@@ -121,7 +127,7 @@ def info(obj, snapFile, top=None, savetxt=False):
                    o.temperatures['mass_weighted'],
                    o.temperatures['sfr_weighted'],
                    o.gas_fraction,      # = Mgas / (Mg + Ms)
-                   np.sum(gas_f_H2 * gas_m)/np.sum(gas_m),    # mass-weighted f_h2
+                   fh2_gal[o.GroupID],    # mass-weighted f_h2
                    o.masses['gas']/o.masses['dust'],
                    o.local_number_density, o.central,
                    phm, phid)
@@ -482,11 +488,11 @@ def run_generate_aux_files(caesar_dir, name_prefix, LoadHalo, top=None, savetxt=
     run info() to save information on galaxies of the snapshot in a .txt
 
     """
-    import caesar
+    from catalogs import caesar_catalog
 
     infile = caesar_dir + name_prefix + '{:0>3}'.format(int(snap)) + \
                 '.hdf5'
-    obj = caesar.load(infile, LoadHalo=LoadHalo)
+    obj = caesar_catalog(infile, LoadHalo=LoadHalo)
     snapFile = raw_sim_dir + raw_sim_name_prefix + '{:0>3}'.format(int(snap)) + '.hdf5'
     output, outName = info(obj, snapFile, top=top, savetxt=savetxt)
     return output, outName
@@ -33,7 +33,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import os
-import caesar
+from catalogs import catalog_table
 import function as fu
 import OBSSMF as obs
 
@@ -55,28 +55,28 @@ def massFunc(objs, labels, ax, jwind, fill_between=False, addvlineMassLimit=Fals
 
     for j in range(0, len(objs)):
         for curType in TYPES:
-            galpos = np.array([g.pos.d for g in objs[j].galaxies])
+            # columns of catalogtable.py, see catalogs.catalog_table()
+            galpos = np.array(objs[j].galaxies['pos'])
             if curType == 'GSMF':
-                mass = np.array(
-                    [g.masses['stellar'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.stellar'])
             elif curType == 'HI':
-                mass = np.array([g.masses['HI'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.HI'])
             elif curType == 'H2':
-                mass = np.array([g.masses['H2'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.H2'])
             elif curType == 'SFR':
-                mass = np.array([g.sfr.d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['sfr'])
             elif curType == 'Halo':
-                mass = np.array([h.masses['virial'].d for h in objs[j].halos])
-                galpos = np.array([h.pos.d for h in objs[j].halos])
+                mass = np.array(objs[j].halos['masses.virial'])
+                galpos = np.array(objs[j].halos['pos'])
 
             npart = objs[j].simulation.effective_resolution
 
-            proper_mlim = 64 * objs[j].simulation.critical_density.value * objs[j].simulation.boxsize.value**3 * objs[j].simulation.omega_baryon / npart**3 * objs[j].simulation.scale_factor**3/objs[j].simulation.hubble_constant**3
+            proper_mlim = 64 * objs[j].simulation.critical_density * objs[j].simulation.boxsize**3 * objs[j].simulation.omega_baryon / npart**3 * objs[j].simulation.scale_factor**3/objs[j].simulation.hubble_constant**3
             # print(proper_mlim)
 
-            sfr = np.array([g.sfr.d for g in objs[j].galaxies])
-            cent = np.array([g.central for g in objs[j].galaxies])
-            volume = objs[j].simulation.boxsize.to('Mpccm').d**3
+            sfr = np.array(objs[j].galaxies['sfr'])
+            cent = np.array(objs[j].galaxies['central'])
+            volume = objs[j].simulation.boxsize_Mpccm**3
             redshift = objs[j].simulation.redshift
             ssfr = np.log10(1.e9 * sfr / mass + 10**(-2.7 + 0.3 * redshift))
             ssfrlim = -1.8 + 0.3 * redshift
@@ -160,7 +160,7 @@ for ii, nn in enumerate(simName):
 
     else:
         caesarfile = '/mnt/ceph/users/daisyleung/simba/sim/' + nn + '/s50/Groups/' + nn + '_036.hdf5'
-    sims.append(caesar.load(caesarfile, LoadHalo=False))
+    sims.append(catalog_table(caesarfile))
 
 ncol = 1
 nrow = 1
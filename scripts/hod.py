@@ -8,7 +8,7 @@ Need to apply the same absolute mass cut for all the volumes
 """
 
 
-import caesar
+from catalogs import catalog_table
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib
@@ -67,21 +67,20 @@ allhalos = False    # apply same mass cut to all volumes
 
 def get_Mhmin(sim):
 
-    mlim = 64*sim.simulation.critical_density.value*sim.simulation.boxsize.value**3*sim.simulation.omega_matter/sim.simulation.effective_resolution**3 # galaxy mass resolution limit in DM particle
+    mlim = 64*sim.simulation.critical_density*sim.simulation.boxsize**3*sim.simulation.omega_matter/sim.simulation.effective_resolution**3 # galaxy mass resolution limit in DM particle
 
     myobjs = sim.galaxies
-    cents = np.asarray([i for i in myobjs if i.central==1])
-    Mhmin = np.min( np.asarray([i.halo.masses['total'] for i in cents]) ) # smallest halo to host a galaxy in each cental halo
+    cents = myobjs['central'] == 1
+    Mhmin = np.min(sim.halos['masses.total'][myobjs['parent_halo_index'][cents]]) # smallest halo to host a galaxy in each cental halo
 
     return mlim, Mhmin
 
 
 MhminList = {}
 mlimList = {}
-ssim = {}
 for k, infile in inoutName.items():
-    ssim[k] = caesar.load(infile)
-    mlim, Mhmin = get_Mhmin(ssim[k])
+    # caesar file as flat columns (see catalogtable.py), loaded once per process (see catalogs.py)
+    mlim, Mhmin = get_Mhmin(catalog_table(infile))
     MhminList[k] = Mhmin
     mlimList[k] = mlim
 print(mlimList)
@@ -106,15 +105,14 @@ print(MhminList)
 for k, infile in inoutName.items():
     figname = k + '_hod_bin' + str(nbin) + '.pdf'
 
-    # sim = caesar.load(infile) # load caesar file
-    sim = ssim[k]
+    sim = catalog_table(infile)     # same table as above, not loaded again
     Mhmin = MhminList[k]
 
-    vol_mpc = sim.simulation.boxsize.to('Mpccm').d**3
+    vol_mpc = sim.simulation.boxsize_Mpccm**3
     cosmo = FlatLambdaCDM(H0=100*sim.simulation.hubble_constant, Om0=sim.simulation.omega_matter, Ob0=sim.simulation.omega_baryon,Tcmb0=2.73)
 
     myobjs = sim.galaxies
-    cents = np.asarray([i for i in myobjs if i.central==1])
+    cents = np.flatnonzero(myobjs['central'] == 1)
 
     # if get the same Mlim across all volumes!!!
     # _mlim = np.array(mlimList[max(mlimList, key=mlimList.get)], \
@@ -125,26 +123,22 @@ for k, infile in inoutName.items():
 
     if not allhalos:
         # only include halos (central + satellites) that are above the min. central halo mass
-        halos = np.asarray([i for i in sim.halos if i.masses['total']>Mhmin])
+        halos = np.flatnonzero(sim.halos['masses.total'] > Mhmin)
     else:
         figname = k + '_hod_bin' + str(nbin) + '_allhalos.pdf'
-        halos = np.asarray([i for i in sim.halos])
+        halos = np.arange(sim.nhalos)
 
-    mh = np.asarray([i.masses['total'] for i in halos])
+    mh = sim.halos['masses.total'][halos]
 
-    pos = np.asarray([i.pos for i in halos])
+    pos = sim.halos['pos'][halos]
     print('Mhalo,min=',np.log10(Mhmin),' Ncents=',len(cents),' Nhalos=',len(halos))
 
-    ms = np.asarray([i.masses['stellar'] for i in myobjs])
+    ms = myobjs['masses.stellar']
     logms = np.log10(ms)
-    sfr = np.asarray([i.sfr for i in myobjs])
+    sfr = myobjs['sfr']
     ssfr = np.log10(1.e9*sfr/ms+10**(-2.9+0.3*sim.simulation.redshift)) # with a floor to prevent NaN's
 
-    halogals = np.asarray([i.galaxy_index_list for i in halos])
-    halomags = []
-    for i in range(len(halogals)):
-        halomags.append(halogals[i])
-    ngal = np.asarray([len(hm) for hm in halomags])
+    ngal = sim.halos['ngalaxies'][halos]
 
 
     # plot
@@ -0,0 +1,117 @@
+"""
+
+Manifest of the galaxies extracted by particles2pd, so that an interrupted run can be resumed.
+
+Every completed galaxy is appended to the manifest as one pickled record (galname, index, output paths and sizes, catalog columns measured on its particles) and flushed to disk, after its .gas, .star, .dm files have been written and renamed into place. A run killed half-way leaves at most a truncated last record, which is dropped on load, and output files never exist half-written under their final name.
+
+"""
+
+from __future__ import print_function, division
+import os
+import threading
+import _pickle as pickle
+
+
+def atomic_to_pickle(df, path):
+    """ DataFrame.to_pickle() to a temp file, then rename it to path """
+    # temp name unique per process and thread, several may write the same path
+    tmp = '{:}.{:}.{:}.tmp'.format(path, os.getpid(), threading.get_ident())
+    df.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+class ExtractionManifest(object):
+
+    def __init__(self, path):
+        """
+
+        Parameters
+        ----------
+        path: str
+            manifest file, e.g. savepath + 'manifest_s036.pkl'
+
+        """
+        self.path = path
+        # commit() may be called from the writer threads, see asyncwrite.py
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """ forget all records, for a run that starts from scratch """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self, verify=True):
+        """
+
+        Read the records committed so far.
+
+        Parameters
+        ----------
+        verify: bool
+            drop records whose output files are missing or don't have the size recorded at commit time
+
+        Returns
+        -------
+        done: dict
+            galname --> record; for a galaxy committed more than once, the last record wins
+
+        """
+
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+
+        good = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    # truncated last record of a killed run
+                    print("Dropping incomplete record at the end of {:}".format(self.path))
+                    break
+                done[record['galname']] = record
+                good = f.tell()
+
+        if good < os.path.getsize(self.path):
+            # cut the torn record off, so records appended later are readable
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+
+        if verify:
+            for galname in list(done):
+                if not self.complete(done[galname]):
+                    print("Output of {:} is missing or corrupt, will extract it again".format(galname))
+                    del done[galname]
+        return done
+
+    @staticmethod
+    def complete(record):
+        """ True if all output files of record exist with the recorded size """
+        for path, size in zip(record['paths'], record['sizes']):
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def commit(self, record):
+        """
+
+        Append a galaxy to the manifest once its output files are in place.
+
+        Parameters
+        ----------
+        record: dict
+            at least 'galname' and 'paths'; the size of each file in paths is added as 'sizes'
+
+        """
+
+        record = dict(record)
+        record['sizes'] = [os.path.getsize(p) for p in record['paths']]
+        data = pickle.dumps(record, protocol=-1)
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
@@ -12,12 +12,11 @@ def get_basic_info_from_caesarCat(snapRange, Nhalo, Ngalaxies, caesar_dir, name_
 
     """
 
-    import caesar
+    from catalogs import caesar_catalog
     for ii, sss in enumerate(snapRange):
         infile = caesar_dir + name_prefix + '{:0>3}'.format(int(sss)) + \
             '.hdf5'
-        print("Loading Ceasar file: {}").format(infile)
-        obj = caesar.load(infile)
+        obj = caesar_catalog(infile)
 
     print('Total number of galaxies found: ' + str(obj.ngalaxies))
     Ngal = obj.ngalaxies
@@ -46,7 +45,7 @@ def get_basic_info_from_caesarCat(snapRange, Nhalo, Ngalaxies, caesar_dir, name_
     return Ngal
 
 
-def select_SFgal_from_simba(raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, snapRange, Ngalaxies, saveggg=None, verbose=False, debug=False):
+def select_SFgal_from_simba(raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, snapRange, Ngalaxies, saveggg=None, verbose=False, debug=False, rankBy='sfr'):
 
     '''
         pick out the 'Ngalaxies' most star-forming galaxies across snapshots 'snapRange'
@@ -67,6 +66,8 @@ def select_SFgal_from_simba(raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_p
         how many galaxies from each snapshot across all halos do we want as output
     saveggg: str
         filename to save output "galnames_selected"
+    rankBy: str or callable
+        galaxies are selected by this instead of SFR if given, e.g. 'stellar_mass', 'dense_gas_mass', 'ssfr'; see galselect.RANKINGS
 
     Returns
     -------
@@ -75,95 +76,80 @@ def select_SFgal_from_simba(raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_p
 
     '''
 
-    import caesar
-    import numpy as np
-    import pandas as pd
-
-    # store gal info for large number of galaxies, which we then select from
-    galnames = pd.DataFrame({'halo': [], 'snap': [], 'GAL': [], 'SFR': []})
-
-    # loop thru snapshots
-    for ii, sss in enumerate(snapRange):
-        infile = caesar_dir + name_prefix + '{:0>3}'.format(int(sss)) + \
-            '.hdf5'
-        print("Loading Ceasar file: {}").format(infile)
-        obj = caesar.load(infile)    # # LoadHalo=False
-
-        print("\nSelecing {} Galaxies with the highest SFRs across all halos in this snapshot, but you may want to galaxies based on different criteria.").format(Ngalaxies)
-        obj.galaxies.sort(key=lambda x: x.sfr, reverse=True)
-        if verbose:
-            print(obj.galinfo(top=Ngalaxies))
-
-        for GAL in range(Ngalaxies):
-            try:
-                SFR = float(obj.galaxies[GAL].sfr.d)
-                add_this = pd.DataFrame({'halo': [int(obj.galaxies[GAL].parent_halo_index)], 'snap': [
-                                        sss], 'GAL': [GAL], 'SFR': [SFR]})
-                galnames = galnames.append(add_this, ignore_index=True)
-                galnames[['halo', 'snap', 'GAL']] = galnames[
-                    ['halo', 'snap', 'GAL']].astype(int)
-            except:
-                break
-
-    print("\nSelecing {} Galaxies with the highest SFRs across snapshot 'snapRange', but you may want to galaxies based on different criteria.\nIf so, edit define_ds()").format(Ngalaxies)
-    galnames = galnames.sort_values(['SFR'], ascending=False).reset_index(drop=True)
+    from catalogs import catalog_table
+    from galselect import select_top_galaxies
+
+    def tables():
+        # loop thru snapshots
+        for sss in snapRange:
+            infile = caesar_dir + name_prefix + '{:0>3}'.format(int(sss)) + \
+                '.hdf5'
+            table = catalog_table(infile)
+            if verbose:
+                print(select_top_galaxies([(sss, table)], Ngalaxies, key=rankBy))
+            yield sss, table
+
+    print("\nSelecing {} Galaxies with the highest {} across snapshot 'snapRange', but you may want to galaxies based on different criteria.\nIf so, change rankBy".format(Ngalaxies, rankBy))
+    galnames = select_top_galaxies(tables(), Ngalaxies, key=rankBy)
     if debug:
         print(galnames)
     print("Note to self: Remember to change variable global_save_files in param.py so that naming is consistent with Ngalaxies we are picking here")
-    galnames = galnames[:Ngalaxies]
     print(galnames)
 
     if saveggg is not None:
-        with open(saveggg, 'w') as f:
-            pickle.dump([ggg], f)
+        import pickle
+        with open(saveggg, 'wb') as f:
+            pickle.dump([galnames], f)
     return galnames
 
 
-def print_ds_info(h, obj, ds):
-    boxsize = (obj.simulation.boxsize*h).d       # boxsize=readheader(snap,'boxsize')
+def print_ds_info(header, obj):
+    boxsize = header.boxsize_Mpch
     # galaxy mass resolution limit: 32 gas particle masses
     mlim = 32*obj.simulation.critical_density.value*obj.simulation.boxsize.value**3*obj.simulation.omega_baryon/obj.simulation.effective_resolution**3
-    print("Box size: {:} Mpc/h").format(boxsize/1.e3)
-    print("Galaxy mass lower bound/mass reolution limit (32 particles masses): {:} ").format(mlim)
+    print("Box size: {:} Mpc/h".format(boxsize))
+    print("Galaxy mass lower bound/mass reolution limit (32 particles masses): {:} ".format(mlim))
     print('Info for this snapshot:')
-    print('Simulation type: ' + ds.dataset_type)
-    for key in ds.parameters.keys():
-        print('%s = %s' % (key, ds.parameters[key]))
+    for key in sorted(header.keys()):
+        print('%s = %s' % (key, header[key]))
 
 
 def define_ds(snap, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, redshiftFile, verbose=False):
 
     """
 
+    Returns
+    -------
+    snapshot: snapheader.Snapshot
+        header of the raw snapshot; snapshot.ds (yt) and snapshot.pygad are only loaded when used
+    h: float
+        hubble parameter from the snapshot header
+    obj: caesar obj
+        galaxies sorted by SFR, highest first
+    zred: float
+
     """
 
     import caesar
-    import yt
-    import numpy as np
-    import os
-    import pygad as pg
-
-    _, zs_table, snaps_table = np.loadtxt(redshiftFile, unpack=True)
+    from snapheader import Snapshot, snap_redshift
 
     infile = caesar_dir + name_prefix + '{:0>3}'.format(int(snap)) + \
         '.hdf5'
-    print("Loading Ceasar file: {}").format(infile)
+    print("Loading Ceasar file: {}".format(infile))
+    # not catalogs.caesar_catalog(): the galaxies are sorted in place
     obj = caesar.load(infile)
     obj.galaxies.sort(key=lambda x: x.sfr, reverse=True)
 
     rawSim = raw_sim_dir + raw_sim_name_prefix + \
         '{:>03}'.format(int(snap)) + '.hdf5'
-
-    ds = yt.load(rawSim, over_refine_factor=1, index_ptype="all")
-
-    s = pg.Snap(raw_sim_dir + raw_sim_name_prefix + '{:0>3}'.format(int(snap)) + '.hdf5')
-    h = s.cosmology.h()    # obj.simulation.hubble_constant
+    snapshot = Snapshot(rawSim)
+    h = snapshot.h    # obj.simulation.hubble_constant
 
     if verbose:
-        print_ds_info(h, obj, ds)
+        print_ds_info(snapshot.header, obj)
 
-    zred = '{:.3f}'.format(zs_table[snaps_table == snap][0])
-    return s, h, obj, ds, float(zred)
+    zred = snap_redshift(redshiftFile, snap)
+    return snapshot, h, obj, zred
 
 
 
@@ -220,8 +206,9 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
     import pandas as pd
     import os
     from readgadget import readsnap
+    from cosmo import stellar_ages
+    from rotation import rotate
 
-    kpc2m = 3.085677580666e19
     resort = False
 
     # Save the names and redshift for the galaxies that we finally decide to save in DataFrames:
@@ -250,7 +237,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
 
         if num == 0:
             snap_hold = snap
-            s, h, obj, ds, zred = define_ds(snap, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, redshiftFile)
+            snapshot, h, obj, zred = define_ds(snap, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, redshiftFile)
 
             # get H2 fraction from snapfile, instead of from YT sphere - faster way to weed out galaxies that are too small/with too few dense gas particles.
             snapFile = raw_sim_dir + raw_sim_name_prefix + '{:0>3}'.format(int(snap)) + '.hdf5'
@@ -259,7 +246,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
 
         else:
             if snap != snap_hold:
-                s, h, obj, ds, zred = define_ds(snap, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, redshiftFile)
+                snapshot, h, obj, zred = define_ds(snap, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_prefix, redshiftFile)
                 snap_hold = snap
 
         # if we have sorted galnames by ('snap', SFR of each snap), we have to do so for obj too.
@@ -332,7 +319,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                 R_gal = galaxy.radius       # kpccm, i.e., co-moving
                 # print(galaxy.radii)
                 print('Cut out a sphere with radius %s, %s' % (R_gal, R_gal.in_units('kpc')))
-                sphere = ds.sphere(loc, R_gal)
+                sphere = snapshot.ds.sphere(loc, R_gal)
 
                 gas_pos = sphere['PartType0', 'Coordinates'].in_units('kpc')
                 print('%s SPH particles' % len(gas_pos))
@@ -347,24 +334,20 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                     os.system('h5ls -r ' + rawSim)
 
                     print("")
-                    print(ds.field_list)
+                    print(snapshot.ds.field_list)
 
                 if len(gas_pos) > 0 and len(star_pos_all) > 0:
                     print('Extracting all gas particle properties...')
                     gas_pos = gas_pos - loc
 
                     # rotation to ensure that the galaxies lie in the xy-plane. That makes it easier to visualize later, and you can always add random viewing angles later as well.
-                    gas_pos = caesar.utils.rotator(gas_pos,
-                                                   galaxy.rotation_angles['ALPHA'],
-                                                   galaxy.rotation_angles['BETA'])
-                    gas_posx, gas_posy, gas_posz = gas_pos[
-                        :, 0].d, gas_pos[:, 1].d, gas_pos[:, 2].d
+                    ALPHA, BETA = galaxy.rotation_angles['ALPHA'], galaxy.rotation_angles['BETA']
+                    gas_pos = rotate(gas_pos.d, ALPHA, BETA)
+                    gas_posx, gas_posy, gas_posz = gas_pos[:, 0], gas_pos[:, 1], gas_pos[:, 2]
 
                     gas_vel = sphere['PartType0', 'Velocities'].in_cgs() / 1.e5
-                    gas_vel = caesar.utils.rotator(gas_vel, galaxy.rotation_angles[
-                                                   'ALPHA'], galaxy.rotation_angles['BETA'])
-                    gas_velx, gas_vely, gas_velz = gas_vel[
-                        :, 0].d, gas_vel[:, 1].d, gas_vel[:, 2].d
+                    gas_vel = rotate(gas_vel.d, ALPHA, BETA)
+                    gas_velx, gas_vely, gas_velz = gas_vel[:, 0], gas_vel[:, 1], gas_vel[:, 2]
 
                     print("gas_velx length: ", len(gas_velx))
                     gas_densities = sphere['PartType0', 'Density'].in_cgs()
@@ -377,7 +360,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                     # ionized gas mass fraction (because we don't trust
                     # NeutralHydrogenAbundance -- which only includes atomic gas but not moleuclar)
                     # At the end, calculated from
-                    gas_f_ion = gas_x_e / max(gas_x_e)
+                    gas_f_ion = gas_x_e / gas_x_e.max()
                     gas_f_HI = 1 - gas_f_ion
 
                     print('\nChecking molecular gas mass fraction from simulation:')
@@ -406,16 +389,12 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
 
                     print('Extracting all star particle properties...')
                     star_pos = star_pos_all - loc
-                    star_pos = caesar.utils.rotator(star_pos, galaxy.rotation_angles[
-                                                    'ALPHA'], galaxy.rotation_angles['BETA'])
-                    star_posx, star_posy, star_posz = star_pos[
-                        :, 0].d, star_pos[:, 1].d, star_pos[:, 2].d
+                    star_pos = rotate(star_pos.d, ALPHA, BETA)
+                    star_posx, star_posy, star_posz = star_pos[:, 0], star_pos[:, 1], star_pos[:, 2]
 
                     star_vel = sphere['PartType4', 'Velocities'].in_cgs() / 1e5
-                    star_vel = caesar.utils.rotator(star_vel, galaxy.rotation_angles[
-                                                    'ALPHA'], galaxy.rotation_angles['BETA'])
-                    star_velx, star_vely, star_velz = star_vel[
-                        :, 0].d, star_vel[:, 1].d, star_vel[:, 2].d
+                    star_vel = rotate(star_vel.d, ALPHA, BETA)
+                    star_velx, star_vely, star_velz = star_vel[:, 0], star_vel[:, 1], star_vel[:, 2]
 
                     star_m = sphere['PartType4', 'Masses'].in_units('Msun')
                     # star_m = galaxy.masses['stellar']
@@ -435,26 +414,19 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                     print('Hubble constant: %s' % hubble_constant)
                     print('XH: %s' % obj.simulation.XH)
 
-                    current_time = ds.current_time.in_units('yr') / 1.e6  # Myr
+                    current_time = snapshot.ds.current_time.in_units('yr') / 1.e6  # Myr
                     # in scale factors, do as with Illustris
                     star_formation_a = sphere['PartType4', 'StellarFormationTime'].d
-                    star_formation_z = 1. / star_formation_a - 1
-                    # Code from yt project (yt.utilities.cosmology)
-                    star_formation_t = 2.0 / 3.0 / np.sqrt(1 - omega_matter) * np.arcsinh(np.sqrt(
-                        (1 - omega_matter) / omega_matter) / np.power(1 + star_formation_z, 1.5)) / (hubble_constant)  # Mpc*s/(100*km)
-                    star_formation_t *=  kpc2m / 100. / (1e6 * 365.25 * 86400)  # Myr
-                    star_age = current_time.d - star_formation_t
+                    star_age = stellar_ages(star_formation_a, current_time.d, omega_matter, hubble_constant)
 
                     print('Extracting all DM particle properties...')
                     dm_pos_all = sphere['PartType1', 'Coordinates'].in_units('kpc')
                     dm_pos = dm_pos_all - loc
-                    dm_pos = caesar.utils.rotator(dm_pos, galaxy.rotation_angles[
-                                                  'ALPHA'], galaxy.rotation_angles['BETA'])
-                    dm_posx, dm_posy, dm_posz = dm_pos[:, 0].d, dm_pos[:, 1].d, dm_pos[:, 2].d
+                    dm_pos = rotate(dm_pos.d, ALPHA, BETA)
+                    dm_posx, dm_posy, dm_posz = dm_pos[:, 0], dm_pos[:, 1], dm_pos[:, 2]
                     dm_vel = sphere['PartType1', 'Velocities'].in_cgs() / 1e5
-                    dm_vel = caesar.utils.rotator(dm_vel, galaxy.rotation_angles[
-                                                  'ALPHA'], galaxy.rotation_angles['BETA'])
-                    dm_velx, dm_vely, dm_velz = dm_vel[:, 0].d, dm_vel[:, 1].d, dm_vel[:, 2].d
+                    dm_vel = rotate(dm_vel.d, ALPHA, BETA)
+                    dm_velx, dm_vely, dm_velz = dm_vel[:, 0], dm_vel[:, 1], dm_vel[:, 2]
                     dm_m = sphere['PartType1', 'Masses'].in_units('Msun')
 
 
@@ -463,11 +435,8 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                     print('%s BH particles' % len(BH_pos))
 
                     if len(BH_pos) > 0:
-                        BH_pos = caesar.utils.rotator(BH_pos,
-                                                       galaxy.rotation_angles['ALPHA'],
-                                                       galaxy.rotation_angles['BETA'])
-                        BH_posx, BH_posy, BH_posz = BH_pos[
-                            :, 0].d, BH_pos[:, 1].d, BH_pos[:, 2].d
+                        BH_pos = rotate(BH_pos.d, ALPHA, BETA)
+                        BH_posx, BH_posy, BH_posz = BH_pos[:, 0], BH_pos[:, 1], BH_pos[:, 2]
 
                         # BH mass
                         # which grows through accretion and mergers w/ other BHs
@@ -540,7 +509,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
                         savepath = 'plots/sims/'
                         if not os.path.exists(savepath):
                             os.makedirs(savepath)
-                        ppp = yt.ProjectionPlot(ds, 0, [('gas', 'density')],
+                        ppp = yt.ProjectionPlot(snapshot.ds, 0, [('gas', 'density')],
                                              center=sphere.center.value,
                                              width=(R_max, 'kpc'),
                                                # center='c',
@@ -582,7 +551,7 @@ def simba_to_pd(galnames, raw_sim_dir, raw_sim_name_prefix, caesar_dir, name_pre
 
                         if not os.path.isfile(filename):
                             print("Plotting gas particles...")
-                            ppp = yt.ProjectionPlot(ds, 0, [('gas', 'density')],
+                            ppp = yt.ProjectionPlot(snapshot.ds, 0, [('gas', 'density')],
                                                  center=sphere.center.value,
                                                  width=(R_max, 'kpc'),
                                                    # center='c',
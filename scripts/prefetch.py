@@ -0,0 +1,235 @@
+"""
+
+Load the next snapshots while the current one is being processed, see particles2pd.run(prefetch=...).
+
+The snapshot fields are read by a helper process into shared memory, and the caesar catalog is loaded by a thread. h5py holds the GIL while it reads, so a reader thread would not overlap with the extraction.
+
+The helper is forked once, before any prefetch thread exists. Forking while a thread is in the middle of an h5py call could leave the child with h5py's lock held forever.
+
+"""
+
+from __future__ import print_function, division
+import threading
+import traceback
+import numpy as np
+
+
+def _serve(conn):
+    """ main loop of the FieldReader process: read one snapshot per request, in order """
+    from multiprocessing import resource_tracker
+    from snapio import readsnap_fields
+    from sharedmem import share_arrays, describe_shared
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        snapFile, requests, caesarFile, part_threshold = job
+        try:
+            index = None
+            if caesarFile is not None:
+                index = selected_particles(caesarFile, part_threshold)
+                if index is None:
+                    # don't read the whole box for a selective run
+                    conn.send((snapFile, None, None, None))
+                    continue
+
+            fields = readsnap_fields(snapFile, requests, units=1, index=index)
+            if index is not None:
+                fields.update({('index', ptype): sel for ptype, sel in index.items()})
+
+            keys = list(fields)
+            descr = {}
+            for i, k in enumerate(keys):
+                # one field at a time, so the copy never doubles the whole snapshot
+                blocks, shared = share_arrays({i: fields.pop(k)})
+                descr.update(describe_shared(blocks, shared))
+                del shared
+                for shm in blocks:
+                    # unlinked by the process that uses the arrays, see SnapshotPrefetch.free()
+                    resource_tracker.unregister(shm._name, 'shared_memory')
+                    shm.close()
+            conn.send((snapFile, keys, descr, None))
+        except Exception:
+            conn.send((snapFile, None, None, traceback.format_exc()))
+
+
+def selected_particles(caesarFile, part_threshold):
+    """
+
+    Gas and star particles of the galaxies with at least part_threshold of each, from the membership index sidecar files (see galindex.py).
+
+    Returns
+    -------
+    index: dict or None
+        {'gas': gsel, 'star': ssel}, None if the caesar file has no membership index yet
+
+    """
+    from galindex import load_member_index
+
+    try:
+        gidx = load_member_index(caesarFile, 'gas')
+        sidx = load_member_index(caesarFile, 'star')
+    except ValueError:
+        return None
+
+    keep = np.flatnonzero((gidx.counts >= part_threshold) & (sidx.counts >= part_threshold))
+    return {'gas': np.unique(np.asarray(gidx.subset(keep).members)),
+            'star': np.unique(np.asarray(sidx.subset(keep).members))}
+
+
+class FieldReader(object):
+
+    def __init__(self):
+        """ start the reader process; do this before starting any thread """
+        import multiprocessing as mp
+
+        ctx = mp.get_context('fork')
+        self._conn, child = ctx.Pipe()
+        self._proc = ctx.Process(target=_serve, args=(child,), daemon=True)
+        self._proc.start()
+        child.close()
+
+    def request(self, snapFile, requests, caesarFile=None, part_threshold=None):
+        """
+
+        Queue a snapshot to read. Results come back in the order of the requests, see result().
+
+        Parameters
+        ----------
+        snapFile: str
+
+        requests: list of tuple
+            (ptype, field) pairs, see snapio.readsnap_fields()
+
+        caesarFile: str or None
+            if given, only read the particles of the galaxies that have part_threshold gas and star particles, see selected_particles()
+
+        """
+        self._conn.send((snapFile, requests, caesarFile, part_threshold))
+
+    def result(self, snapFile=None):
+        """
+
+        Wait for the oldest request.
+
+        Parameters
+        ----------
+        snapFile: str or None
+            snapshot of the oldest request; a result of another snapshot means a result was not received and raises a RuntimeError
+
+        Returns
+        -------
+        blocks: list of SharedMemory
+            pass to sharedmem.free_shared_arrays() when done
+
+        fields: dict or None
+            (ptype, field) --> array, as snapio.readsnap_fields(units=1); None if nothing was read, see selected_particles()
+
+        index: dict or None
+            particles that were read per ptype, None for the whole box
+
+        """
+        from sharedmem import attach_shared_arrays
+
+        snap, keys, descr, tb = self._conn.recv()
+        if snapFile is not None and snap != snapFile:
+            raise RuntimeError("Prefetched fields of {:} arrived while waiting for {:}".format(snap, snapFile))
+        if tb is not None:
+            raise RuntimeError("Prefetching snapshot fields failed:\n" + tb)
+        if keys is None:
+            return [], None, None
+        blocks, shared = attach_shared_arrays(descr)
+        fields = {k: shared[i] for i, k in enumerate(keys)}
+
+        index = None
+        if ('index', 'gas') in fields:
+            index = {ptype: fields.pop(('index', ptype)) for ptype in ('gas', 'star')}
+        return blocks, fields, index
+
+    def close(self):
+        self._conn.send(None)
+        self._proc.join()
+        self._conn.close()
+
+
+class SnapshotPrefetch(object):
+
+    def __init__(self, reader, caesarFile, snapFile, requests, LoadHalo=False, selective=False, part_threshold=None):
+        """
+
+        Start loading one snapshot in the background.
+
+        Parameters
+        ----------
+        reader: FieldReader
+            reads the fields; shared by all prefetches of a run, which must be consumed in the order they were started
+
+        caesarFile, snapFile: str
+
+        requests: list of tuple
+            (ptype, field) pairs
+
+        LoadHalo: bool
+            passed to caesar.load()
+
+        selective, part_threshold:
+            see particles2pd selectiveRead
+        """
+        self.reader = reader
+        self.snapFile = snapFile
+        self.blocks = []
+        self._obj = None
+        self._error = None
+        self._fields = None
+
+        reader.request(snapFile, requests, caesarFile if selective else None, part_threshold)
+
+        self._thread = threading.Thread(target=self._load_caesar, args=(caesarFile, LoadHalo), daemon=True)
+        self._thread.start()
+
+    def _load_caesar(self, caesarFile, LoadHalo):
+        try:
+            import caesar
+            print("Loading Ceasar file: {:}".format(caesarFile))
+            self._obj = caesar.load(caesarFile, LoadHalo=LoadHalo)
+        except Exception:
+            self._error = traceback.format_exc()
+
+    def obj(self):
+        """ caesar obj, waiting for it if needed """
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("Prefetching caesar catalog failed:\n" + self._error)
+        return self._obj
+
+    def fields(self):
+        """
+
+        (fields, index) of FieldReader.result(), waiting for them if needed.
+
+        The result is taken from the reader only once, also if reading failed, so the results of the later prefetches stay in line.
+
+        """
+        if self._fields is None:
+            try:
+                self.blocks, fields, index = self.reader.result(self.snapFile)
+                self._fields = (fields, index)
+            except RuntimeError as e:
+                self._fields = e
+        if isinstance(self._fields, Exception):
+            raise self._fields
+        return self._fields
+
+    def free(self):
+        """ release the shared memory of the fields, receiving them first if fields() was never called """
+        from sharedmem import free_shared_arrays
+
+        if self._fields is None:
+            try:
+                self.fields()
+            except RuntimeError:
+                pass
+        free_shared_arrays(self.blocks)
+        self.blocks = []
+        self._obj = None
@@ -0,0 +1,107 @@
+"""
+
+Column dtypes of the .gas, .star and .dm DataFrames written by particles2pd, see particles2pd(outputSchema=...).
+
+The 'full' schema writes the columns as they come out of the extraction, mostly float64. The 'compact' schema casts every column to the dtype declared in COLUMN_DTYPES (float32 for all of them). In a GalaxyStore it also stores the columns of GALAXY_COLUMNS, which hold the same value for every particle of a galaxy, once per galaxy instead of once per particle (see galstore.py). Readers get back DataFrames with the same columns in the same order.
+
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+
+OUTPUT_SCHEMAS = ('full', 'compact')
+
+GAS_COLUMNS = ['x', 'y', 'z', 'vx', 'vy', 'vz', 'SFR', 'SFRsd_halfM', 'gasSD_halfM', 'Z', 'nH', 'Tk', 'h',
+               'f_HI1', 'f_neu', 'f_H21', 'm', 'a_He', 'a_C', 'a_N', 'a_O', 'a_Ne', 'a_Mg', 'a_Si', 'a_S', 'a_Ca', 'a_Fe']
+STAR_COLUMNS = ['x', 'y', 'z', 'vx', 'vy', 'vz', 'Z', 'm', 'age']
+DM_COLUMNS = ['x', 'y', 'z', 'vx', 'vy', 'vz', 'm']
+
+# ptype --> column --> dtype in the 'compact' schema
+COLUMN_DTYPES = {'gas': dict.fromkeys(GAS_COLUMNS, np.float32),
+                 'star': dict.fromkeys(STAR_COLUMNS, np.float32),
+                 'dm': dict.fromkeys(DM_COLUMNS, np.float32)}
+
+# ptype --> columns that are constant within a galaxy
+GALAXY_COLUMNS = {'gas': ['SFRsd_halfM', 'gasSD_halfM'], 'star': [], 'dm': []}
+
+
+def cast_frames(frames, dtypes=COLUMN_DTYPES):
+    """
+
+    Parameters
+    ----------
+    frames: dict
+        ptype --> DataFrame, e.g. {'gas': simgas, 'star': simstar, 'dm': simdm}
+
+    dtypes: dict
+        ptype --> column --> dtype; columns not listed are left as they are
+
+    Returns
+    -------
+    frames: dict
+        ptype --> DataFrame with the columns cast; columns already of the right dtype are not copied
+
+    """
+
+    out = {}
+    for ptype, df in frames.items():
+        cast = {col: dt for col, dt in dtypes.get(ptype, {}).items() if col in df.columns and df[col].dtype != dt}
+        out[ptype] = df.astype(cast, copy=False) if cast else df
+    return out
+
+
+def split_galaxy_columns(df, ptype):
+    """
+
+    Returns
+    -------
+    particles: DataFrame
+        df without the GALAXY_COLUMNS of ptype
+
+    values: dict
+        column --> the value of each GALAXY_COLUMNS column, taken from its first row (nan if df is empty)
+
+    """
+
+    cols = [col for col in GALAXY_COLUMNS.get(ptype, []) if col in df.columns]
+    values = {}
+    for col in cols:
+        data = df[col].values
+        values[col] = data[0] if len(data) else data.dtype.type(np.nan)
+    return df.drop(columns=cols), values
+
+
+def join_galaxy_columns(particles, values, columns):
+    """
+
+    Inverse of split_galaxy_columns().
+
+    Parameters
+    ----------
+    particles: dict
+        column --> array of the particles of one galaxy
+
+    values: dict
+        column --> galaxy-level value, repeated for every particle
+
+    columns: list of str
+        column order of the DataFrame
+
+    Returns
+    -------
+    df: DataFrame
+
+    """
+
+    import pandas as pd
+
+    n = len(next(iter(particles.values()))) if particles else 0
+    data = {}
+    for col in columns:
+        if col in particles:
+            data[col] = particles[col]
+        else:
+            v = np.asarray(values[col])
+            data[col] = np.full(n, v, dtype=v.dtype)
+    return pd.DataFrame(data, columns=columns)
@@ -39,7 +39,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import os
-import caesar
+from catalogs import catalog_table
 import function as fu
 
 nrowmax = 3
@@ -82,26 +82,26 @@ def sfrf_data(zbin, ax):
 def massFunc(objs, labels, ax, jwind, fill_between=True, showtitle=False):
     for j in range(0, len(objs)):
         for curType in TYPES:
-            galpos = np.array([g.pos.d for g in objs[j].galaxies])
+            # columns of catalogtable.py, see catalogs.catalog_table()
+            galpos = np.array(objs[j].galaxies['pos'])
             if curType == 'GSMF':
-                mass = np.array(
-                    [g.masses['stellar'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.stellar'])
             elif curType == 'HI':
-                mass = np.array([g.masses['HI'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.HI'])
             elif curType == 'H2':
-                mass = np.array([g.masses['H2'].d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['masses.H2'])
             elif curType == 'SFR':
-                mass = np.array([g.sfr.d for g in objs[j].galaxies])
+                mass = np.array(objs[j].galaxies['sfr'])
             elif curType == 'Halo':
-                mass = np.array([h.masses['virial'].d for h in objs[j].halos])
-                galpos = np.array([h.pos.d for h in objs[j].halos])
+                mass = np.array(objs[j].halos['masses.virial'])
+                galpos = np.array(objs[j].halos['pos'])
 
             # remove SFR = 0.0
             mask = mass > 0
             mass = mass[mask]
             galpos = galpos[mask, :]
 
-            volume = objs[j].simulation.boxsize.to('Mpccm').d**3
+            volume = objs[j].simulation.boxsize_Mpccm**3
             x, y, sig = fu.cosmic_variance(
                 mass, galpos, objs[j].simulation.boxsize, volume, nbin=16, minmass=-3)
             ncol = int((len(objs) - 1) / nrowmax + 1)
@@ -163,7 +163,7 @@ for ii, nn in enumerate(simName):
 
     else:
         caesarfile = '/mnt/ceph/users/daisyleung/simba/sim/' + nn + '/s50/Groups/' + nn + '_036.hdf5'
-    sims.append(caesar.load(caesarfile, LoadHalo=False))
+    sims.append(catalog_table(caesarfile))
 
 ncol = 1
 nrow = 1
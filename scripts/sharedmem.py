@@ -0,0 +1,86 @@
+"""
+
+Numpy arrays in multiprocessing.shared_memory, for extraction workers (see particles2pd.extract_parallel()) and snapshot prefetching (see prefetch.py).
+
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+
+def share_arrays(arrays):
+    """
+
+    Copy numpy arrays into multiprocessing.shared_memory blocks.
+
+    Parameters
+    ----------
+    arrays: dict
+        name --> array
+
+    Returns
+    -------
+    blocks: list of SharedMemory
+        keep these alive while the arrays are in use, then call free_shared_arrays()
+
+    shared: dict
+        name --> read-only array backed by shared memory
+
+    """
+    from multiprocessing import shared_memory
+
+    blocks = []
+    shared = {}
+    for k, v in arrays.items():
+        v = np.ascontiguousarray(v)
+        shm = shared_memory.SharedMemory(create=True, size=max(v.nbytes, 1))
+        blocks.append(shm)
+        arr = np.ndarray(v.shape, dtype=v.dtype, buffer=shm.buf)
+        arr[...] = v
+        arr.flags.writeable = False
+        shared[k] = arr
+    return blocks, shared
+
+
+def describe_shared(blocks, shared):
+    """ picklable (block name, shape, dtype) of each array from share_arrays(), to attach_shared_arrays() in another process """
+    return {k: (shm.name, v.shape, v.dtype.str) for shm, (k, v) in zip(blocks, shared.items())}
+
+
+def attach_shared_arrays(descr):
+    """
+
+    Map arrays shared by another process.
+
+    Parameters
+    ----------
+    descr: dict
+        from describe_shared()
+
+    Returns
+    -------
+    blocks, shared:
+        as share_arrays(); free_shared_arrays(blocks) releases them for good
+
+    """
+    from multiprocessing import shared_memory
+
+    blocks = []
+    shared = {}
+    for k, (name, shape, dtype) in descr.items():
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        arr.flags.writeable = False
+        shared[k] = arr
+    return blocks, shared
+
+
+def free_shared_arrays(blocks):
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:
+            # an array still points into the block; it is unmapped once that array is gone
+            pass
+        shm.unlink()
@@ -0,0 +1,160 @@
+"""
+
+Snapshot metadata straight from the HDF5 header of gizmo/gadget snapshots.
+
+Cosmology, redshift, box size, particle counts and mass table are read from the 'Header' attributes, which takes milliseconds, instead of loading the snapshot with yt or pygad. Headers and redshift tables are cached per path and re-read when the file changes.
+
+Snapshot wraps a header and only builds the yt dataset (Snapshot.ds) or pygad snapshot (Snapshot.pygad) when a caller asks for it, see parse_simba.define_ds().
+
+"""
+
+from __future__ import print_function, division
+import os
+import numpy as np
+
+
+# header attribute --> name in SnapHeader
+HEADER_ATTRS = {'Redshift': 'redshift',
+                'Time': 'scale_factor',
+                'HubbleParam': 'hubble',
+                'Omega0': 'omega_matter',
+                'OmegaBaryon': 'omega_baryon',
+                'OmegaLambda': 'omega_lambda',
+                'BoxSize': 'boxsize',
+                'MassTable': 'masstable',
+                'NumPart_Total': 'npart'}
+
+# path --> (mtime, value)
+_headers = {}
+_redshift_tables = {}
+
+
+class SnapHeader(dict):
+    """
+
+    Header of a snapshot as plain numbers, keys also being attributes (e.g. header.hubble):
+
+    redshift, scale_factor, hubble (h), omega_matter, omega_baryon, omega_lambda
+    boxsize: in code units, ckpc/h
+    masstable: (6,) in code units, 1e10 Msun/h; 0 for particle types with individual masses
+    npart: (6,) int, total number of particles of each type over all files of the snapshot
+    time: cosmic time in Myr, see cosmo.cosmic_time()
+
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def boxsize_Mpch(self):
+        return self['boxsize'] / 1.e3
+
+
+def _cached(cache, path, read):
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    if path not in cache or cache[path][0] != mtime:
+        cache[path] = (mtime, read(path))
+    return cache[path][1]
+
+
+def _read_header(snapFile):
+    import h5py
+    from cosmo import cosmic_time
+
+    with h5py.File(snapFile, 'r') as f:
+        attrs = dict(f['Header'].attrs)
+
+    header = SnapHeader()
+    for key, name in HEADER_ATTRS.items():
+        if key in attrs:
+            value = np.asarray(attrs[key])
+            header[name] = float(value) if value.ndim == 0 else value
+    if 'npart' in header:
+        npart = header['npart'].astype(np.int64)
+        if 'NumPart_Total_HighWord' in attrs:
+            # counts above 2^32 are split over two uint32
+            npart += np.asarray(attrs['NumPart_Total_HighWord'], dtype=np.int64) << 32
+        header['npart'] = npart
+    header['time'] = float(cosmic_time(header['scale_factor'], header['omega_matter'], header['hubble']))
+    return header
+
+
+def read_header(snapFile):
+    """
+
+    Parameters
+    ----------
+    snapFile: str
+        path to snapshot .hdf5
+
+    Returns
+    -------
+    header: SnapHeader
+        shared between calls, don't modify it
+
+    """
+    return _cached(_headers, snapFile, _read_header)
+
+
+def redshift_table(redshiftFile):
+    """
+
+    Returns
+    -------
+    zs_table, snaps_table: array
+        redshift and snapshot number of every output in redshiftFile, as np.loadtxt(redshiftFile, unpack=True)
+
+    """
+
+    def read(path):
+        _, zs_table, snaps_table = np.loadtxt(path, unpack=True)
+        return zs_table, snaps_table
+
+    return _cached(_redshift_tables, redshiftFile, read)
+
+
+def snap_redshift(redshiftFile, snap):
+    """ redshift of snapshot snap in redshiftFile, rounded to 3 decimals as in the galaxy names """
+    zs_table, snaps_table = redshift_table(redshiftFile)
+    return float('{:.3f}'.format(zs_table[snaps_table == snap][0]))
+
+
+class Snapshot(object):
+
+    def __init__(self, snapFile):
+        """
+
+        Parameters
+        ----------
+        snapFile: str
+            path to snapshot .hdf5
+
+        """
+        self.snapFile = snapFile
+        self.header = read_header(snapFile)
+        self._ds = None
+        self._pygad = None
+
+    @property
+    def ds(self):
+        """ yt dataset, loaded on first use """
+        if self._ds is None:
+            import yt
+            self._ds = yt.load(self.snapFile, over_refine_factor=1, index_ptype="all")
+        return self._ds
+
+    @property
+    def pygad(self):
+        """ pygad.Snap, loaded on first use """
+        if self._pygad is None:
+            import pygad as pg
+            self._pygad = pg.Snap(self.snapFile)
+        return self._pygad
+
+    @property
+    def h(self):
+        return self.header.hubble
@@ -0,0 +1,338 @@
+"""
+
+Read gizmo/gadget HDF5 snapshots without going through readsnap() once per field.
+
+The snapshot is opened once and every requested (ptype, field) pair is read in the same pass. Field names and unit conversions follow readgadget, so readsnap_fields(snapFile, [('gas', 'rho')], units=1) gives the same array as readsnap(snapFile, 'rho', 'gas', units=1).
+
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import h5py
+
+
+PTYPES = {'gas': 0, 'dm': 1, 'disk': 2, 'bulge': 3, 'star': 4, 'bndry': 5}
+
+# readgadget short names --> HDF5 dataset names; anything else is passed through as is
+FIELDS = {'pos': 'Coordinates',
+          'vel': 'Velocities',
+          'pid': 'ParticleIDs',
+          'mass': 'Masses',
+          'u': 'InternalEnergy',
+          'rho': 'Density',
+          'ne': 'ElectronAbundance',
+          'nh': 'NeutralHydrogenAbundance',
+          'hsml': 'SmoothingLength',
+          'sfr': 'StarFormationRate',
+          'age': 'StellarFormationTime',
+          'metals': 'Metallicity',
+          'fH2': 'FractionH2'}
+
+# code units of gizmo: 1e10 Msun/h, ckpc/h, km/s
+UnitMass_in_g = 1.989e43
+UnitLength_in_cm = 3.085678e21
+UnitVelocity_in_cm_per_s = 1.e5
+UnitDensity_in_cgs = UnitMass_in_g / UnitLength_in_cm**3
+
+PROTONMASS = 1.6726e-24
+BOLTZMANN = 1.3806e-16
+GAMMA = 5. / 3.
+H_MASSFRAC = 0.76
+
+
+def ptype_group(ptype):
+    """
+    HDF5 group name of a readgadget particle type, e.g. 'gas' --> 'PartType0'
+    """
+    if ptype not in PTYPES:
+        raise KeyError("Unclear ptype: {:}".format(ptype))
+    return 'PartType' + str(PTYPES[ptype])
+
+
+def convert_units(field, data, ne=None):
+    """
+
+    Convert a field from code units the same way readsnap(units=1) does.
+
+    Parameters
+    ----------
+    field: str
+        readgadget short name, e.g. 'rho', 'u', 'mass'
+
+    data: array
+        field in code units
+
+    ne: array
+        electron abundance of the same particles, only needed for 'u'
+
+    Returns
+    -------
+    data: array
+        'mass' in Msun/h, 'rho' in comoving h^2 g/cm^3, 'u' as temperature in K; all other fields are returned unchanged.
+
+    """
+
+    if field == 'mass':
+        data = data * 1.e10
+    elif field == 'rho':
+        data = data * UnitDensity_in_cgs
+    elif field == 'u':
+        if ne is None:
+            ne = 0.0
+        MeanWeight = 4.0 / (3. * H_MASSFRAC + 1. + 4. * H_MASSFRAC * ne) * PROTONMASS
+        data = data * UnitVelocity_in_cm_per_s**2 * MeanWeight * (GAMMA - 1.) / BOLTZMANN
+    return data
+
+
+def index_runs(index, gap=0):
+    """
+
+    Turn particle indices into contiguous runs that can be read as HDF5 slabs.
+
+    Parameters
+    ----------
+    index: array of int
+        particle indices, need not be sorted or unique
+
+    gap: int
+        runs separated by at most this many unwanted particles are merged into one slab; trades a bit of extra I/O for fewer read calls
+
+    Returns
+    -------
+    starts, stops: array of int
+        run i covers particles starts[i] <= k < stops[i]
+
+    """
+
+    index = np.unique(np.asarray(index, dtype=np.int64))
+    if len(index) == 0:
+        return index, index
+
+    breaks = np.flatnonzero(np.diff(index) > gap + 1) + 1
+    starts = index[np.r_[0, breaks]]
+    stops = index[np.r_[breaks - 1, len(index) - 1]] + 1
+    return starts, stops
+
+
+def read_index(dset, index, gap=0):
+    """
+
+    Read only the rows of an HDF5 dataset listed in index, slab by slab.
+
+    Parameters
+    ----------
+    dset: h5py.Dataset
+
+    index: array of int
+        sorted, unique particle indices
+
+    gap: int
+        see index_runs()
+
+    Returns
+    -------
+    data: array
+        rows of dset in the order of index
+
+    """
+
+    out = np.empty((len(index),) + dset.shape[1:], dtype=dset.dtype)
+    starts, stops = index_runs(index, gap=gap)
+    lo = np.searchsorted(index, starts)
+    hi = np.searchsorted(index, stops)
+    for a, b, i, j in zip(starts, stops, lo, hi):
+        if j - i == b - a:
+            out[i:j] = dset[a:b]
+        else:
+            out[i:j] = dset[a:b][index[i:j] - a]
+    return out
+
+
+def read_chunked(dset, index=None, chunkbytes=64.e6, convert=None):
+    """
+
+    Read rows of an HDF5 dataset in pieces of at most chunkbytes, so the temporary memory of the read stays bounded however the rows are spread over the file.
+
+    Parameters
+    ----------
+    dset: h5py.Dataset
+
+    index: array of int or None
+        sorted, unique rows to read; None for all rows
+
+    chunkbytes: float
+        size of the file range read by one HDF5 call
+
+    convert: callable or None
+        convert(block, i, j) is applied to each piece before it is stored as rows i:j of data, e.g. a unit conversion
+
+    Returns
+    -------
+    data: array
+        rows of dset in the order of index
+
+    """
+
+    nrows = max(1, int(chunkbytes // max(1, dset.dtype.itemsize * int(np.prod(dset.shape[1:])))))
+    n = dset.shape[0] if index is None else len(index)
+    out = np.empty((n,) + dset.shape[1:], dtype=dset.dtype)
+
+    i = 0
+    while i < n:
+        if index is None:
+            j = min(i + nrows, n)
+            block = dset[i:j]
+        else:
+            # selected rows in the next chunk of the file, starting at the next selected row
+            a = index[i]
+            j = int(np.searchsorted(index, a + nrows))
+            b = index[j-1] + 1
+            if 4 * (j - i) < b - a:
+                # sparse, read the runs only
+                block = read_index(dset, index[i:j])
+            else:
+                block = dset[a:b]
+                if j - i < b - a:
+                    block = block[index[i:j] - a]
+        out[i:j] = block if convert is None else convert(block, i, j)
+        i = j
+    return out
+
+
+def particle_nbytes(snapFile, requests):
+    """
+
+    Memory of the requested fields per particle, as read by readsnap_fields().
+
+    Returns
+    -------
+    nbytes: dict
+        ptype --> bytes per particle
+
+    """
+
+    nbytes = {}
+    with h5py.File(snapFile, 'r') as f:
+        for ptype, field in set(requests):
+            group, dset = ptype_group(ptype), FIELDS.get(field, field)
+            if group in f and dset in f[group]:
+                d = f[group][dset]
+                size = d.dtype.itemsize * int(np.prod(d.shape[1:]))
+            else:
+                # e.g. masses from the MassTable, read as float64
+                size = 8
+            nbytes[ptype] = nbytes.get(ptype, 0) + size
+    return nbytes
+
+
+def local_index(selected, index):
+    """
+    Position of particle indices inside an array read with readsnap_fields(..., index={ptype: selected}).
+    """
+    return np.searchsorted(selected, index)
+
+
+def readsnap_fields(snapFile, requests, units=1, index=None, gap=0, chunkbytes=None, verbose=False):
+    """
+
+    Read several fields of a snapshot in a single pass over the file.
+
+    Parameters
+    ----------
+    snapFile: str
+        path to snapshot .hdf5
+
+    requests: list of tuple
+        (ptype, field) pairs, e.g. [('gas', 'rho'), ('gas', 'u'), ('star', 'age')]. ptype is one of PTYPES, field is a readgadget short name (see FIELDS) or an HDF5 dataset name.
+
+    units: int
+        1 to convert to physical units as readsnap(units=1), 0 to return code units
+
+    index: dict or None
+        {ptype: particle indices}; only these particles are read for that ptype, e.g. the union of glist of the galaxies we keep. Peak memory then scales with the selected particles instead of the box. Other ptypes are read in full.
+
+    gap: int
+        see index_runs()
+
+    chunkbytes: float or None
+        if given, read each field in pieces of at most this many bytes of the file and convert units piece by piece (see read_chunked()), instead of slab by slab
+
+    Returns
+    -------
+    out: dict
+        keyed by (ptype, field), each value a numpy array in the particle order of the snapshot. For a ptype in index, rows follow np.unique(index[ptype]); use local_index() to find a galaxy's particles.
+
+    NOTE
+    ----
+    Particle masses that are only stored in the header MassTable (e.g. DM) are expanded to one value per particle.
+
+    """
+
+    out = {}
+    with h5py.File(snapFile, 'r') as f:
+        header = f['Header'].attrs
+        npart = header['NumPart_ThisFile']
+        masstable = header['MassTable']
+
+        if index is None:
+            index = {}
+        index = {k: np.unique(np.asarray(v, dtype=np.int64)) for k, v in index.items()}
+
+        for ptype, field in requests:
+            if (ptype, field) in out:
+                continue
+
+            group = ptype_group(ptype)
+            dset = FIELDS.get(field, field)
+
+            sel = index.get(ptype)
+            n = npart[PTYPES[ptype]] if sel is None else len(sel)
+
+            converted = False
+            if group in f and dset in f[group]:
+                if n == 0:
+                    # keep the trailing shape, e.g. (0, 3) for positions
+                    data = np.empty((0,) + f[group][dset].shape[1:], dtype=f[group][dset].dtype)
+                elif chunkbytes is None:
+                    data = _read(f[group][dset], sel, gap)
+                else:
+                    convert = None
+                    if units:
+                        ne = _electron_abundance(f, out, ptype, field, sel, gap, chunkbytes)
+                        convert = lambda block, i, j, field=field, ne=ne: convert_units(field, block, ne=None if ne is None else ne[i:j])
+                    data = read_chunked(f[group][dset], sel, chunkbytes, convert=convert)
+                    converted = True
+            elif n == 0:
+                data = np.array([])
+            elif field == 'mass':
+                data = np.full(n, masstable[PTYPES[ptype]])
+            else:
+                raise KeyError("{:} has no field {:}/{:}".format(snapFile, group, dset))
+
+            if units and not converted:
+                ne = _electron_abundance(f, out, ptype, field, sel, gap, chunkbytes)
+                data = convert_units(field, data, ne=ne)
+
+            if verbose:
+                print("Read {:} {:} from {:}: {:} particles".format(ptype, field, snapFile, len(data)))
+            out[(ptype, field)] = data
+
+    return out
+
+
+def _read(dset, sel, gap, chunkbytes=None):
+    if chunkbytes is not None:
+        return read_chunked(dset, sel, chunkbytes)
+    if sel is None:
+        return dset[...]
+    return read_index(dset, sel, gap=gap)
+
+
+def _electron_abundance(f, out, ptype, field, sel, gap, chunkbytes):
+    # 'u' of gas needs ne for the temperature, see convert_units()
+    if field != 'u' or ptype != 'gas':
+        return None
+    ne = out.get(('gas', 'ne'))
+    if ne is None:
+        ne = _read(f[ptype_group('gas')][FIELDS['ne']], sel, gap, chunkbytes)
+    return ne
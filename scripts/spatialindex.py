@@ -0,0 +1,258 @@
+"""
+
+Periodic KD-tree over the particles of one type in a snapshot, for cutting spheres around many galaxies at once.
+
+The tree (scipy.spatial.cKDTree with boxsize, so distances wrap around the box) is built from the snapshot coordinates in code units (ckpc/h), pickled and loaded from there later, as for the membership index of the caesar catalog (galindex.py):
+
+    <treeDir or snapshot directory>/<snapshot file name without .hdf5>_<ptype>_tree.pkl
+
+The pickle holds the coordinates (float64), the particle order and the nodes of the tree, about TREE_BYTES_PER_PARTICLE (38) bytes per particle of ptype in the box: some 640 MB for the 256^3 DM particles of m25n256, 5 GB for m50n512 and 40 GB for m100n1024, compared to 8 bytes per member for the membership index. The same is needed in memory. Delete it to free the disk space; it is rebuilt on the next use.
+
+build_region_tree() instead reads the coordinates in chunks and only keeps the particles near a given set of galaxies, so its memory scales with the volume of the galaxies instead of the box. It is not saved, since it depends on the galaxies.
+
+ParticleTree.query_balls() answers the ball queries of all galaxies in one call and returns a galindex.MemberIndex, whose members can be read with snapio.readsnap_fields(index=...) and gathered per galaxy. This gives particles that caesar has no member list for, e.g. the DM around a galaxy.
+
+"""
+
+from __future__ import print_function, division
+import os
+import pickle
+import numpy as np
+
+
+# memory and pickle size of a full tree per particle: float64 coordinates, int64 particle order and the nodes
+TREE_BYTES_PER_PARTICLE = 38
+
+class ParticleTree(object):
+
+    def __init__(self, tree, boxsize, ptype, rows=None):
+        """
+
+        Parameters
+        ----------
+        tree: scipy.spatial.cKDTree
+            built with boxsize, over all particles of ptype in file order, or over the particles in rows
+
+        boxsize: float
+            in the units of the tree, ckpc/h for snapshot coordinates
+
+        ptype: str
+            readgadget particle type, e.g. 'dm'
+
+        rows: array of int or None
+            sorted particle indices of the points of tree, see build_region_tree(); None if tree holds all particles
+
+        """
+        self.tree = tree
+        self.boxsize = boxsize
+        self.ptype = ptype
+        self.rows = rows
+
+    def __len__(self):
+        return self.tree.n
+
+    def query_balls(self, centers, radii, workers=-1):
+        """
+
+        Particles within radii of centers, for all centers in one call.
+
+        Parameters
+        ----------
+        centers: array
+            (ngalaxies, 3) in the units of the tree; wrapped into the box
+
+        radii: float or array
+            (ngalaxies,) in the units of the tree
+
+        workers: int
+            threads of the query, -1 for all cores
+
+        Returns
+        -------
+        idx: galindex.MemberIndex
+            particle indices (rows of the snapshot fields of ptype) within each ball, sorted per galaxy; a particle can be in several balls
+
+        """
+
+        from galindex import MemberIndex
+
+        centers = np.mod(np.asarray(centers, dtype=np.float64).reshape(-1, 3), self.boxsize)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(centers),))
+        balls = self.tree.query_ball_point(centers, radii, return_sorted=True, workers=workers)
+
+        counts = np.array([len(b) for b in balls], dtype=np.int64)
+        offsets = np.zeros(len(centers) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        members = np.empty(offsets[-1], dtype=np.int64)
+        for i, b in enumerate(balls):
+            members[offsets[i]:offsets[i+1]] = b
+        if self.rows is not None:
+            # rows is sorted, so the members stay sorted per galaxy
+            members = self.rows[members]
+        return MemberIndex(members, offsets, self.ptype)
+
+
+def periodic_offsets(pos, center, boxsize):
+    """
+
+    Positions relative to center, wrapped to the nearest periodic image.
+
+    Parameters
+    ----------
+    pos: array
+        (N, 3)
+
+    center: array
+        (3,) or (N, 3)
+
+    boxsize: float
+        in the units of pos
+
+    Returns
+    -------
+    dx: array
+        (N, 3), each component in [-boxsize/2, boxsize/2]
+
+    """
+    dx = pos - center
+    dx -= boxsize * np.round(dx / boxsize)
+    return dx
+
+
+def build_particle_tree(snapFile, ptype, leafsize=32):
+    """
+
+    Read the coordinates of ptype and build the periodic tree.
+
+    Parameters
+    ----------
+    snapFile: str
+        path to snapshot .hdf5
+
+    ptype: str
+        e.g. 'dm', 'gas', 'star'
+
+    Returns
+    -------
+    tree: ParticleTree
+        in ckpc/h
+
+    """
+
+    from scipy.spatial import cKDTree
+    from snapio import readsnap_fields
+    from snapheader import read_header
+
+    boxsize = read_header(snapFile).boxsize
+    pos = readsnap_fields(snapFile, [(ptype, 'pos')], units=1)[(ptype, 'pos')]
+    # cKDTree needs 0 <= pos < boxsize
+    pos = np.mod(np.asarray(pos, dtype=np.float64), boxsize)
+    tree = cKDTree(pos, leafsize=leafsize, boxsize=boxsize, balanced_tree=False, compact_nodes=False)
+    return ParticleTree(tree, boxsize, ptype)
+
+
+def build_region_tree(snapFile, ptype, centers, radii, chunkbytes=64.e6, leafsize=32):
+    """
+
+    Periodic tree over only the particles of ptype within max(radii) of any of centers. The coordinates are read in pieces of at most chunkbytes of the file, so memory scales with the particles that are kept, not with the box.
+
+    Parameters
+    ----------
+    snapFile: str
+        path to snapshot .hdf5
+
+    ptype: str
+
+    centers: array
+        (ngalaxies, 3) in ckpc/h
+
+    radii: float or array
+        (ngalaxies,) in ckpc/h; the balls that will be queried, see ParticleTree.query_balls()
+
+    chunkbytes: float
+        size of the file range read at a time
+
+    Returns
+    -------
+    tree: ParticleTree
+        in ckpc/h, with rows set; gives the same query_balls() as the tree of all particles for balls within radii of centers
+
+    """
+
+    import h5py
+    from scipy.spatial import cKDTree
+    from snapio import ptype_group, FIELDS
+    from snapheader import read_header
+
+    boxsize = read_header(snapFile).boxsize
+    centers = np.mod(np.asarray(centers, dtype=np.float64).reshape(-1, 3), boxsize)
+    rmax = float(np.max(radii)) if len(centers) else 0.
+    galtree = cKDTree(centers, boxsize=boxsize) if len(centers) else None
+
+    keep, kept = [], []
+    with h5py.File(snapFile, 'r') as f:
+        group = ptype_group(ptype)
+        dset = f[group][FIELDS['pos']] if group in f else np.empty((0, 3))
+        nrows = max(1, int(chunkbytes // (dset.dtype.itemsize * 3)))
+        for a in range(0, dset.shape[0] if galtree is not None else 0, nrows):
+            pos = np.mod(np.asarray(dset[a:a+nrows], dtype=np.float64), boxsize)
+            # distance to the nearest galaxy, inf beyond rmax; slightly larger, so particles on the edge of a ball aren't lost to rounding
+            d, _ = galtree.query(pos, distance_upper_bound=rmax * (1. + 1.e-9) + 1.e-12)
+            near = np.flatnonzero(np.isfinite(d))
+            keep.append(a + near)
+            kept.append(pos[near])
+
+    rows = np.concatenate(keep + [np.empty(0, dtype=np.int64)]).astype(np.int64)
+    pos = np.concatenate(kept + [np.empty((0, 3))])
+    tree = cKDTree(pos, leafsize=leafsize, boxsize=boxsize, balanced_tree=False, compact_nodes=False)
+    return ParticleTree(tree, boxsize, ptype, rows=rows)
+
+
+def tree_file(snapFile, ptype, treeDir=None):
+    """ pickle holding the tree of ptype in treeDir, next to the snapshot if None; about 38 bytes per particle of ptype """
+    fname = os.path.splitext(os.path.basename(snapFile))[0] + '_' + ptype + '_tree.pkl'
+    return os.path.join(os.path.dirname(snapFile) if treeDir is None else treeDir, fname)
+
+
+def save_particle_tree(tree, snapFile, treeDir=None):
+    """ pickle tree to tree_file(); written to a temp file first, so a half-written tree is never picked up """
+    fname = tree_file(snapFile, tree.ptype, treeDir)
+    with open(fname + '.tmp', 'wb') as f:
+        pickle.dump(tree, f, protocol=4)
+    os.replace(fname + '.tmp', fname)
+
+
+def load_particle_tree(snapFile, ptype, treeDir=None):
+    """
+
+    Load the tree of ptype, building and saving it on first use.
+
+    Parameters
+    ----------
+    snapFile: str
+        path to snapshot .hdf5
+
+    ptype: str
+
+    treeDir: str or None
+        directory of the pickle, e.g. the output directory when the simulation directory is read-only; None for the directory of snapFile
+
+    Returns
+    -------
+    tree: ParticleTree
+
+    """
+
+    fname = tree_file(snapFile, ptype, treeDir)
+    if os.path.exists(fname) and os.path.getmtime(fname) >= os.path.getmtime(snapFile):
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+
+    print("Building {:} tree of {:}".format(ptype, snapFile))
+    tree = build_particle_tree(snapFile, ptype)
+    try:
+        save_particle_tree(tree, snapFile, treeDir)
+    except (IOError, OSError) as e:
+        # e.g. no write permission in treeDir; keep the tree in memory
+        print("Could not save {:} tree: {:}".format(ptype, e))
+    return tree
@@ -13,6 +13,17 @@ so then gas_f_neu wouldn't be useful anymore.
 from __future__ import print_function, division
 from astropy import constants as constants
 from readgadget import *
+from snapio import readsnap_fields, local_index, particle_nbytes
+from galindex import load_member_index, batch_galaxies, segment_reduce
+from manifest import ExtractionManifest, atomic_to_pickle
+from asyncwrite import AsyncWriter, frames_nbytes
+from sharedmem import share_arrays, free_shared_arrays
+from cosmo import stellar_ages
+from rotation import rotate_segments
+from galcatalog import EXTRACTED_COLUMNS, bh_properties, build_catalog, write_catalog, merge_catalogs
+from aperture import surface_densities
+from spatialindex import load_particle_tree, build_region_tree, periodic_offsets, TREE_BYTES_PER_PARTICLE
+from schema import OUTPUT_SCHEMAS, cast_frames
 
 # for consistency, will use python 3 for all scripts of this project.
 import sys
@@ -29,7 +40,10 @@ import caesar
 import matplotlib.pyplot as plt
 
 
-def get_partmasses_from_snapshot(snapFile: str, obj, ptype: str, physicalUnit: bool=True, verbose:bool=False):
+SolarAbundances = np.array([0.0134, 0.2485, 2.38e-3, 0.70e-3, 5.79e-3, 1.26e-3,
+                            7.14e-4, 6.17e-4, 3.12e-4, 0.65e-4, 1.31e-3])
+
+def get_partmasses_from_snapshot(snapFile: str, obj, ptype: str, physicalUnit: bool=True, verbose:bool=False, index=None):
     """
 
     Use readgadget to read in the info of each particles.
@@ -46,6 +60,9 @@ def get_partmasses_from_snapshot(snapFile: str, obj, ptype: str, physicalUnit: b
     physicalUnits: bool
         should be True in most cases
 
+    index: array of int or None
+        if given, only read these particles (e.g. union of glist of selected galaxies) instead of the whole box. m is then ordered as np.unique(index).
+
     Returns
     -------
     m: array
@@ -67,6 +84,13 @@ def get_partmasses_from_snapshot(snapFile: str, obj, ptype: str, physicalUnit: b
 
     h = obj.simulation.hubble_constant
 
+    if index is not None:
+        if ptype == 'dust':
+            m = readsnap_fields(snapFile, [('gas', 'Dust_Masses')], units=0, index={'gas': index})[('gas', 'Dust_Masses')]*1.e10/h
+        else:
+            m = readsnap_fields(snapFile, [(ptype, 'mass')], units=units, index={ptype: index})[(ptype, 'mass')]/h
+        return m
+
     if ptype == 'dm':
         try:
             m = readsnap(snapFile,'mass','dm',units=units)/h
@@ -88,18 +112,71 @@ def get_partmasses_from_snapshot(snapFile: str, obj, ptype: str, physicalUnit: b
     return m
 
 
-def group_part_by_galaxy(snapPart, galaxy, ptype):
+def group_part_by_galaxy(snapPart, galaxy, ptype, sel=None):
     """
         take an array of particles and then return an array containing only the particles that belong to the given galaxy.
+
+        sel: sorted particle indices snapPart was read with (selective read), None if snapPart covers the whole box.
+    """
+
+    if ptype == 'gas':
+        plist = galaxy.glist
+    elif ptype == 'star':
+        plist = galaxy.slist
+    elif ptype == 'bh':
+        plist = galaxy.bhlist
+    else:
+        raise NotImplemented("Unclear ptype")
+
+    plist = np.asarray(plist, dtype=np.int64)
+    if sel is not None:
+        plist = local_index(sel, plist)
+    return snapPart[plist]
+
+
+def gather_galaxy_fields(fields, galaxy, ptype, sel=None):
+    """
+
+    Gather several snapshot fields for the particles of one galaxy, with one fancy-index per field.
+
+    Parameters
+    ----------
+    fields: dict, list or array
+        snapshot fields (1-D or N-D, e.g. the 11 columns of gas metals), keyed by name if a dict
+
+    galaxy: caesar galaxy object
+
+    ptype: str
+        'gas', 'star' or 'bh'
+
+    sel: array of int or None
+        see group_part_by_galaxy()
+
+    Returns
+    -------
+    out: dict, list or array
+        same structure as fields (struct-of-arrays), holding only the particles of galaxy
+
     """
 
     if ptype == 'gas':
-        snapPart = np.array([snapPart[k] for k in galaxy.glist])
+        plist = galaxy.glist
     elif ptype == 'star':
-        snapPart = np.array([snapPart[k] for k in galaxy.slist])
+        plist = galaxy.slist
+    elif ptype == 'bh':
+        plist = galaxy.bhlist
     else:
         raise NotImplemented("Unclear ptype")
-    return snapPart
+
+    plist = np.asarray(plist, dtype=np.int64)
+    if sel is not None:
+        plist = local_index(sel, plist)
+
+    if isinstance(fields, dict):
+        return {k: v[plist] for k, v in fields.items()}
+    elif isinstance(fields, (list, tuple)):
+        return [v[plist] for v in fields]
+    return fields[plist]
 
 
 
@@ -125,10 +202,39 @@ def check_dense_gas(dir='./'):
     return None
 
 
+# state of a forked extraction worker, see particles2pd.extract_parallel()
+_worker = {}
+
+
+def _init_extract_worker(pp, gasFields, starFields, gsel, ssel, savepath, emptyDM, caesarRotate, write, surfaceDensities, dmParticles):
+    _worker.update(pp=pp, gasFields=gasFields, starFields=starFields, gsel=gsel, ssel=ssel,
+                   savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, write=write, surfaceDensities=surfaceDensities,
+                   dmParticles=dmParticles)
+
+
+def _run_snapshot(pp, idx, kwargs, results):
+    """ one snapshot of particles2pd.run_snapshots(), in its own process """
+    import traceback
+    try:
+        pp.load_obj_snap(idx, LoadHalo=kwargs.pop('LoadHalo'))
+        gnames, zred = pp.main_proc(**kwargs)
+        # exceptions need not be picklable
+        errors = [(name, repr(e), tb) for name, e, tb in pp.writeErrors]
+        results.put((idx, gnames, zred, errors, None))
+    except Exception:
+        results.put((idx, None, None, [], traceback.format_exc()))
+
+
+def _extract_worker(gg):
+    w = _worker
+    pp = w['pp']
+    return pp.extract_galaxy(gg, pp.obj.galaxies[gg], w['gasFields'], w['starFields'], w['gsel'], w['ssel'], w['savepath'], w['emptyDM'], w['caesarRotate'], write=w['write'], surfaceDensity=w['surfaceDensities'].get(gg), dm=w['dmParticles'].get(gg))
+
+
 class particles2pd(object):
 
 
-    def __init__(self, snapRange=[36], name_prefix='m25n1024_', feedback='s50/', zCloudy=6, part_threshold=64, sfr_threshold=0.1, denseGasThres=1.e5, user='Daisy', debug=False, verbose=True):
+    def __init__(self, snapRange=[36], name_prefix='m25n1024_', feedback='s50/', zCloudy=6, part_threshold=64, sfr_threshold=0.1, denseGasThres=1.e5, user='Daisy', selectiveRead=False, nproc=1, outputFormat='pickle', nwriter=1, writeBufferMB=1024, outOfCoreGB=None, chunkMB=64, catalogFormat='pickle', outputSchema='full', compression=None, debug=False, verbose=True):
         """
 
         Parameters
@@ -153,6 +259,36 @@ class particles2pd(object):
 
         denseGasThres: float
             min. gas in dense phase in Msun in order for a galaxy to be included. If too small, we won't be able to do GMC subgridding.
+
+        selectiveRead: bool
+            if True, only read the gas and star particles belonging to galaxies that pass part_threshold, as contiguous HDF5 slabs, instead of the whole box. Needed for m100n1024 on a normal node.
+
+        nproc: int
+            number of worker processes extracting galaxies of a snapshot in parallel; 1 to run serially
+
+        outputFormat: str
+            'pickle' to write .gas, .star, .dm pickles per galaxy, 'hdf5' to write all galaxies of a snapshot and gal_catalog into one file, see galstore.py and def_storeFileName()
+
+        nwriter: int
+            number of background threads writing finished galaxies while the next one is extracted; 0 to write them in the galaxy loop
+
+        writeBufferMB: float
+            max. memory of finished galaxies waiting to be written; extraction pauses when the writers fall behind that much
+
+        outOfCoreGB: float or None
+            if given, extract out of core: galaxies are planned and extracted in batches whose particle fields fit in this many GB, see stream_batches(), and only the particles of each batch are read. For boxes whose selected particles don't fit in memory at once (e.g. m100n1024).
+
+        chunkMB: float
+            with outOfCoreGB, snapshot fields are read in pieces of at most this many MB of the file, see snapio.read_chunked()
+
+        catalogFormat: str
+            'pickle' to write gal_catalog.pkl, 'parquet' to write gal_catalog.parquet (needs pyarrow); also the catalog of each snapshot, gal_catalog_s<snap>. See galcatalog.py
+
+        outputSchema: str
+            'full' to write the particle columns as extracted, 'compact' to write them as float32 and, with outputFormat 'hdf5', to store galaxy-constant columns (SFRsd_halfM, gasSD_halfM) once per galaxy; see schema.py
+
+        compression: str or None
+            with outputFormat 'hdf5', codec of the particle tables of the GalaxyStore, e.g. 'lzf', 'gzip' or, with hdf5plugin, 'blosc-lz4', 'blosc-zstd', 'zstd', 'lz4'; see galstore.CODECS and bench_codecs.py. Pickles are not compressed, SIGAME reads them directly
         """
 
         self.Mp = 1.67262189821e-24
@@ -171,9 +307,41 @@ class particles2pd(object):
         self.denseGasThres = denseGasThres       # Msun
 
         self.user = user
+        self.selectiveRead = selectiveRead
+        self.nproc = nproc
+        if outputFormat not in ('pickle', 'hdf5'):
+            raise ValueError("Unclear outputFormat: {:}".format(outputFormat))
+        self.outputFormat = outputFormat
+        if catalogFormat not in ('pickle', 'parquet'):
+            raise ValueError("Unclear catalogFormat: {:}".format(catalogFormat))
+        self.catalogFormat = catalogFormat
+        if outputSchema not in OUTPUT_SCHEMAS:
+            raise ValueError("Unclear outputSchema: {:}".format(outputSchema))
+        self.outputSchema = outputSchema
+        if compression is not None and outputFormat != 'hdf5':
+            raise ValueError("compression needs outputFormat 'hdf5'")
+        self.compression = compression
+        self.nwriter = nwriter
+        self.writeBufferMB = writeBufferMB
+        self.outOfCoreGB = outOfCoreGB
+        self.chunkMB = chunkMB
+        self.writeErrors = []
+        self.prefetchedFields = None
+        self.prefetchedIndex = None
 
         self.debug = debug
         self.verbose = verbose
+
+        # every snapshot field main_proc() needs, read in one pass by readsnap_fields()
+        self.snap_requests = [('gas', 'rho'), ('gas', 'mass'), ('gas', 'u'),
+                              ('gas', 'sfr'), ('gas', 'metals'), ('gas', 'hsml'),
+                              ('gas', 'pos'), ('gas', 'vel'), ('gas', 'fH2'),
+                              ('gas', 'nh'), ('gas', 'ne'),
+                              ('star', 'mass'), ('star', 'pos'), ('star', 'vel'),
+                              ('star', 'Metallicity'), ('star', 'age'),
+                              ('bndry', 'BH_Mdot'), ('bndry', 'BH_Mass')]
+        # gas fields plan_galaxies() selects on
+        self.plan_requests = [('gas', 'mass'), ('gas', 'sfr'), ('gas', 'fH2')]
         self.setup()
 
     def setup(self):
@@ -215,12 +383,22 @@ class particles2pd(object):
         return snapfile
 
 
-    def load_obj_snap(self, idx, redshiftDecimal=2, LoadHalo=False):
+    def load_obj_snap(self, idx, redshiftDecimal=2, LoadHalo=False, prefetched=None):
         self.snap = self.snapRange[idx]
 
         infile = self.def_caesarFileName()
-        print("Loading Ceasar file: {:}".format(infile))
-        self.obj = caesar.load(infile, LoadHalo=LoadHalo)
+        self.prefetchedFields, self.prefetchedIndex = None, None
+        if prefetched is not None:
+            # loaded in the background, see run_prefetched(); the fields first, so they are taken from the reader even if the catalog failed
+            self.prefetchedFields, self.prefetchedIndex = prefetched.fields()
+            self.obj = prefetched.obj()
+        else:
+            print("Loading Ceasar file: {:}".format(infile))
+            self.obj = caesar.load(infile, LoadHalo=LoadHalo)
+
+        self.caesarFile = infile
+        self.memberIndex = {}
+        self.particleTrees = {}
 
         self.h = self.obj.simulation.hubble_constant
         # self.redshift = np.round(self.obj.simulation.redshift, redshiftDecimal)
@@ -230,7 +408,7 @@ class particles2pd(object):
         self.snapFile = self.def_snapFileName()
 
 
-    def run(self, savepath=None, outname=None, emptyDM=True, caesarRotate=False, LoadHalo=False):
+    def run(self, savepath=None, outname=None, emptyDM=True, caesarRotate=False, LoadHalo=False, resume=False, nsnap=1, memBudgetGB=None, prefetch=0):
         """
         Loop through snapRange and run main_proc()
 
@@ -242,6 +420,7 @@ class particles2pd(object):
 
         emptyDM: bool
             if True, will create empty holders as DM position, mass, velocity to save as pandas dataframe. Do so because we don't have a dmlist from caesar catalog and we don't need it really.
+            If False, the DM particles within gal.radii['total'] of each galaxy are extracted, found with a periodic KD-tree of the snapshot (see galaxy_dm()). Without selectiveRead or outOfCoreGB, the tree of the full box is pickled to savepath.
 
         outname: str
             path to where zx_extracted_gals is stored for global_results.py to read
@@ -252,101 +431,554 @@ class particles2pd(object):
         LoadHalo: bool
             True so that we can crosslink galaxy properties (e.g., whether it's a central) to sigame output via galname
 
+        resume: bool
+            if True, continue an interrupted run: galaxies recorded in the manifest of each snapshot with intact output files are not extracted again, see main_proc()
+
+        nsnap: int
+            number of snapshots processed at the same time, each in its own process; see run_snapshots()
+
+        memBudgetGB: float or None
+            with nsnap > 1, start another snapshot only if the estimated memory of all running snapshots stays below this; see estimate_snapshot_memory()
+
+        prefetch: int
+            with nsnap = 1, number of snapshots loaded in the background while the current one is extracted; at most 1 + prefetch snapshots are in memory. See run_prefetched().
+
         """
 
-        for idx in range(len(self.snapRange)):
-            self.load_obj_snap(idx, LoadHalo=LoadHalo)
-            if idx == 0:
-                gnames, zzz = self.main_proc(savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate)
-            else:
-                gnamesOut, zzzRed = self.main_proc(savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate)
-                gnames.extend(gnamesOut)
-                zzz.extend(zzzRed)
+        if nsnap > 1 and len(self.snapRange) > 1:
+            results, failed = self.run_snapshots(nsnap, memBudgetGB, savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, LoadHalo=LoadHalo, resume=resume)
+        elif prefetch > 0 and len(self.snapRange) > 1:
+            results, failed = self.run_prefetched(prefetch, savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, LoadHalo=LoadHalo, resume=resume), {}
+        else:
+            results, failed = {}, {}
+            for idx in range(len(self.snapRange)):
+                self.load_obj_snap(idx, LoadHalo=LoadHalo)
+                results[idx] = self.main_proc(savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, resume=resume)
+
+        # in the order of snapRange, whichever snapshot finished first
+        gnames, zzz = [], []
+        for idx in sorted(results):
+            gnames.extend(results[idx][0])
+            zzz.extend(results[idx][1])
 
         from parse_simba import pd_bookkeeping
         _, _ = pd_bookkeeping(gnames, zzz, self.zCloudy, outname=outname)
 
+        if results:
+            if savepath is None:
+                savepath = self.d_data + 'particle_data/sim_data/'
+            # after every snapshot has finished, so it doesn't depend on which finished last
+            merge_catalogs([self.def_catalogFileName(savepath, self.snapRange[idx]) for idx in sorted(results)],
+                           self.def_catalogFileName(savepath))
+
+        if failed:
+            idx = min(failed)
+            raise RuntimeError("Snapshots {:} failed. First error (snapshot {:}):\n{:}".format([self.snapRange[i] for i in sorted(failed)], self.snapRange[idx], failed[idx]))
+
+        if self.writeErrors:
+            # galaxies that failed to write are not in the manifest, so run(resume=True) extracts them again
+            name, e, tb = self.writeErrors[0]
+            raise RuntimeError("Writing {:} galaxies failed: {:}\nFirst error ({:}):\n{:}".format(len(self.writeErrors), ', '.join(str(x[0]) for x in self.writeErrors), name, tb))
+
         return gnames, zzz
 
 
-    def main_proc(self, savepath, emptyDM, caesarRotate):
+    def def_fileNames(self, idx):
+        """ caesar and snapshot file of snapRange[idx], without loading it """
+        snap = getattr(self, 'snap', None)
+        self.snap = self.snapRange[idx]
+        files = self.def_caesarFileName(), self.def_snapFileName()
+        self.snap = snap
+        return files
+
+
+    def def_catalogFileName(self, savepath, snap=None):
+        """ gal_catalog of snapshot snap written by main_proc(), or of all snapshots merged by run() if snap is None """
+        ext = '.parquet' if self.catalogFormat == 'parquet' else '.pkl'
+        if snap is None:
+            return savepath + 'gal_catalog' + ext
+        return savepath + 'gal_catalog_s{:0>3}'.format(int(snap)) + ext
+
+
+    def def_storeFileName(self, savepath):
+        return savepath + self.name_prefix + '{:0>3}'.format(int(self.snap)) + '_sim.hdf5'
+
+
+    def def_galFileNames(self, savepath, galname):
+        simgas_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + '_' + \
+                       galname + '_sim.gas'
+        simstar_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + \
+                       '_' + galname + '_sim.star'
+        simdm_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + \
+                      '_' + galname + '_sim.dm'
+        return [simgas_path, simstar_path, simdm_path]
+
+
+    def def_galname(self, gg, gal):
+        return 'h' + str(int(gal.parent_halo_index)) + '_s' + \
+            str(int(self.snap)) + '_G' + str(int(gg))
+
+
+    def member_index(self, ptype):
+        """ CSR membership index of the current caesar file, see galindex.py """
+        if ptype not in self.memberIndex:
+            self.memberIndex[ptype] = load_member_index(self.caesarFile, ptype, obj=self.obj)
+        return self.memberIndex[ptype]
+
+
+    def particle_tree(self, ptype, treeDir=None):
+        """ periodic KD-tree of all particles of ptype in the current snapshot, pickled to treeDir (default next to the snapshot), see spatialindex.py """
+        if ptype not in self.particleTrees:
+            self.particleTrees[ptype] = load_particle_tree(self.snapFile, ptype, treeDir)
+        return self.particleTrees[ptype]
 
+
+    def galaxy_members(self, todo, ptype, sel=None):
         """
+
         Parameters
         ----------
+        todo: list of int
+            indices into self.obj.galaxies
 
-        savepath: str
-            where the pandas .gas, .star, .dm should be saved to
-            default is None, which means subdir of sigame
+        ptype: str
+            'gas' or 'star'
 
-        emptyDM: bool
-            if True, will create empty holders as DM position, mass, velocity to save as pandas dataframe. Do so because we don't have a dmlist from caesar catalog and we don't need it really.
+        sel: array of int or None
+            particles the fields were read with, see load_snap_fields()
 
-        caesarRotate: bool
-            whether to project gal to xy-plane.
+        Returns
+        -------
+        sub: galindex.MemberIndex
+            members of the galaxies of todo, in the order of todo
+
+        members: array of int
+            rows of the members in the fields read with sel
+
+        """
+
+        rows = np.array([self.obj.galaxies[gg].GroupID for gg in todo], dtype=np.int64)
+        sub = self.member_index(ptype).subset(rows)
+        members = np.asarray(sub.members)
+        if sel is not None:
+            members = local_index(sel, members)
+        return sub, members
+
+
+    def plan_galaxies(self, gasFields=None, gsel=None, savepath=None):
+        """
+
+        Apply the selection criteria of main_proc() to all galaxies of the snapshot at once, before any per-galaxy field is gathered.
+
+        Particle numbers come from the membership index; SFR and dense gas mass are segmented sums over the gas members of the galaxies that pass the particle number cut.
+
+        Parameters
+        ----------
+        gasFields: dict or None
+            from load_snap_fields(); if None, only gas mass, SFR and fH2 are read, restricted to the particles of the galaxies that pass the particle number cut if selectiveRead, and batch by batch if outOfCoreGB
+
+        gsel: array of int or None
+            gas particles gasFields was read with
+
+        savepath: str or None
+            where to write the rejection report selection_s<snap>.pkl
 
         Returns
         -------
-        galName: list of str
-            galnames extracted, after applying the selection criteria
+        accepted: list of int
+            indices into the SFR-sorted self.obj.galaxies of the galaxies to extract
 
         Note
         ----
-        We will apply some selection criteria:
-        - SFR
-        - dense gas mass, otherwise we will get an error in subgrid add_GMCs()
-        - stars and gas particles number
-
+        Each galaxy is rejected for the first criterion it fails, in the order extract_galaxy() checks them: particle number, SFR, dense gas mass.
 
         """
 
-        from yt2caesar import get_partmasses_from_snapshot
-        from yt2caesar import group_part_by_galaxy
-        from astropy import units as u
         import pandas as pd
 
-        if savepath is None:
-            savepath = self.d_data + 'particle_data/sim_data/'
+        galaxies = self.obj.galaxies
+        rows = np.array([gal.GroupID for gal in galaxies], dtype=np.int64)
+
+        gidx = self.member_index('gas')
+        ngas = gidx.counts[rows]
+        nstar = self.member_index('star').counts[rows]
+        pass_npart = (ngas >= self.part_threshold) & (nstar >= self.part_threshold)
+
+        # only gas of galaxies that pass the particle number cut
+        sub = gidx.subset(rows[pass_npart])
+        sfr_gas = np.full(len(galaxies), np.nan)
+        mdense = np.full(len(galaxies), np.nan)
+        if gasFields is None and self.outOfCoreGB is not None:
+            # one batch of galaxies at a time, so only their gas is in memory
+            sfr_sub, mdense_sub = np.empty(len(sub)), np.empty(len(sub))
+            for pos in self.galaxy_batches(rows[pass_npart], self.plan_requests):
+                sfr_sub[pos], mdense_sub[pos] = self.gas_sums(sub.subset(pos))
+        else:
+            sfr_sub, mdense_sub = self.gas_sums(sub, gasFields, gsel)
+        sfr_gas[pass_npart] = sfr_sub
+        mdense[pass_npart] = mdense_sub
+
+        # nan (failed particle number cut) compares as False
+        pass_sfr = sfr_gas > self.sfr_threshold
+        pass_dense = mdense > self.denseGasThres
+
+        rejected = np.full(len(galaxies), '', dtype=object)
+        rejected[~pass_npart] = 'npart'
+        rejected[pass_npart & ~pass_sfr] = 'SFR'
+        rejected[pass_npart & pass_sfr & ~pass_dense] = 'denseGas'
+        accepted = np.flatnonzero(rejected == '').tolist()
+
+        print("Selection of {:} galaxies in snapshot {:}: {:} accepted".format(len(galaxies), self.snap, len(accepted)))
+        print("  rejected for particle number < {:}: {:}".format(self.part_threshold, (rejected == 'npart').sum()))
+        print("  rejected for SFR <= {:}: {:}".format(self.sfr_threshold, (rejected == 'SFR').sum()))
+        print("  rejected for dense gas mass <= {:.2e} Msun: {:}".format(self.denseGasThres, (rejected == 'denseGas').sum()))
+
+        if savepath is not None:
+            report = pd.DataFrame({'galnames': [self.def_galname(gg, gal) for gg, gal in enumerate(galaxies)],
+                                   'GroupID': rows,
+                                   'Ngas': ngas,
+                                   'Nstar': nstar,
+                                   'SFR_gas': sfr_gas,
+                                   'Mdense': mdense,
+                                   'pass_npart': pass_npart,
+                                   'pass_SFR': pass_sfr,
+                                   'pass_denseGas': pass_dense,
+                                   'rejected': rejected})
+            report.to_pickle(savepath + 'selection_s{:0>3}.pkl'.format(int(self.snap)))
+
+        return accepted
+
+
+    def gas_sums(self, sub, gasFields=None, gsel=None):
+        """
 
-        # sort by SFR
-        self.obj.galaxies.sort(key=lambda x: x.sfr, reverse=True)
+        SFR and dense gas mass of the galaxies in sub, for plan_galaxies().
+
+        Parameters
+        ----------
+        sub: MemberIndex
+            gas membership of the galaxies
+
+        gasFields, gsel:
+            see plan_galaxies(); if gasFields is None, self.plan_requests are read for the gas of sub
+
+        Returns
+        -------
+        sfr, mdense: array
+            len(sub), in Msun/yr and Msun
+
+        """
+
+        if gasFields is None:
+            if self.selectiveRead or self.outOfCoreGB is not None:
+                gsel = np.unique(np.asarray(sub.members))
+                snapFields, index = self.read_snap_fields(self.plan_requests, index={'gas': gsel})
+                gsel = index['gas']
+            else:
+                gsel = None
+                snapFields, _ = self.read_snap_fields(self.plan_requests)
+            gasFields = {'m': snapFields[('gas', 'mass')]/self.h,
+                         'SFR': snapFields[('gas', 'sfr')]/self.h,
+                         'fH2': snapFields[('gas', 'fH2')]}
+            del snapFields
+
+        gas_m = sub.gather(gasFields['m'], sel=gsel)
+        sfr = sub.segment_sum(sub.gather(gasFields['SFR'], sel=gsel))
+        mdense = sub.segment_sum(gas_m * sub.gather(gasFields['fH2'], sel=gsel))
+        return sfr, mdense
+
+
+    def galaxy_batches(self, rows, requests):
+        """
+
+        Split galaxies into consecutive batches whose gas and star fields fit in outOfCoreGB, see galindex.batch_galaxies().
+
+        Parameters
+        ----------
+        rows: array of int
+            GroupIDs of the galaxies, in the order they are processed
+
+        requests: list of tuple
+            (ptype, field) pairs read for each batch; only 'gas' and 'star' are counted, other ptypes are read in full
+
+        Returns
+        -------
+        batches: list of array of int
+            positions into rows
+
+        """
+
+        bpp = particle_nbytes(self.snapFile, requests)
+        nbytes = np.zeros(len(rows))
+        for ptype in ('gas', 'star'):
+            if ptype in bpp:
+                nbytes += self.member_index(ptype).counts[rows] * bpp[ptype]
+        if self.nproc > 1:
+            # copied into shared memory for the pool, as in estimate_snapshot_memory()
+            nbytes *= 2
+        return batch_galaxies(nbytes, self.outOfCoreGB * 1.e9)
+
+
+    def run_prefetched(self, prefetch, LoadHalo=False, **kwargs):
+        """
+
+        Run load_obj_snap() and main_proc() for the snapshots in snapRange one after the other, while the next snapshots are loaded in the background.
+
+        The caesar catalog of an upcoming snapshot is loaded by a thread and its fields (self.snap_requests; with selectiveRead only the particles of galaxies that pass part_threshold, if the membership index sidecar exists) are read into shared memory by a helper process, see prefetch.py.
+
+        Parameters
+        ----------
+        prefetch: int
+            number of snapshots loaded ahead of the current one
+
+        kwargs:
+            savepath, emptyDM, caesarRotate, resume as in run()
+
+        Returns
+        -------
+        results: dict
+            idx --> (galName, zred) from main_proc()
+
+        """
+
+        from prefetch import FieldReader, SnapshotPrefetch
+
+        nsnaps = len(self.snapRange)
+        reader = FieldReader()
+        pending = {}
+        results = {}
+        nxt = 0
+        try:
+            for idx in range(nsnaps):
+                while nxt < nsnaps and nxt <= idx + prefetch:
+                    caesarFile, snapFile = self.def_fileNames(nxt)
+                    if self.outOfCoreGB is not None:
+                        # only the catalog, fields are read batch by batch
+                        requests, selective = [], False
+                    else:
+                        requests, selective = self.snap_requests, self.selectiveRead
+                    pending[nxt] = SnapshotPrefetch(reader, caesarFile, snapFile, requests, LoadHalo=LoadHalo,
+                                                    selective=selective, part_threshold=self.part_threshold)
+                    nxt += 1
+
+                pf = pending.pop(idx)
+                try:
+                    self.load_obj_snap(idx, LoadHalo=LoadHalo, prefetched=pf)
+                    results[idx] = self.main_proc(**kwargs)
+                finally:
+                    self.prefetchedFields, self.prefetchedIndex = None, None
+                    pf.free()
+        finally:
+            # release what was prefetched for snapshots we didn't get to, in the order of the reader's results
+            for idx in sorted(pending):
+                pending[idx].free()
+            reader.close()
+
+        return results
+
+
+    def estimate_snapshot_memory(self, idx, emptyDM=True):
+        """
+
+        Upper bound of the memory main_proc() needs for snapshot snapRange[idx], in bytes, from the snapshot header and dataset shapes.
+
+        All fields in self.snap_requests are counted for every particle of the box (selectiveRead reads less), twice if nproc > 1 because the fields are copied into shared memory; at most outOfCoreGB if given. Unless emptyDM, the DM tree of galaxy_dm() is added: TREE_BYTES_PER_PARTICLE per DM particle of the box, or nothing with selectiveRead or outOfCoreGB, where the tree only holds the DM near the galaxies.
+
+        """
+
+        import h5py
+        from snapio import ptype_group, PTYPES, FIELDS
+
+        _, snapFile = self.def_fileNames(idx)
+
+        nbytes = 0
+        with h5py.File(snapFile, 'r') as f:
+            npart = f['Header'].attrs['NumPart_ThisFile']
+            for ptype, field in self.snap_requests:
+                group, dset = ptype_group(ptype), FIELDS.get(field, field)
+                if group in f and dset in f[group]:
+                    d = f[group][dset]
+                    nbytes += d.dtype.itemsize * int(np.prod(d.shape))
+                else:
+                    # e.g. masses from the MassTable, read as float64
+                    nbytes += 8 * int(npart[PTYPES[ptype]])
+
+        if self.nproc > 1:
+            nbytes *= 2
+        if self.outOfCoreGB is not None:
+            # fields are read batch by batch, see stream_batches()
+            nbytes = min(nbytes, self.outOfCoreGB * 1.e9)
+        if not emptyDM and not self.selectiveRead and self.outOfCoreGB is None:
+            nbytes += TREE_BYTES_PER_PARTICLE * int(npart[PTYPES['dm']])
+        return nbytes
+
+
+    def run_snapshots(self, nsnap, memBudgetGB=None, **kwargs):
+        """
+
+        Run load_obj_snap() and main_proc() for the snapshots in snapRange, nsnap at a time, each in a forked process.
+
+        Snapshots are started in the order of snapRange as long as fewer than nsnap are running and the estimated memory of the running ones (see estimate_snapshot_memory()) plus the next one fits in memBudgetGB. A snapshot that doesn't fit on its own is run alone.
+
+        Each snapshot writes its own gal_catalog_s<snap> to savepath (see def_catalogFileName()), so snapshots running at the same time don't overwrite each other's catalog. run() merges them into gal_catalog in the order of snapRange once all snapshots have finished, the same as after a serial run.
+
+        Parameters
+        ----------
+        nsnap: int
+            max. number of snapshots processed at the same time
+
+        memBudgetGB: float or None
+            None for no memory limit
+
+        kwargs:
+            savepath, emptyDM, caesarRotate, LoadHalo, resume as in run()
+
+        Returns
+        -------
+        results: dict
+            idx --> (galName, zred) from main_proc() of snapshot snapRange[idx]
+
+        failed: dict
+            idx --> traceback of the snapshots that failed
+
+        """
 
-        # load in the fields from snapshot
-        print("Read in gas fields")
-        rho_crit_cgs = 1.8791e-29      # /h^2
-        unit_Density = rho_crit_cgs *self.h*self.h * u.g/(u.cm**3)
-        gas_densities_p = readsnap(self.snapFile,'rho','gas',units=1)
+        import multiprocessing as mp
+        import queue
+
+        ctx = mp.get_context('fork')
+        resultQueue = ctx.Queue()
+
+        budget = np.inf if memBudgetGB is None else memBudgetGB * 1.e9
+        estimate = {idx: self.estimate_snapshot_memory(idx, emptyDM=kwargs.get('emptyDM', True)) for idx in range(len(self.snapRange))}
+
+        todo = list(range(len(self.snapRange)))
+        running = {}
+        results = {}
+        failed = {}
+
+        while todo or running:
+            # start snapshots while workers and memory allow
+            while todo and len(running) < nsnap and \
+                    (not running or sum(estimate[i] for i in running) + estimate[todo[0]] <= budget):
+                idx = todo.pop(0)
+                print("Starting snapshot {:} (estimated {:.1f} GB)".format(self.snapRange[idx], estimate[idx] / 1.e9))
+                proc = ctx.Process(target=_run_snapshot, args=(self, idx, dict(kwargs), resultQueue))
+                proc.start()
+                running[idx] = proc
+
+            try:
+                idx, gnames, zred, errors, tb = resultQueue.get(timeout=10)
+            except queue.Empty:
+                # a process killed without reporting back, e.g. by the OOM killer
+                for idx, proc in list(running.items()):
+                    if not proc.is_alive() and proc.exitcode != 0:
+                        failed[idx] = "process exited with code {:}".format(proc.exitcode)
+                        del running[idx]
+                continue
+
+            running.pop(idx).join()
+            if tb is not None:
+                print("Snapshot {:} failed".format(self.snapRange[idx]))
+                failed[idx] = tb
+            else:
+                print("Finished snapshot {:}: {:} galaxies".format(self.snapRange[idx], len(gnames)))
+                results[idx] = (gnames, zred)
+                self.writeErrors.extend(errors)
+
+        return results, failed
+
+
+    def read_snap_fields(self, requests, index=None):
+        """
+
+        readsnap_fields(units=1) of the current snapshot, served from the prefetched fields if they hold all requests (see run_prefetched()).
+
+        Returns
+        -------
+        fields: dict
+            (ptype, field) --> array
+
+        index: dict or None
+            particles the fields hold per ptype. A prefetched selection holds all galaxies that pass part_threshold, so it can be a superset of index.
+
+        """
+        pf = self.prefetchedFields
+        if pf is not None and all(r in pf for r in requests) and (index is None) == (self.prefetchedIndex is None):
+            return {r: pf[r] for r in requests}, self.prefetchedIndex
+        chunkbytes = self.chunkMB * 1.e6 if self.outOfCoreGB is not None else None
+        return readsnap_fields(self.snapFile, requests, units=1, index=index, chunkbytes=chunkbytes), index
+
+
+    def load_snap_fields(self, accepted=None):
+        """
+
+        Read every snapshot field main_proc() needs for the current snapshot.
+
+        Parameters
+        ----------
+        accepted: list of int or None
+            with selectiveRead or outOfCoreGB, only read the particles of these galaxies (indices into self.obj.galaxies, see plan_galaxies()). Default is all galaxies that pass part_threshold.
+
+        Returns
+        -------
+        gasFields, starFields: dict
+            snapshot fields in Msun, ckpc, km/s, etc. keyed as expected by extract_galaxy()
+
+        bhFields: dict
+            'mdot' in Msun/yr and 'm' in Msun of all BH particles
+
+        gsel, ssel: array of int or None
+            gas and star particles that were read if selectiveRead or outOfCoreGB, otherwise None
+
+        """
+
+        # load in the fields from snapshot, opening the file only once
+        print("Read in gas and stellar fields")
+        gsel, ssel = None, None
+        if self.selectiveRead or self.outOfCoreGB is not None:
+            # only particles of galaxies that can pass the particle number cut
+            if accepted is None:
+                keep = [gal for gal in self.obj.galaxies if len(gal.slist) >= self.part_threshold and len(gal.glist) >= self.part_threshold]
+            else:
+                keep = [self.obj.galaxies[gg] for gg in accepted]
+            gsel = np.unique(np.concatenate([np.asarray(gal.glist, dtype=np.int64) for gal in keep] + [np.array([], dtype=np.int64)]))
+            ssel = np.unique(np.concatenate([np.asarray(gal.slist, dtype=np.int64) for gal in keep] + [np.array([], dtype=np.int64)]))
+            print("Reading {:} gas and {:} star particles of {:} galaxies".format(len(gsel), len(ssel), len(keep)))
+            snapFields, index = self.read_snap_fields(self.snap_requests, index={'gas': gsel, 'star': ssel})
+            gsel, ssel = index['gas'], index['star']
+        else:
+            snapFields, _ = self.read_snap_fields(self.snap_requests)
+
+        gas_densities_p = snapFields[('gas', 'rho')]
                           # gas density in comoving g/cm^3
         # print("density g/cc")
         # print(gas_densities_p.min(), gas_densities_p.max())
         #
 
-        if self.verbose or self.debug:
+        if self.debug:
             # not acutally used in the dataframe
             gas_nh_p = gas_densities_p*self.h*self.h*0.76/self.Mp     # number density of H in 1/cc
 
-        gas_p_m = get_partmasses_from_snapshot(self.snapFile, self.obj,
-                                               ptype='gas')
-        gas_Tk_p = readsnap(self.snapFile,'u','gas',units=1)
-        gas_SFR_p = readsnap(self.snapFile,'sfr','gas',units=1, \
-                             suppress=1)/self.h
-        gmet_p = readsnap(self.snapFile,'metals','gas',units=1)
+        gas_p_m = snapFields[('gas', 'mass')]/self.h    # solar mass
+        gas_Tk_p = snapFields[('gas', 'u')]
+        gas_SFR_p = snapFields[('gas', 'sfr')]/self.h
+        gmet_p = snapFields[('gas', 'metals')]
         # Smoothing length
-        gas_h_p = readsnap(self.snapFile,'hsml','gas',units=1) \
+        gas_h_p = snapFields[('gas', 'hsml')] \
                            /self.h/(1+self.redshift)  # smoothing length in ckpc --> proper kpc
         #
-        gas_pos_p = readsnap(self.snapFile,'pos','gas',units=1,suppress=1)\
-                             /self.h # ckpc
-        gas_vel_p = readsnap(self.snapFile,'vel','gas',units=1,suppress=1)   # km/s
+        gas_pos_p = snapFields[('gas', 'pos')]/self.h # ckpc
+        gas_vel_p = snapFields[('gas', 'vel')]   # km/s
 
         # molecular gas fraction
-        gfH2_p = readsnap(self.snapFile,'fH2','gas', units=1)
+        gfH2_p = snapFields[('gas', 'fH2')]
         assert abs(gfH2_p.all()) <= 1.0      # each particles
         # neutral hydrogen fraction (between 0-1)
-        gfHI_p = readsnap(self.snapFile,'nh','gas',units=1)
+        gfHI_p = snapFields[('gas', 'nh')]
         assert abs(gfHI_p.all()) <= 1.0      # each particles
 
-        gas_x_e_p = readsnap(self.snapFile,'ne','gas',units=1)
+        gas_x_e_p = snapFields[('gas', 'ne')]
 
         if self.debug:
             nH = gfHI_p*gas_densities_p/self.Mp              # number density
@@ -366,301 +998,796 @@ class particles2pd(object):
             print(nE)
             import pdb; pdb.set_trace()
 
-        print("Read in stellar fields")
-        star_p_m = get_partmasses_from_snapshot(self.snapFile, self.obj, ptype='star')
-        star_pos_p =readsnap(self.snapFile,'pos','star',units=1,suppress=1)/self.h   # ckpc
-        star_vel_p =readsnap(self.snapFile,'vel','star',units=1,suppress=1)
-        pmetarray = readsnap(self.snapFile,'Metallicity','star',units=1,suppress=1)[:, 0]
-        sage = readsnap(self.snapFile,'age','star',units=1,suppress=1)    #  expansion factor of formation
+        star_p_m = snapFields[('star', 'mass')]/self.h
+        star_pos_p = snapFields[('star', 'pos')]/self.h   # ckpc
+        star_vel_p = snapFields[('star', 'vel')]
+        pmetarray = snapFields[('star', 'Metallicity')][:, 0]
+        sage = snapFields[('star', 'age')]    #  expansion factor of formation
+        # for all stars at once, galaxies take their slice in extract_galaxy()
+        star_age = stellar_ages(sage, self.obj.simulation.time.in_units("Myr").d,
+                                self.obj.simulation.omega_matter, self.h)
+
+        # BH_Mdot is read in code units (units=0 in readsnap)
+        bhmdot = snapFields[('bndry', 'BH_Mdot')]*1.e10/self.h/3.08568e+16*3.155e7 # in Mo/yr
+        bhm = snapFields[('bndry', 'BH_Mass')]*1.e10/self.h     # in Mo
+        del snapFields
+
+        # gathered together for each galaxy by gather_galaxy_fields()
+        gasFields = {'m': gas_p_m, 'rho': gas_densities_p, 'Tk': gas_Tk_p,
+                     'SFR': gas_SFR_p, 'metals': gmet_p, 'h': gas_h_p,
+                     'pos': gas_pos_p, 'vel': gas_vel_p, 'fH2': gfH2_p,
+                     'nh': gfHI_p, 'ne': gas_x_e_p}
+        starFields = {'m': star_p_m, 'pos': star_pos_p, 'vel': star_vel_p,
+                      'Z': pmetarray, 'age': star_age}
+
+        bhFields = {'m': bhm, 'mdot': bhmdot}
+
+        return gasFields, starFields, bhFields, gsel, ssel
+
+
+    def main_proc(self, savepath, emptyDM, caesarRotate, resume=False):
+
+        """
+        Parameters
+        ----------
+
+        savepath: str
+            where the pandas .gas, .star, .dm should be saved to
+            default is None, which means subdir of sigame
+
+        emptyDM: bool
+            if True, will create empty holders as DM position, mass, velocity to save as pandas dataframe. Do so because we don't have a dmlist from caesar catalog and we don't need it really.
+            If False, the DM particles within gal.radii['total'] of each galaxy are extracted, found with a periodic KD-tree of the snapshot (see galaxy_dm()).
+
+        caesarRotate: bool
+            whether to project gal to xy-plane.
+
+        resume: bool
+            if True, only extract the accepted galaxies that are not in the manifest yet or whose output files are missing or corrupt; otherwise the manifest is started afresh
+
+        Returns
+        -------
+        galName: list of str
+            galnames extracted, after applying the selection criteria
+
+        Note
+        ----
+        We will apply some selection criteria:
+        - SFR
+        - dense gas mass, otherwise we will get an error in subgrid add_GMCs()
+        - stars and gas particles number
+
+        The criteria are evaluated for all galaxies at once by plan_galaxies() and only the accepted galaxies are extracted; with selectiveRead only their particles are read in full.
+
+        With self.nproc > 1 the galaxies are extracted by a pool of worker processes that share the snapshot arrays; output is identical to the serial run and in the same order.
+
+        With outputFormat 'hdf5' the galaxies are written to one GalaxyStore per snapshot, see def_storeFileName(), instead of three pickles each.
+
+        Each extracted galaxy is committed to savepath + 'manifest_s<snap>.pkl' together with the catalog columns measured on its particles (see manifest.py), and gal_catalog_s<snap> is built from the manifest with galcatalog.build_catalog(), so it also holds the galaxies of a previous, interrupted run. run() merges the catalogs of all snapshots into gal_catalog.
 
-        print("Read in DM mass for each particle: " )
-        dm_p_m = get_partmasses_from_snapshot(self.snapFile, self.obj, ptype='dm')
+        """
 
-        print("Read BH mdot: ")
-        bhmdot = readsnap(self.snapFile, 'BH_Mdot','bndry',suppress=1)*1.e10/self.h/3.08568e+16*3.155e7 # in Mo/yr
+        if savepath is None:
+            savepath = self.d_data + 'particle_data/sim_data/'
 
         if not os.path.exists(savepath):
             os.makedirs(savepath)
 
-        SolarAbundances=[0.0134, 0.2485, 2.38e-3, 0.70e-3, 5.79e-3, 1.26e-3,
-                         7.14e-4, 6.17e-4, 3.12e-4, 0.65e-4, 1.31e-3]
-
-        galName = []
-        zred = []
-        for gg, gal in enumerate(self.obj.galaxies):
-
-            loc = gal.pos    # ckpc
-
-            galname = 'h' + str(int(gal.parent_halo_index)) + '_s' + \
-                str(int(self.snap)) + '_G' + str(int(gg))
-
-            if self.verbose:
-                print(galname)
-                print("SFR: {:.2f}".format(gal.sfr))
-
-            gas_m = group_part_by_galaxy(gas_p_m, gal, ptype='gas')
-            gas_densities = group_part_by_galaxy(gas_densities_p, gal, ptype='gas')
-
-            if self.debug:
-                print("from readsnap: ")
-                print(gas_densities.max(), gas_densities.min())    # g/cc
-                print("from YT sphere: ")
-                print(sim_gas['nH'].max(), sim_gas['nH'].min())
-                gas_nh = group_part_by_galaxy(gas_nh_p, gal, ptype='gas')
-                print(gas_nh.max(), gas_nh.min())      # 1/cc
-                import pdb; pdb.set_trace()
-
-            gas_Tk = group_part_by_galaxy(gas_Tk_p, gal, ptype='gas')
-            gas_SFR = group_part_by_galaxy(gas_SFR_p, gal, ptype='gas')
-            gas_Z = group_part_by_galaxy(gmet_p[:, 0], gal, ptype='gas')/SolarAbundances[0]
-            gas_Z_1 = group_part_by_galaxy(gmet_p[:, 1], gal, ptype='gas')/SolarAbundances[1]
-            gas_Z_2 = group_part_by_galaxy(gmet_p[:, 2], gal, ptype='gas')/SolarAbundances[2]
-            gas_Z_3 = group_part_by_galaxy(gmet_p[:, 3], gal, ptype='gas')/SolarAbundances[3]
-            gas_Z_4 = group_part_by_galaxy(gmet_p[:, 4], gal, ptype='gas')/SolarAbundances[4]
-            gas_Z_5 = group_part_by_galaxy(gmet_p[:, 5], gal, ptype='gas')/SolarAbundances[5]
-            gas_Z_6 = group_part_by_galaxy(gmet_p[:, 6], gal, ptype='gas')/SolarAbundances[6]
-            gas_Z_7 = group_part_by_galaxy(gmet_p[:, 7], gal, ptype='gas')/SolarAbundances[7]
-            gas_Z_8 = group_part_by_galaxy(gmet_p[:, 8], gal, ptype='gas')/SolarAbundances[8]
-            gas_Z_9 = group_part_by_galaxy(gmet_p[:, 9], gal, ptype='gas')/SolarAbundances[9]
-            gas_Z_10 = group_part_by_galaxy(gmet_p[:, 10], gal, ptype='gas')/SolarAbundances[10]
-
-            # smoothing length
-            gas_h = group_part_by_galaxy(gas_h_p, gal, ptype='gas')
-
-            gas_pos = group_part_by_galaxy(gas_pos_p, gal, ptype='gas')
-
-            if len(gal.slist) < self.part_threshold or len(gal.glist) < self.part_threshold:
-                print("Too few star particles or gas particles, unlikely to be real galaxy or useful for our purpose. Skipping ", galname)
-                continue
+        manifest = ExtractionManifest(savepath + 'manifest_s{:0>3}.pkl'.format(int(self.snap)))
+        if resume:
+            done = manifest.load(verify=True)
+        else:
+            manifest.reset()
+            done = {}
+
+        store = None
+        if self.outputFormat == 'hdf5':
+            from galstore import GalaxyStore
+            store = GalaxyStore(self.def_storeFileName(savepath), mode='a' if resume else 'w', schema=self.outputSchema, compression=self.compression)
+            # galaxies of the manifest that never made it into the store are redone
+            done = {k: v for k, v in done.items() if k in store}
+
+        accepted, todo, snapFields = self.prepare_snapshot(skip=done, savepath=savepath)
+        if resume:
+            print("Resuming snapshot {:}: {:} of {:} accepted galaxies already extracted".format(self.snap, len(accepted) - len(todo), len(accepted)))
+
+        # pool workers write their own pickles; otherwise DataFrames are written by save_galaxy()
+        write = self.nproc > 1 and self.outputFormat == 'pickle'
+        if snapFields is None:
+            stream = self.stream_batches(todo, savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, write=write)
+        else:
+            stream = self.stream_galaxies(todo, *snapFields, savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, write=write)
+        del snapFields
 
-            gas_pos -= loc.d          # both are in comoving
-            gas_pos /= (1+self.redshift)   # physical kpc
-            gas_vel = group_part_by_galaxy(gas_vel_p, gal, ptype='gas')
+        writer = None
+        if self.nwriter > 0:
+            writer = AsyncWriter(self.nwriter, maxbytes=self.writeBufferMB * 1.e6)
 
-            if caesarRotate:
-                gas_pos = caesar.utils.rotator(gas_pos.astype('float64'), gal.rotation_angles['ALPHA'], gal.rotation_angles['BETA'])
-
-                gas_vel = caesar.utils.rotator(gas_vel.astype('float64'),
-                                              np.float64(gal.rotation_angles['ALPHA']),
-                                              np.float64(gal.rotation_angles['BETA']))
-            gas_x = gas_pos[:, 0]
-            gas_y = gas_pos[:, 1]
-            gas_z = gas_pos[:, 2]
-
-            gas_vx = gas_vel[:,0]
-            gas_vy = gas_vel[:,1]
-            gas_vz = gas_vel[:,2]
-
-            gas_f_H2 = group_part_by_galaxy(gfH2_p, gal, ptype='gas')
-            gas_f_neu = group_part_by_galaxy(gfHI_p, gal, ptype='gas')   # f_neu
-
-            if self.debug:
-                print("HI fraction")
-                print(gas_f_neu.min(), gas_f_neu.max())    # following RD's def.
-                print((1-gas_f_H2).min(), (1-gas_f_H2).max())
-                print((gas_f_neu/(1-gas_f_H2)).min())
-                print((gas_f_neu/(1-gas_f_H2)).max())
-
-            # neutral gas from 1- ionized gas
-            gas_x_e = group_part_by_galaxy(gas_x_e_p, gal, ptype='gas')   # relative to nH
-            gas_f_ion = gas_x_e / max(gas_x_e)
-            gas_f_HI = 1 - gas_f_ion
-            assert abs(gas_f_HI.all()) <= 1.0
-
-            if self.debug:
-                print(gas_f_HI >= gas_f_neu)     # former incl. also molecular
-                print((gas_f_HI >= gas_f_neu).all())   # expecting True
-                import pdb; pdb.set_trace()
-
-            if self.debug:
-                print('\nChecking molecular gas mass fraction from simulation:')
-                print('%.3s %% \n' % (np.sum(gas_m * gas_f_H2) / np.sum(gas_m) * 100.))
-                #
-                print("gas mass from snapshot: {:.2f} [x1e8 Msun]".format(gas_m.sum()/1.e8))
-                print("gas mass from 'gas' from caesar {:.2f} [x1e8 Msun]".format(gal.masses['gas']/1.e8))
-                #
-                print('gas mass from (HI + H2) from caesar {:.2f} [x1e8 Msun]'.format((gal.masses['HI'] + gal.masses['H2'])/1.e8))
-                print('')
-                print("gas fraction from caesar: {:.2f}".format(gal.gas_fraction))
-                print('gas fraction from Mgas/(Mgas+Mstar): {:.2f} '.format(gal.masses['gas']/(gal.masses['gas'] + gal.masses['stellar'])))
-                print('gas fraction from MHI + MH2 /(MHI + MH2 + Mstar): {:.2f}'.format((gal.masses['HI'] + gal.masses['H2']) / (gal.masses['HI'] + gal.masses['H2'] + gal.masses['stellar'])))
-                #
-                print(gal.masses['HI'], np.sum(gas_f_neu * gas_m))
-                import pdb; pdb.set_trace()
-
-            # selection crit.
-            if gas_SFR.sum() <= self.sfr_threshold:
-                print("SFR too low.. Skipping ", galname)
-                continue
+        try:
+            try:
+                # the file writer is one consumer of the stream, see iter_galaxies() for others
+                for gg, res in stream:
+                    if writer is not None:
+                        writer.submit(self.save_galaxy, gg, res, manifest, store, done,
+                                      nbytes=frames_nbytes(res.get('frames', {})), name=res['galname'])
+                    else:
+                        self.save_galaxy(gg, res, manifest, store, done)
+            finally:
+                # also if the stream fails, so the galaxies already extracted are in the manifest for resume
+                if writer is not None:
+                    errors = writer.close()
+                    for name, e, tb in errors:
+                        print("Writing {:} failed: {:}".format(name, e))
+                    self.writeErrors.extend(errors)
+
+            # only galaxies accepted by the current selection, in the order of self.obj.galaxies
+            accepted = set(accepted)
+            records = sorted([r for r in done.values() if r['gg'] in accepted], key=lambda r: r['gg'])
+
+            galName = [r['galname'] for r in records]
+            zred = [r['redshift'] for r in records]
+
+            gal_prop = build_catalog([self.obj.galaxies[r['gg']] for r in records], galName,
+                                     {k: [r['props'][k] for r in records] for k in EXTRACTED_COLUMNS})
+            # one catalog per snapshot, run() merges them into gal_catalog
+            write_catalog(gal_prop, self.def_catalogFileName(savepath, self.snap))
+            if store is not None:
+                store.write_catalog(gal_prop)
+        finally:
+            if store is not None:
+                store.close()
 
-            if (gas_m * gas_f_H2).sum() <= self.denseGasThres:
-                print ("Dense gas mass less than %.2f Msun.. Skipping %s" % (denseGasThres, galname ))
-                continue
+        return galName, zred
+
+    def prepare_snapshot(self, skip=(), savepath=None):
+        """
+
+        Sort the galaxies of the current snapshot by SFR, apply the selection criteria and read the snapshot fields needed to extract them.
+
+        Parameters
+        ----------
+        skip: container of str
+            galnames not to extract, e.g. already in the manifest
+
+        savepath: str or None
+            where plan_galaxies() writes its report
+
+        Returns
+        -------
+        accepted: list of int
+            galaxies passing the selection, see plan_galaxies()
+
+        todo: list of int
+            accepted galaxies not in skip
+
+        snapFields: tuple or None
+            (gasFields, starFields, bhFields, gsel, ssel) from load_snap_fields(); None with outOfCoreGB
+
+        """
+
+        # sort by SFR
+        self.obj.galaxies.sort(key=lambda x: x.sfr, reverse=True)
+
+        if self.selectiveRead or self.outOfCoreGB is not None:
+            # cut on gas mass, SFR and fH2 first, then read all fields of the galaxies still to extract only
+            accepted = self.plan_galaxies(savepath=savepath)
+        else:
+            snapFields = self.load_snap_fields()
+            accepted = self.plan_galaxies(snapFields[0], snapFields[3], savepath=savepath)
+
+        todo = [gg for gg in accepted if self.def_galname(gg, self.obj.galaxies[gg]) not in skip]
+
+        if self.outOfCoreGB is not None:
+            # read batch by batch, see stream_batches()
+            snapFields = None
+        elif self.selectiveRead:
+            snapFields = self.load_snap_fields(todo)
+
+        return accepted, todo, snapFields
+
+
+    def stream_galaxies(self, todo, gasFields, starFields, bhFields, gsel, ssel, savepath=None, emptyDM=True, caesarRotate=False, write=False):
+        """
+
+        Extract galaxies one after the other, serially or on the pool.
+
+        Yields
+        ------
+        gg: int
+            index of the galaxy in the SFR-sorted self.obj.galaxies
+
+        res: dict
+            extract_galaxy() result plus the catalog columns measured on the particles as 'props' (see galcatalog.EXTRACTED_COLUMNS) and the BH particles as 'bh' DataFrame; galaxies rejected by extract_galaxy() are left out
+
+        """
+
+        import pandas as pd
 
-            if len(gal.slist) < self.part_threshold or len(gal.glist) < self.part_threshold:
-                print("Too few star particles or gas particles, unlikely to be real galaxy or useful for our purpose. Skipping ", galname)
+        # all galaxies at once, before the per-galaxy extraction
+        gasFields, starFields = self.galaxy_frames(todo, gasFields, starFields, gsel, ssel, caesarRotate=caesarRotate)
+        gasFields = self.galaxy_derived_fields(todo, gasFields, gsel)
+        surfaceDensities = self.galaxy_surface_densities(todo, gasFields, gsel)
+        dmParticles = {} if emptyDM else self.galaxy_dm(todo, caesarRotate=caesarRotate, treeDir=savepath)
+
+        if self.nproc > 1:
+            results = self.extract_parallel(todo, gasFields, starFields, gsel, ssel, savepath, emptyDM, caesarRotate, write=write, surfaceDensities=surfaceDensities, dmParticles=dmParticles)
+        else:
+            results = (self.extract_galaxy(gg, self.obj.galaxies[gg], gasFields, starFields, gsel, ssel, savepath, emptyDM, caesarRotate, write=write, surfaceDensity=surfaceDensities[gg], dm=dmParticles.get(gg)) for gg in todo)
+
+        for gg, res in zip(todo, results):
+            if res is None:
                 continue
+            gal = self.obj.galaxies[gg]
+
+            # the caesar properties are added for all galaxies at once, see galcatalog.build_catalog()
+            bm, fedd = bh_properties(gal, bhFields['mdot'])
+            res['props'] = dict(zip(EXTRACTED_COLUMNS, [bm, fedd, res['SFRSD'], res['gasSD'], res['f_H2']]))
+            res['bh'] = pd.DataFrame(gather_galaxy_fields(bhFields, gal, ptype='bh'))
+            yield gg, res
+
+
+    def galaxy_frames(self, todo, gasFields, starFields, gsel, ssel, caesarRotate=False, dtype=np.float64):
+        """
+
+        Move the gas and star particles of the galaxies in todo into the frame of their galaxy, for all galaxies at once: positions relative to gal.pos (gas also in physical kpc) and, with caesarRotate, positions and velocities rotated face-on by the caesar rotation_angles, see rotation.py.
+
+        Parameters
+        ----------
+        todo: list of int
+            indices into self.obj.galaxies
+
+        gasFields, starFields, gsel, ssel:
+            from load_snap_fields(); not modified
+
+        caesarRotate: bool
+
+        dtype: numpy dtype
+            of the rotated positions and velocities; np.float32 keeps the memory of the snapshot arrays
 
-            star_m = group_part_by_galaxy(star_p_m, gal, ptype='star')
-            star_pos = group_part_by_galaxy(star_pos_p, gal, ptype='star')
-            star_pos -= loc.d
-            star_vel = group_part_by_galaxy(star_vel_p, gal, ptype='star')
+        Returns
+        -------
+        gasFields, starFields: dict
+            as given, with 'pos' and 'vel' replaced by copies in which the rows of the particles of todo are transformed
+
+        """
 
+        galaxies = [self.obj.galaxies[gg] for gg in todo]
+        loc = np.array([gal.pos.d for gal in galaxies], dtype=np.float64).reshape(-1, 3)    # ckpc
+        alpha = np.array([np.float64(gal.rotation_angles['ALPHA']) for gal in galaxies]) if caesarRotate else None
+        beta = np.array([np.float64(gal.rotation_angles['BETA']) for gal in galaxies]) if caesarRotate else None
+
+        frames = []
+        for ptype, fields, sel in (('gas', gasFields, gsel), ('star', starFields, ssel)):
+            sub, members = self.galaxy_members(todo, ptype, sel)
+
+            pos = fields['pos'][members]
+            pos -= np.repeat(loc, sub.counts, axis=0)     # both are in comoving
+            if ptype == 'gas':
+                pos /= (1+self.redshift)   # physical kpc
+            fields = dict(fields)
             if caesarRotate:
-                star_pos = caesar.utils.rotator(star_pos.astype('float64'),
-                                   np.float64(gal.rotation_angles['ALPHA']),
-                                   np.float64(gal.rotation_angles['BETA']))
-
-                star_vel = caesar.utils.rotator(star_vel.astype('float64'),
-                                    np.float64(gal.rotation_angles['ALPHA']),
-                                    np.float64(gal.rotation_angles['BETA']))
-            star_x = star_pos[:, 0]
-            star_y = star_pos[:, 1]
-            star_z = star_pos[:, 2]
-
-            star_vx = star_vel[:,0]
-            star_vy = star_vel[:,1]
-            star_vz = star_vel[:,2]
-
-            star_Z =  group_part_by_galaxy(pmetarray, gal, ptype='star')
-
-            # derive stellar age
-            star_a = group_part_by_galaxy(sage, gal, ptype='star')
-            current_time = self.obj.simulation.time.in_units("Myr")
-            # in scale factors, do as with Illustris
-            star_formation_z = 1. / star_a - 1
-            # Code from yt project (yt.utilities.cosmology)
-            star_formation_t = 2.0 / 3.0 / np.sqrt(1 - self.obj.simulation.omega_matter) * np.arcsinh(np.sqrt(
-                (1 - self.obj.simulation.omega_matter) / self.obj.simulation.omega_matter) / np.power(1 + star_formation_z, 1.5)) / (self.h)  # Mpc*s/(100*km)
-            star_formation_t *=  self.kpc2m / 100. / (1e6 * 365.25 * 86400)  # Myr
-            star_age = current_time.d - star_formation_t
-
-            # create empty DM data
-            if emptyDM:
-                dm_m = 0.0
-
-                dm_posx = np.array([0.0])
-                dm_posy = np.array([0.0])
-                dm_posz = np.array([0.0])
-
-                dm_velx = np.array([0.0])
-                dm_vely = np.array([0.0])
-                dm_velz = np.array([0.0])
+                fields['pos'] = fields['pos'].astype(dtype)
+                fields['pos'][members] = rotate_segments(pos, sub.offsets, alpha, beta, dtype=dtype)
+                vel = fields['vel'][members]
+                fields['vel'] = fields['vel'].astype(dtype)
+                fields['vel'][members] = rotate_segments(vel, sub.offsets, alpha, beta, dtype=dtype)
             else:
-                # because caesar output dones't have a dmlist and since we don't really need it
-                raise NotImplementedError
-
-            # create pandas DF
-            simgas_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + '_' + \
-                           galname + '_sim.gas'
-            simstar_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + \
-                           '_' + galname + '_sim.star'
-            simdm_path = (savepath + 'z{:.2f}').format(float(self.redshift)) + \
-                          '_' + galname + '_sim.dm'
-
-            # SFRSD and gasSD within half mass radius of gas
-            _SFRSD = calc_SFRSD_inside_half_mass(gal, gas_SFR, gas_m, gas_pos)
-            _gasSD = calc_gasSD_inside_half_mass(gal, gas_m, gas_pos)
-
-            simgas = pd.DataFrame({'x': gas_x, 'y': gas_y, 'z': gas_z,
-                                   'vx': gas_vx, 'vy': gas_vy, 'vz': gas_vz,
-                                   'SFR': gas_SFR,
-                                   'SFRsd_halfM': _SFRSD,     # will be same for all particles in a galaxy; used for sigame.galaxy.interpolate_dif()
-                                   'gasSD_halfM': _gasSD,
-                                   'Z': gas_Z,
-                                   'nH': gas_densities,
-                                   'Tk': gas_Tk, 'h': gas_h,
-                                   'f_HI1': gas_f_HI,    # atomic and molecular H
-                                   'f_neu': gas_f_neu,   # atomic H
-                                   'f_H21': gas_f_H2, 'm': gas_m,
-                                   'a_He': gas_Z_1, 'a_C': gas_Z_2,
-                                   'a_N': gas_Z_3, 'a_O': gas_Z_4,
-                                   'a_Ne': gas_Z_5, 'a_Mg': gas_Z_6,
-                                    'a_Si': gas_Z_7, 'a_S': gas_Z_8,
-                                    'a_Ca': gas_Z_9, 'a_Fe': gas_Z_10})
-
-            simstar = pd.DataFrame({'x': star_x, 'y': star_y, 'z': star_z,
-                                    'vx': star_vx, 'vy': star_vy, 'vz': star_vz,
-                                    'Z': star_Z, 'm': star_m, 'age': star_age})
-
-            # create fake DM dataframe to trick Sigame
-            simdm = pd.DataFrame({'x': dm_posx, 'y': dm_posy, 'z': dm_posz,
-                                  'vx': dm_velx, 'vy': dm_vely, 'vz': dm_velz,
-                                  'm': dm_m})
-
-            # from parse_simba import center_cut_galaxy
-            # simgas, simstar, simdm = center_cut_galaxy(simgas, simstar, simdm, plot=False)
-            # import pdb; pdb.set_trace()
-
-            simgas.to_pickle(simgas_path)
-            simstar.to_pickle(simstar_path)
-            simdm.to_pickle(simdm_path)
-
-            galName.append(galname)
-            zred.append(self.redshift)
-
-            # link galname to galaxy properties from caesar
-            if gg == 0:
-                groupID = []
-                galnames = []
-                mstar = []
-                mgas = []
-                mbh = []
-                fedd_array = []
-                sfr = []
-                sfrsd = []
-                sfrsd_manual = []
-                gassd = []
-                gassd_manual = []
-                gasR = []
-                gasR_half = []
-                starR_half = []
-                Zgas = []
-                Zstar = []
-                fgas = []
-                fh2 = []
-                gdr = []
-                central = []
-                mhalo = []
-                hid = []
-
-            groupID, galnames, mstar, mgas, mbh, fedd_array, sfr, sfrsd, sfrsd_manual, gassd, gassd_manual, gasR, gasR_half, starR_half, Zgas, Zstar, fgas, fh2, gdr, central, mhalo, hid = link_caesarGalProp_galname(gal, galname, gg, groupID, galnames, mstar, mgas, mbh, fedd_array, sfr, sfrsd, sfrsd_manual, gassd, gassd_manual, gasR, gasR_half, starR_half, Zgas, Zstar, fgas, fh2, gdr, central, mhalo, hid, _SFRSD, _gasSD, np.sum(gas_f_H2 * gas_m)/np.sum(gas_m), bhmdot)
-
-        # link galname to galaxy properties from caesar
-        gal_prop = dict.fromkeys(['GroupID', 'galnames', 'Mstar', 'Mgas', 'MBH', 'fedd', 'SFR', 'SFRSD_gasR_caesar', 'SFRSD_gasR_manual', 'gasSD_caesar', 'gasSD_manual', 'r_gas', 'r_gas_half_mass', 'r_stellar_half_mass', 'Zsfr', 'Zstellar', 'fgas', 'f_H2_fromSnap', 'DGR', 'Central', 'Mhalo_parent', 'HID'])
-
-        gal_prop['GroupID'] = groupID
-        gal_prop['galnames'] = galnames
-        gal_prop['Mstar'] = mstar
-        gal_prop['Mgas'] = mgas
-        gal_prop['MBH'] = mbh
-        gal_prop['fedd'] = fedd_array
-        gal_prop['SFR'] = sfr
-        gal_prop['SFRSD_gasR_caesar'] = sfrsd
-        gal_prop['SFRSD_gasR_manual'] = sfrsd_manual
-        gal_prop['gasSD_caesar'] = gassd
-        gal_prop['gasSD_manual']= gassd_manual
-        gal_prop['r_gas'] = gasR
-        gal_prop['r_gas_half_mass'] = gasR_half
-        gal_prop['r_stellar_half_mass'] = starR_half
-        gal_prop['Zsfr'] = Zgas
-        gal_prop['Zstellar'] = Zstar
-        gal_prop['fgas'] = fgas
-        gal_prop['f_H2_fromSnap'] = fh2
-        gal_prop['DGR'] = gdr
-        gal_prop['Central'] = central
-        gal_prop['Mhalo_parent'] = mhalo
-        gal_prop['HID'] = hid
-
-        gal_prop = pd.DataFrame(gal_prop)
-        gal_prop.to_pickle(savepath + 'gal_catalog.pkl')
+                fields['pos'] = fields['pos'].copy()
+                fields['pos'][members] = pos
+            frames.append(fields)
 
-        return galName, zred
+        return frames[0], frames[1]
+
+
+    def galaxy_derived_fields(self, todo, gasFields, gsel):
+        """
+
+        Gas fields that depend on the whole galaxy, for the members of all galaxies in todo at once: the ionized fraction f_ion = ne / max(ne), the maximum taken over each galaxy, and f_HI = 1 - f_ion.
+
+        Returns
+        -------
+        gasFields: dict
+            as given plus 'f_ion' and 'f_HI', filled at the rows of the particles of todo; gathered with the other fields by extract_galaxy()
+
+        """
+
+        sub, members = self.galaxy_members(todo, 'gas', gsel)
+
+        x_e = gasFields['ne'][members]
+        x_e_max = segment_reduce(np.maximum, x_e, sub.offsets, empty=0)
+
+        f_ion = np.zeros_like(gasFields['ne'])
+        f_ion[members] = x_e / np.repeat(x_e_max, sub.counts)
+        gasFields = dict(gasFields)
+        gasFields['f_ion'] = f_ion
+        gasFields['f_HI'] = 1 - f_ion
+        return gasFields
+
+
+    def galaxy_surface_densities(self, todo, gasFields, gsel, projection=None):
+        """
+
+        SFR and gas mass surface densities inside the gas radius and the gas half mass radius of the galaxies in todo, for all galaxies at once, see aperture.surface_densities().
+
+        Parameters
+        ----------
+        todo: list of int
+            indices into self.obj.galaxies
+
+        gasFields, gsel:
+            from load_snap_fields(), with positions in the galaxy frame, see galaxy_frames()
+
+        projection: int or None
+            None for spheres, 2 for circles face-on (with caesarRotate)
+
+        Returns
+        -------
+        surfaceDensities: dict
+            gg --> (SFRSD [Msun/yr/kpc^2], gasSD [Msun/pc^2])
+
+        """
+
+        galaxies = [self.obj.galaxies[gg] for gg in todo]
+        sub, members = self.galaxy_members(todo, 'gas', gsel)
+
+        SFRSD, gasSD = surface_densities(galaxies, gasFields['pos'][members], sub.offsets,
+                                         gasFields['SFR'][members], gasFields['m'][members], projection=projection)
+        return dict(zip(todo, zip(SFRSD, gasSD)))
+
+
+    def galaxy_dm(self, todo, caesarRotate=False, dtype=np.float64, treeDir=None):
+        """
+
+        DM particles around the galaxies in todo, for all galaxies at once. Caesar has no DM member list, so the particles within gal.radii['total'] of gal.pos are found with one batched query of a periodic KD-tree (see spatialindex.py), and only those are read.
+
+        Parameters
+        ----------
+        todo: list of int
+            indices into self.obj.galaxies
+
+        caesarRotate: bool
+            rotate positions and velocities face-on, as in galaxy_frames()
+
+        dtype: numpy dtype
+            of the rotated positions and velocities
+
+        treeDir: str or None
+            where the tree of all DM particles is pickled, see particle_tree()
+
+        By default the first call for a snapshot reads the positions of all DM particles and builds a tree of the box, about 38 bytes per DM particle (40 GB for m100n1024), counted by estimate_snapshot_memory(). With selectiveRead or outOfCoreGB, the DM positions are read chunkMB at a time instead and the tree only holds the particles near the galaxies of todo (see build_region_tree()); it is built for each call and not saved.
+
+        Returns
+        -------
+        dmParticles: dict
+            gg --> {'m': Msun, 'pos': ckpc relative to gal.pos (nearest periodic image), 'vel': km/s}; empty if todo is, without loading the tree
+
+        """
+
+        from galcatalog import strip_units
+
+        if len(todo) == 0:
+            # e.g. resuming a snapshot whose galaxies are all extracted
+            return {}
+
+        galaxies = [self.obj.galaxies[gg] for gg in todo]
+        loc = np.array([gal.pos.d for gal in galaxies], dtype=np.float64).reshape(-1, 3)    # ckpc
+        radii = strip_units([gal.radii['total'] for gal in galaxies], 'kpccm')
+
+        # the tree is in code units, ckpc/h
+        if self.selectiveRead or self.outOfCoreGB is not None:
+            tree = build_region_tree(self.snapFile, 'dm', loc * self.h, radii * self.h, chunkbytes=self.chunkMB * 1.e6)
+        else:
+            tree = self.particle_tree('dm', treeDir)
+        sub = tree.query_balls(loc * self.h, radii * self.h)
+        sel = np.unique(sub.members)
+        print("Reading {:} DM particles around {:} galaxies".format(len(sel), len(todo)))
+        snapFields = readsnap_fields(self.snapFile, [('dm', 'mass'), ('dm', 'pos'), ('dm', 'vel')], units=1, index={'dm': sel})
+
+        rows = local_index(sel, sub.members)
+        m = snapFields[('dm', 'mass')][rows]/self.h     # Msun
+        pos = periodic_offsets(snapFields[('dm', 'pos')][rows]/self.h, np.repeat(loc, sub.counts, axis=0), tree.boxsize/self.h)   # ckpc
+        vel = snapFields[('dm', 'vel')][rows]    # km/s
+        del snapFields
+
+        if caesarRotate:
+            alpha = np.array([np.float64(gal.rotation_angles['ALPHA']) for gal in galaxies])
+            beta = np.array([np.float64(gal.rotation_angles['BETA']) for gal in galaxies])
+            pos = rotate_segments(pos, sub.offsets, alpha, beta, dtype=dtype)
+            vel = rotate_segments(vel, sub.offsets, alpha, beta, dtype=dtype)
+
+        offsets = sub.offsets
+        return {gg: {'m': m[offsets[i]:offsets[i+1]], 'pos': pos[offsets[i]:offsets[i+1]], 'vel': vel[offsets[i]:offsets[i+1]]}
+                for i, gg in enumerate(todo)}
+
+
+    def stream_batches(self, todo, savepath=None, emptyDM=True, caesarRotate=False, write=False):
+        """
+
+        stream_galaxies() for outOfCoreGB: the galaxies are split into batches (see galaxy_batches()) and only the fields of one batch are in memory at a time.
+
+        Batches are consecutive in todo, so galaxies come out in the same order as from stream_galaxies(). Finished galaxies waiting for the writers count against writeBufferMB, not outOfCoreGB.
+
+        """
+
+        rows = np.array([self.obj.galaxies[gg].GroupID for gg in todo], dtype=np.int64)
+        batches = self.galaxy_batches(rows, self.snap_requests)
+        print("Extracting {:} galaxies in {:} batches of at most {:} GB".format(len(todo), len(batches), self.outOfCoreGB))
+
+        for pos in batches:
+            batch = [todo[i] for i in pos]
+            snapFields = self.load_snap_fields(batch)
+            for item in self.stream_galaxies(batch, *snapFields, savepath=savepath, emptyDM=emptyDM, caesarRotate=caesarRotate, write=write):
+                yield item
+            del snapFields
+
+
+    def iter_galaxies(self, emptyDM=True, caesarRotate=False):
+        """
+
+        Extract the accepted galaxies of the current snapshot (see load_obj_snap()) without writing anything.
+
+        Parameters
+        ----------
+        emptyDM, caesarRotate:
+            see main_proc()
+
+        Yields
+        ------
+        galname: str
+
+        row: dict
+            catalog row, keyed as the columns of gal_catalog, see galcatalog.build_catalog()
+
+        gas, star, bh: DataFrame
+            same columns as the .gas and .star pickles; bh holds 'm' [Msun] and 'mdot' [Msun/yr] of the BH particles
+
+        Example
+        -------
+        >>> pp.load_obj_snap(0)
+        >>> for galname, row, gas, star, bh in pp.iter_galaxies():
+        ...     xyz = np.average(gas[['x', 'y', 'z']], weights=gas['m'], axis=0)
+
+        """
+
+        accepted, todo, snapFields = self.prepare_snapshot()
+        if snapFields is None:
+            stream = self.stream_batches(todo, emptyDM=emptyDM, caesarRotate=caesarRotate)
+        else:
+            stream = self.stream_galaxies(todo, *snapFields, emptyDM=emptyDM, caesarRotate=caesarRotate)
+        del snapFields
+        for gg, res in stream:
+            frames = res['frames']
+            row = build_catalog([self.obj.galaxies[gg]], [res['galname']], {k: [v] for k, v in res['props'].items()}).iloc[0].to_dict()
+            yield res['galname'], row, frames['gas'], frames['star'], res['bh']
+
+
+    def save_galaxy(self, gg, res, manifest, store, done):
+        """
+
+        Write the DataFrames of an extracted galaxy, if extract_galaxy() didn't, and commit it with its catalog columns to the manifest. Runs on the writer threads unless nwriter is 0.
+
+        Parameters
+        ----------
+        gg: int
+            index of the galaxy in the SFR-sorted self.obj.galaxies
+
+        res: dict
+            from stream_galaxies()
+
+        manifest: ExtractionManifest
+
+        store: GalaxyStore or None
+
+        done: dict
+            galname --> manifest record, updated in place
+
+        """
+
+        gal = self.obj.galaxies[gg]
+        galname = res['galname']
+
+        frames = res.pop('frames', None)
+        if frames is not None:
+            if store is not None:
+                store.append(galname, frames)
+            else:
+                for path, ptype in zip(res['paths'], ['gas', 'star', 'dm']):
+                    atomic_to_pickle(frames[ptype], path)
+            del frames
+
+        record = {'galname': galname, 'gg': gg, 'redshift': self.redshift, 'paths': res['paths'],
+                  'props': res['props']}
+        manifest.commit(record)
+        done[galname] = record
+
+
+    def extract_galaxy(self, gg, gal, gasFields, starFields, gsel, ssel, savepath, emptyDM, caesarRotate, write=True, surfaceDensity=None, dm=None):
+        """
+
+        Apply the selection criteria to one galaxy and, if it passes, write its .gas, .star, .dm DataFrames.
+
+        Parameters
+        ----------
+        gg: int
+            index of gal in the SFR-sorted self.obj.galaxies
+
+        gal: caesar galaxy object
+
+        gasFields, starFields, gsel, ssel:
+            from load_snap_fields(), with positions and velocities in the galaxy frame, see galaxy_frames()
+
+        write: bool
+            write the .gas, .star, .dm pickles here; if False, they are returned as 'frames' for save_galaxy()
+
+        surfaceDensity: tuple or None
+            (SFRSD, gasSD) of the galaxy from galaxy_surface_densities(); computed from its particles if None
+
+        dm: dict or None
+            DM particles of the galaxy from galaxy_dm(), used if not emptyDM; queried for this galaxy alone if None
+
+        Returns
+        -------
+        res: dict or None
+            None if the galaxy is skipped, otherwise galname, SFRSD, gasSD and mass-weighted f_H2 for the catalog, and the paths of the files written. With outputFormat 'hdf5' or write=False nothing is written and the DataFrames are returned as 'frames' instead.
+
+        """
+
+        import pandas as pd
+
+        galname = self.def_galname(gg, gal)
+
+        if self.verbose:
+            print(galname)
+            print("SFR: {:.2f}".format(gal.sfr))
+
+        if len(gal.slist) < self.part_threshold or len(gal.glist) < self.part_threshold:
+            print("Too few star particles or gas particles, unlikely to be real galaxy or useful for our purpose. Skipping ", galname)
+            return None
+
+        gas = gather_galaxy_fields(gasFields, gal, ptype='gas', sel=gsel)
+        gas_m = gas['m']
+        gas_densities = gas['rho']
+
+        if self.debug:
+            print("from readsnap: ")
+            print(gas_densities.max(), gas_densities.min())    # g/cc
+            print("from YT sphere: ")
+            print(sim_gas['nH'].max(), sim_gas['nH'].min())
+            gas_nh = gas_densities*self.h*self.h*0.76/self.Mp
+            print(gas_nh.max(), gas_nh.min())      # 1/cc
+            import pdb; pdb.set_trace()
+
+        gas_Tk = gas['Tk']
+        gas_SFR = gas['SFR']
+        gas_Zs = gas['metals']/SolarAbundances
+        gas_Z = gas_Zs[:, 0]
+        gas_Z_1 = gas_Zs[:, 1]
+        gas_Z_2 = gas_Zs[:, 2]
+        gas_Z_3 = gas_Zs[:, 3]
+        gas_Z_4 = gas_Zs[:, 4]
+        gas_Z_5 = gas_Zs[:, 5]
+        gas_Z_6 = gas_Zs[:, 6]
+        gas_Z_7 = gas_Zs[:, 7]
+        gas_Z_8 = gas_Zs[:, 8]
+        gas_Z_9 = gas_Zs[:, 9]
+        gas_Z_10 = gas_Zs[:, 10]
+
+        # smoothing length
+        gas_h = gas['h']
+
+        # centered, physical kpc and rotated by galaxy_frames()
+        gas_pos = gas['pos']
+        gas_vel = gas['vel']
+
+        gas_x = gas_pos[:, 0]
+        gas_y = gas_pos[:, 1]
+        gas_z = gas_pos[:, 2]
+
+        gas_vx = gas_vel[:,0]
+        gas_vy = gas_vel[:,1]
+        gas_vz = gas_vel[:,2]
+
+        gas_f_H2 = gas['fH2']
+        gas_f_neu = gas['nh']   # f_neu
+
+        if self.debug:
+            print("HI fraction")
+            print(gas_f_neu.min(), gas_f_neu.max())    # following RD's def.
+            print((1-gas_f_H2).min(), (1-gas_f_H2).max())
+            print((gas_f_neu/(1-gas_f_H2)).min())
+            print((gas_f_neu/(1-gas_f_H2)).max())
+
+        # neutral gas from 1- ionized gas
+        # ionized fraction relative to the galaxy's maximum, see galaxy_derived_fields()
+        if 'f_ion' in gas:
+            gas_f_ion = gas['f_ion']
+            gas_f_HI = gas['f_HI']
+        else:
+            gas_x_e = gas['ne']   # relative to nH
+            gas_f_ion = gas_x_e / gas_x_e.max()
+            gas_f_HI = 1 - gas_f_ion
+        assert abs(gas_f_HI.all()) <= 1.0
+
+        if self.debug:
+            print(gas_f_HI >= gas_f_neu)     # former incl. also molecular
+            print((gas_f_HI >= gas_f_neu).all())   # expecting True
+            import pdb; pdb.set_trace()
+
+        if self.debug:
+            print('\nChecking molecular gas mass fraction from simulation:')
+            print('%.3s %% \n' % (np.sum(gas_m * gas_f_H2) / np.sum(gas_m) * 100.))
+            #
+            print("gas mass from snapshot: {:.2f} [x1e8 Msun]".format(gas_m.sum()/1.e8))
+            print("gas mass from 'gas' from caesar {:.2f} [x1e8 Msun]".format(gal.masses['gas']/1.e8))
+            #
+            print('gas mass from (HI + H2) from caesar {:.2f} [x1e8 Msun]'.format((gal.masses['HI'] + gal.masses['H2'])/1.e8))
+            print('')
+            print("gas fraction from caesar: {:.2f}".format(gal.gas_fraction))
+            print('gas fraction from Mgas/(Mgas+Mstar): {:.2f} '.format(gal.masses['gas']/(gal.masses['gas'] + gal.masses['stellar'])))
+            print('gas fraction from MHI + MH2 /(MHI + MH2 + Mstar): {:.2f}'.format((gal.masses['HI'] + gal.masses['H2']) / (gal.masses['HI'] + gal.masses['H2'] + gal.masses['stellar'])))
+            #
+            print(gal.masses['HI'], np.sum(gas_f_neu * gas_m))
+            import pdb; pdb.set_trace()
+
+        # selection crit.
+        if gas_SFR.sum() <= self.sfr_threshold:
+            print("SFR too low.. Skipping ", galname)
+            return None
+
+        if (gas_m * gas_f_H2).sum() <= self.denseGasThres:
+            print ("Dense gas mass less than %.2f Msun.. Skipping %s" % (self.denseGasThres, galname ))
+            return None
+
+        if len(gal.slist) < self.part_threshold or len(gal.glist) < self.part_threshold:
+            print("Too few star particles or gas particles, unlikely to be real galaxy or useful for our purpose. Skipping ", galname)
+            return None
+
+        star = gather_galaxy_fields(starFields, gal, ptype='star', sel=ssel)
+        star_m = star['m']
+        star_pos = star['pos']
+        star_vel = star['vel']
+
+        star_x = star_pos[:, 0]
+        star_y = star_pos[:, 1]
+        star_z = star_pos[:, 2]
+
+        star_vx = star_vel[:,0]
+        star_vy = star_vel[:,1]
+        star_vz = star_vel[:,2]
+
+        star_Z = star['Z']
+
+        # Myr, see load_snap_fields()
+        star_age = star['age']
+
+        # create empty DM data
+        if emptyDM:
+            dm_m = 0.0
+
+            dm_posx = np.array([0.0])
+            dm_posy = np.array([0.0])
+            dm_posz = np.array([0.0])
+
+            dm_velx = np.array([0.0])
+            dm_vely = np.array([0.0])
+            dm_velz = np.array([0.0])
+        else:
+            # caesar output doesn't have a dmlist, see galaxy_dm()
+            if dm is None:
+                dm = self.galaxy_dm([gg], caesarRotate=caesarRotate, treeDir=savepath)[gg]
+            dm_m = dm['m']
+
+            dm_posx = dm['pos'][:, 0]
+            dm_posy = dm['pos'][:, 1]
+            dm_posz = dm['pos'][:, 2]
+
+            dm_velx = dm['vel'][:, 0]
+            dm_vely = dm['vel'][:, 1]
+            dm_velz = dm['vel'][:, 2]
+
+        # create pandas DF
+        # SFRSD and gasSD within half mass radius of gas
+        if surfaceDensity is None:
+            surfaceDensity = surface_densities([gal], gas_pos, [0, len(gas_m)], gas_SFR, gas_m)
+        # galaxy-level, float64 in the catalog; the dtype of the particle columns is up to outputSchema
+        _SFRSD = float(np.squeeze(surfaceDensity[0]))
+        _gasSD = float(np.squeeze(surfaceDensity[1]))
+
+        simgas = pd.DataFrame({'x': gas_x, 'y': gas_y, 'z': gas_z,
+                               'vx': gas_vx, 'vy': gas_vy, 'vz': gas_vz,
+                               'SFR': gas_SFR,
+                               'SFRsd_halfM': _SFRSD,     # will be same for all particles in a galaxy; used for sigame.galaxy.interpolate_dif()
+                               'gasSD_halfM': _gasSD,
+                               'Z': gas_Z,
+                               'nH': gas_densities,
+                               'Tk': gas_Tk, 'h': gas_h,
+                               'f_HI1': gas_f_HI,    # atomic and molecular H
+                               'f_neu': gas_f_neu,   # atomic H
+                               'f_H21': gas_f_H2, 'm': gas_m,
+                               'a_He': gas_Z_1, 'a_C': gas_Z_2,
+                               'a_N': gas_Z_3, 'a_O': gas_Z_4,
+                               'a_Ne': gas_Z_5, 'a_Mg': gas_Z_6,
+                                'a_Si': gas_Z_7, 'a_S': gas_Z_8,
+                                'a_Ca': gas_Z_9, 'a_Fe': gas_Z_10})
+
+        simstar = pd.DataFrame({'x': star_x, 'y': star_y, 'z': star_z,
+                                'vx': star_vx, 'vy': star_vy, 'vz': star_vz,
+                                'Z': star_Z, 'm': star_m, 'age': star_age})
+
+        # create fake DM dataframe to trick Sigame
+        simdm = pd.DataFrame({'x': dm_posx, 'y': dm_posy, 'z': dm_posz,
+                              'vx': dm_velx, 'vy': dm_vely, 'vz': dm_velz,
+                              'm': dm_m})
+
+        # from parse_simba import center_cut_galaxy
+        # simgas, simstar, simdm = center_cut_galaxy(simgas, simstar, simdm, plot=False)
+        # import pdb; pdb.set_trace()
+
+        if self.outputSchema == 'compact':
+            frames = cast_frames({'gas': simgas, 'star': simstar, 'dm': simdm})
+            simgas, simstar, simdm = frames['gas'], frames['star'], frames['dm']
+
+        res = {'galname': galname, 'SFRSD': _SFRSD, 'gasSD': _gasSD,
+               'f_H2': np.sum(gas_f_H2 * gas_m)/np.sum(gas_m)}
+
+        res['paths'] = []
+        if self.outputFormat == 'pickle' and savepath is not None:
+            res['paths'] = self.def_galFileNames(savepath, galname)
+        if not write or self.outputFormat == 'hdf5':
+            # written by save_galaxy(), to the snapshot's GalaxyStore with outputFormat 'hdf5'
+            res['frames'] = {'gas': simgas, 'star': simstar, 'dm': simdm}
+            return res
+
+        simgas_path, simstar_path, simdm_path = res['paths']
+        atomic_to_pickle(simgas, simgas_path)
+        atomic_to_pickle(simstar, simstar_path)
+        atomic_to_pickle(simdm, simdm_path)
+        return res
+
+    def extract_parallel(self, accepted, gasFields, starFields, gsel, ssel, savepath, emptyDM, caesarRotate, write=True, surfaceDensities=None, dmParticles=None):
+        """
+
+        Run extract_galaxy() for the accepted galaxies on self.nproc worker processes.
+
+        The snapshot arrays are copied once into multiprocessing.shared_memory and the workers are forked afterwards, so they all map the same physical memory and nothing is pickled except galaxy indices and the small per-galaxy results.
+
+        Yields
+        ------
+        res: dict or None
+            extract_galaxy() result of each galaxy, in the order of accepted, as soon as it is ready
+
+        """
+
+        import multiprocessing as mp
+
+        arrays = {'gas_' + k: v for k, v in gasFields.items()}
+        arrays.update({'star_' + k: v for k, v in starFields.items()})
+        if gsel is not None:
+            arrays['gsel'] = gsel
+            arrays['ssel'] = ssel
+        blocks, shared = share_arrays(arrays)
+        del arrays
+
+        gasShared = {k: shared['gas_' + k] for k in gasFields}
+        starShared = {k: shared['star_' + k] for k in starFields}
+        del gasFields, starFields
+
+        ctx = mp.get_context('fork')
+        ngal = len(accepted)
+        chunksize = max(1, min(64, ngal // (4 * self.nproc)))
+        try:
+            with ctx.Pool(self.nproc, initializer=_init_extract_worker,
+                          initargs=(self, gasShared, starShared, shared.get('gsel'), shared.get('ssel'), savepath, emptyDM, caesarRotate, write, surfaceDensities or {}, dmParticles or {})) as pool:
+                for res in pool.imap(_extract_worker, accepted, chunksize=chunksize):
+                    yield res
+        finally:
+            del gasShared, starShared, shared
+            free_shared_arrays(blocks)
 
 
 def calc_SFRSD_inside_half_mass(galObj, gas_SFR, gas_m, gas_pos, halfMassR='gas'):
     """
-    Calculate the SFR surface density inside the half light radius.
+    Calculate the SFR surface density inside the half light radius of one galaxy; aperture.surface_densities() does this for many galaxies at once.
 
     Parameters
     ----------
@@ -686,27 +1813,18 @@ def calc_SFRSD_inside_half_mass(galObj, gas_SFR, gas_m, gas_pos, halfMassR='gas'
 
     """
 
-    if halfMassR == 'gas':
-        half_mass_radius = galObj.radii['gas'].in_units('kpc')
-    elif halfMassR == 'stars':
-        half_mass_radius = galObj.radii['stellar_half_mass'].in_units('kpc')
-
-    extent = np.sqrt(gas_pos[:, 0]**2 + gas_pos[:, 1]**2 + gas_pos[:, 2]**2)
-    print(extent.shape)
-    mask = extent <= half_mass_radius
-    print("SFR inner: {:.2f}".format(np.sum(gas_SFR[mask])))
-    print("SFR global: {:.2f}".format(galObj.sfr))
-    #
-    SFRSD = np.sum(gas_SFR[mask]) / np.pi/half_mass_radius**2
-    print("SFRSD: {:.2f}".format(SFRSD))
-    print(galObj.sfr / np.pi / half_mass_radius**2)
+    from aperture import galaxy_radii, aperture_sums
+
+    half_mass_radius = galaxy_radii([galObj], names=['gas' if halfMassR == 'gas' else 'stellar_half_mass'])[0, 0]
+    inner = aperture_sums(gas_pos, [0, len(gas_SFR)], [half_mass_radius], {'SFR': gas_SFR})['SFR'][0]
+    SFRSD = inner / np.pi/half_mass_radius**2
     return SFRSD
 
 
 def calc_gasSD_inside_half_mass(galObj, gas_m, gas_pos, halfMassR='gas'):
 
     """
-    Calculate the gas mass surface density inside the half light radius.
+    Calculate the gas mass surface density inside the half light radius of one galaxy; aperture.surface_densities() does this for many galaxies at once.
 
     Parameters
     ----------
@@ -728,17 +1846,11 @@ def calc_gasSD_inside_half_mass(galObj, gas_m, gas_pos, halfMassR='gas'):
         [Msun/pc^2]
 
     """
-    if halfMassR == 'gas':
-        half_mass_radius = galObj.radii['gas_half_mass'].in_units('kpc')
-    elif halfMassR == 'stars':
-        half_mass_radius = galObj.radii['stellar_half_mass'].in_units('kpc')
-
-    extent = np.sqrt(gas_pos[:, 0]**2 + gas_pos[:, 1]**2 + gas_pos[:, 2]**2)
-    mask = extent <= half_mass_radius
-    gasSD = np.sum(gas_m[mask])/np.pi/(half_mass_radius*1.e3)**2
-    print("gas SD: ")
-    print(gasSD)
-    print(galObj.masses['gas'] / np.pi / (half_mass_radius*1.e3)**2)
+    from aperture import galaxy_radii, aperture_sums
+
+    half_mass_radius = galaxy_radii([galObj], names=['gas_half_mass' if halfMassR == 'gas' else 'stellar_half_mass'])[0, 0]
+    inner = aperture_sums(gas_pos, [0, len(gas_m)], [half_mass_radius], {'m': gas_m})['m'][0]
+    gasSD = inner/np.pi/(half_mass_radius*1.e3)**2
     return gasSD
 
 
@@ -781,23 +1893,7 @@ def link_caesarGalProp_galname(galObj, galname, index, groupID, galnames, mstar,
     if galObj.halo is not None:
         phm, phid = galObj.halo.masses['total'], galObj.halo.GroupID
 
-    try:
-        bhmdots = [bhmdot[k] for k in galObj.bhlist]
-        bm = galObj.masses['bh']
-        imax = np.argmax(bm)
-        try:
-            bm = bm[imax]
-            bmdot = bhmdots[imax]        # only the massive BH particle matters.
-        except:
-            bm = bm
-            bmdot = bhmdots
-
-        mdot_edd = 4*np.pi*6.67e-8*1.673e-24/(frad*3.e10*6.65245e-25) * bm * 3.155e7 # in Mo/yr
-        fedd = bmdot / mdot_edd
-        fedd = fedd[0].value
-    except:
-        bm = 0
-        fedd = 0
+    bm, fedd = bh_properties(galObj, bhmdot, frad=frad)
 
     groupID.append(galObj.GroupID)
     galnames.append(galname)